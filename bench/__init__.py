@@ -0,0 +1 @@
+"""Retrieval benchmark suite (see `bench/run.py`)."""
@@ -0,0 +1,137 @@
+"""Synthetic corpus with known relevant chunks, plus an offline hashing encoder.
+
+Each document mixes filler sentences drawn from a shared vocabulary with "fact"
+sentences made of words that occur nowhere else in the corpus. Every fact yields one
+query (a shuffled subset of its words); a chunk is relevant to the query when it
+contains any of the fact's words, so relevance survives any chunking configuration.
+
+Usage:
+    from bench.corpus import make_corpus, HashingEncoder
+    queries = make_corpus("bench/out/corpus", n_docs=200)
+"""
+
+import hashlib
+import json
+import random
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "qu", "dor", "fen", "gil", "hax", "jub"]
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def _words(rng: random.Random, n: int, taken: Set[str], syllables: Tuple[int, int]) -> List[str]:
+    out = []
+    while len(out) < n:
+        word = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(*syllables)))
+        if word not in taken:
+            taken.add(word)
+            out.append(word)
+    return out
+
+
+def make_corpus(
+    out_dir,
+    n_docs: int = 200,
+    doc_chars: int = 3000,
+    facts_per_doc: int = 2,
+    fact_words: int = 6,
+    query_words: int = 4,
+    vocab_size: int = 500,
+    seed: int = 0,
+) -> List[Dict]:
+    """Write `n_docs` text files under `out_dir/docs` and `out_dir/queries.jsonl`.
+
+    Returns:
+        The queries: dicts with `id`, `question`, `source` and the fact's `words`.
+    """
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    docs_dir = out_dir / "docs"
+    docs_dir.mkdir(parents=True, exist_ok=True)
+    taken = set()
+    vocab = _words(rng, vocab_size, taken, (1, 3))
+
+    queries = []
+    for d in range(n_docs):
+        path = docs_dir / f"doc_{d:05d}.txt"
+        sentences = []
+        size = 0
+        while size < doc_chars:
+            sentence = " ".join(rng.choice(vocab) for _ in range(rng.randint(8, 14))).capitalize() + "."
+            sentences.append(sentence)
+            size += len(sentence) + 1
+        for _ in range(facts_per_doc):
+            words = _words(rng, fact_words, taken, (4, 5))
+            sentences.insert(rng.randrange(len(sentences) + 1), " ".join(words).capitalize() + ".")
+            question = rng.sample(words, query_words)
+            queries.append({"id": f"q{len(queries)}", "question": " ".join(question), "source": str(path), "words": words})
+        path.write_text(" ".join(sentences), encoding="utf-8")
+
+    with open(out_dir / "queries.jsonl", "w", encoding="utf-8") as f:
+        for q in queries:
+            f.write(json.dumps(q) + "\n")
+    return queries
+
+
+def relevant_ids(records: Iterable[Tuple[int, Dict]], queries: List[Dict]) -> List[Set[int]]:
+    """Map each query to the chunk ids (from `store.iter_records()`) containing one of its fact words."""
+    owner = {word: qi for qi, q in enumerate(queries) for word in q["words"]}
+    relevant = [set() for _ in queries]
+    for chunk_id, record in records:
+        for word in set(_WORD_RE.findall(record["text"].lower())):
+            qi = owner.get(word)
+            if qi is not None:
+                relevant[qi].add(chunk_id)
+    return relevant
+
+
+class HashingEncoder:
+    """Offline stand-in for SentenceTransformer: signed hashed word counts, L2-normalised.
+
+    Deterministic and fast, so benchmark numbers track our code rather than model
+    inference; pass a real model name to the runner to measure end-to-end quality.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self._buckets = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _bucket(self, word: str):
+        hit = self._buckets.get(word)
+        if hit is None:
+            h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            hit = self._buckets[word] = (h % self.dim, 1.0 if (h >> 32) & 1 else -1.0)
+        return hit
+
+    def encode(self, sentences, **kwargs) -> np.ndarray:
+        out = np.zeros((len(sentences), self.dim), dtype="float32")
+        for row, text in enumerate(sentences):
+            # texts without words (e.g. a trailing "." chunk) still get a unit vector, as
+            # real models give them; a zero vector would sit closest to every query
+            for word in _WORD_RE.findall(text.lower()) or [""]:
+                col, sign = self._bucket(word)
+                out[row, col] += sign
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1.0, norms)
+
+
+class LexicalCrossEncoder:
+    """Offline stand-in for a sentence-transformers CrossEncoder: query-word overlap.
+
+    Scores each (query, text) pair by the fraction of query words found in the text, so
+    the re-ranking benchmark runs without a model download.
+    """
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs) -> np.ndarray:
+        out = np.empty(len(pairs), dtype="float32")
+        for i, (query, text) in enumerate(pairs):
+            words = set(_WORD_RE.findall(query.lower()))
+            out[i] = len(words.intersection(_WORD_RE.findall(text.lower()))) / max(1, len(words))
+        return out
@@ -0,0 +1,349 @@
+"""Retrieval benchmark: ingest throughput, index build time, query latency, recall@k and MRR.
+
+Builds a synthetic corpus with known relevant chunks (`bench.corpus`), ingests it once
+per chunking configuration with `src.ingest`, builds every index type from the ingested
+vectors and runs each query through `src.query.search`. Results are written as JSON and
+compared against a stored baseline; any regression beyond the tolerances makes the
+command exit non-zero.
+
+With `--rerank-depths`, the first index type is also run with cross-encoder re-ranking
+(`src.reranker`) of N candidates per query for each N (0: no re-ranking), reporting
+end-to-end latency against the precision@k / MRR of the returned context. The default
+`--cross-encoder lexical` scorer is offline; pass a CrossEncoder model name to measure
+a real one. These runs are reported but not compared against the baseline.
+
+Each run also times the sensitive-topic guardrail (`src.guardrail.benchmark`, with
+`--guardrail-queries` questions): matching precomputed chunk flags must stay faster than
+matching the context text, within the same run.
+
+By default documents are embedded with the offline `HashingEncoder`, so the numbers
+reflect our ingest/index/query code rather than model inference. Pass `--model
+all-MiniLM-L6-v2` to benchmark with a real embedding model.
+
+Usage:
+    python -m bench.run
+    python -m bench.run --docs 2000 --index-types flat,hnsw --chunking chars:1000:200,tokens:128:16
+    python -m bench.run --update-baseline
+    python -m bench.run --index-types flat --rerank-depths 0,20,50,100
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+from bench.corpus import HashingEncoder, LexicalCrossEncoder, make_corpus, relevant_ids
+from scripts.index_report import build, load_vectors
+from src import ann_index, guardrail, ingest
+from src.chunk_store import open_chunk_store
+from src.embeddings import BACKENDS, DEFAULT_BACKEND, load_encoder
+from src.query import search
+from src.reranker import Reranker
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+# (chunker, size, overlap): characters for "chars", tokenizer tokens for "tokens"
+DEFAULT_CHUNKINGS = [("chars", 1000, 200), ("tokens", 128, 16)]
+
+
+def recall_at_k(relevant: Set[int], ranked: Sequence[int], k: int) -> float:
+    """Fraction of the relevant chunks found in the first `k` results."""
+    if not relevant:
+        return 0.0
+    return len(relevant.intersection(ranked[:k])) / len(relevant)
+
+
+def reciprocal_rank(relevant: Set[int], ranked: Sequence[int]) -> float:
+    for rank, chunk_id in enumerate(ranked, start=1):
+        if chunk_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_ms)
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "mean": float(ms.mean()),
+    }
+
+
+def evaluate(model, index, store, queries: List[Dict], relevant: List[Set[int]], k: int, reranker=None) -> Dict:
+    """Run queries one at a time (as the interactive path does); return latency and quality."""
+    search(model, index, store, [queries[0]["question"]], k, reranker=reranker)  # warm-up
+    latencies, recalls, precisions, rrs = [], [], [], []
+    for q, rel in zip(queries, relevant):
+        t0 = time.perf_counter()
+        (rows,) = search(model, index, store, [q["question"]], k, reranker=reranker)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        ranked = [row["id"] for row in rows]
+        recalls.append(recall_at_k(rel, ranked, k))
+        precisions.append(len(rel.intersection(ranked[:k])) / k)
+        rrs.append(reciprocal_rank(rel, ranked))
+    return {
+        "latency_ms": percentiles(latencies),
+        "recall_at_k": float(np.mean(recalls)),
+        "precision_at_k": float(np.mean(precisions)),
+        "mrr": float(np.mean(rrs)),
+    }
+
+
+def run_benchmark(
+    work_dir,
+    n_docs: int = 500,
+    n_queries: Optional[int] = None,
+    k: int = 10,
+    chunkings: Sequence[Tuple[str, int, int]] = DEFAULT_CHUNKINGS,
+    index_types: Sequence[str] = ann_index.INDEX_TYPES,
+    model_name: str = "hash",
+    workers: int = 1,
+    batch_size: int = 256,
+    seed: int = 0,
+    rerank_depths: Sequence[int] = (),
+    cross_encoder: str = "lexical",
+    backend: str = DEFAULT_BACKEND,
+    guardrail_queries: int = 2000,
+) -> Dict:
+    """Run every (chunking, index type) combination and return the report dict.
+
+    With `rerank_depths`, the report also has `rerank_runs`: the first index type with
+    each number of cross-encoder re-ranked candidates (0: none). With `guardrail_queries`,
+    `guardrail` holds the microseconds per question of the guardrail check.
+    """
+    if faiss is None:
+        raise RuntimeError("faiss is required (install faiss-cpu)")
+    work_dir = Path(work_dir)
+    queries = make_corpus(work_dir / "corpus", n_docs=n_docs, seed=seed)
+    if n_queries:
+        queries = queries[:n_queries]
+    if model_name == "hash":
+        model = HashingEncoder()
+    else:
+        model = load_encoder(model_name, backend)
+    if rerank_depths:
+        scorer = LexicalCrossEncoder() if cross_encoder == "lexical" else Reranker(cross_encoder).model
+
+    runs, rerank_runs = [], []
+    for chunker, chunk_size, overlap in chunkings:
+        out = work_dir / f"{chunker}{chunk_size}_o{overlap}"
+        index_path = out / "faiss.index"
+        t0 = time.perf_counter()
+        ingest.main(
+            work_dir / "corpus" / "docs",
+            index_path,
+            out / "chunks",
+            model_name,
+            workers=workers,
+            batch_size=batch_size,
+            chunker=chunker,
+            chunk_tokens=chunk_size,
+            overlap_tokens=overlap,
+            chunk_size=chunk_size,
+            overlap=overlap,
+            model=model,
+        )
+        ingest_s = time.perf_counter() - t0
+        xb = load_vectors(index_path)
+        # duplicate chunks have no vector, so vector ids are not contiguous
+        xb_ids = faiss.vector_to_array(faiss.read_index(str(index_path)).id_map)
+        store_bytes = sum(f.stat().st_size for f in (out / "chunks").iterdir())
+
+        with open_chunk_store(out / "chunks") as store:
+            relevant = [{store.canonical_of(i) for i in ids} for ids in relevant_ids(store.iter_records(), queries)]
+            for index_type in index_types:
+                index, params, build_s = build(xb, ann_index.resolve_params(index_type), xb_ids)
+                ann_index.apply_search_params(index, params)
+                row = {
+                    "chunker": chunker,
+                    "chunk_size": chunk_size,
+                    "overlap": overlap,
+                    "index_type": index_type,
+                    "chunks": len(xb),
+                    "store_bytes": store_bytes,
+                    "ingest_s": ingest_s,
+                    "chunks_per_s": len(xb) / ingest_s,
+                    "build_s": build_s,
+                    "queries": len(queries),
+                }
+                row.update(evaluate(model, index, store, queries, relevant, k))
+                runs.append(row)
+                print(
+                    f"{chunker} {chunk_size}/{overlap} {index_type:<6} recall@{k}={row['recall_at_k']:.3f} "
+                    f"mrr={row['mrr']:.3f} p50={row['latency_ms']['p50']:.2f}ms"
+                )
+                if index_type != index_types[0]:
+                    continue
+                for depth in rerank_depths:
+                    # no score cache: every query pays for its cross-encoder pass
+                    reranker = Reranker(scorer, candidates=depth, cache_size=0) if depth else None
+                    rerank_row = dict(row, rerank_candidates=depth)
+                    rerank_row.update(evaluate(model, index, store, queries, relevant, k, reranker))
+                    rerank_runs.append(rerank_row)
+                    print(
+                        f"{chunker} {chunk_size}/{overlap} {index_type:<6} rerank N={depth:<4} "
+                        f"precision@{k}={rerank_row['precision_at_k']:.3f} mrr={rerank_row['mrr']:.3f} "
+                        f"p50={rerank_row['latency_ms']['p50']:.2f}ms p95={rerank_row['latency_ms']['p95']:.2f}ms"
+                    )
+
+    config = {
+        "docs": n_docs,
+        "queries": len(queries),
+        "k": k,
+        "model": model_name,
+        "workers": workers,
+        "batch_size": batch_size,
+        "seed": seed,
+    }
+    report = {
+        "config": config,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": getattr(faiss, "__version__", None),
+            "numpy": np.__version__,
+        },
+        "runs": runs,
+    }
+    if backend != DEFAULT_BACKEND:
+        config["backend"] = backend
+    if rerank_depths:
+        config.update(rerank_depths=list(rerank_depths), cross_encoder=cross_encoder)
+        report["rerank_runs"] = rerank_runs
+    if guardrail_queries:
+        report["guardrail"] = guardrail.benchmark(queries=guardrail_queries, seed=seed)
+        timings = report["guardrail"]
+        print(
+            f"guardrail substring={timings['substring_us']:.1f}us regex_text={timings['regex_text_us']:.1f}us "
+            f"regex_flags={timings['regex_flags_us']:.1f}us per query"
+        )
+    return report
+
+
+def _run_key(row: Dict) -> Tuple:
+    return row["index_type"], row["chunker"], row["chunk_size"], row["overlap"]
+
+
+def compare(report: Dict, baseline: Dict, quality_tol: float = 0.02, speed_tol: float = 0.5) -> List[str]:
+    """Return human-readable regressions of `report` against `baseline`.
+
+    Args:
+        quality_tol: allowed absolute drop in recall@k and MRR.
+        speed_tol: allowed relative slowdown in p50 latency, build time and ingest throughput.
+    """
+    regressions = []
+    if report["config"] != baseline["config"]:
+        regressions.append(f"config differs from baseline: {baseline['config']} -> {report['config']}")
+        return regressions
+    previous = {_run_key(row): row for row in baseline["runs"]}
+    for row in report["runs"]:
+        key = _run_key(row)
+        base = previous.get(key)
+        if base is None:
+            continue
+        name = f"{key[0]} {key[1]} {key[2]}/{key[3]}"
+        for metric in ("recall_at_k", "mrr"):
+            if row[metric] < base[metric] - quality_tol:
+                regressions.append(f"{name}: {metric} {base[metric]:.3f} -> {row[metric]:.3f}")
+        slower = [
+            ("p50 latency", base["latency_ms"]["p50"], row["latency_ms"]["p50"]),
+            ("build time", base["build_s"], row["build_s"]),
+            # lower throughput == slower; compare inverses so one tolerance applies
+            ("ingest time/chunk", 1.0 / base["chunks_per_s"], 1.0 / row["chunks_per_s"]),
+        ]
+        for metric, before, after in slower:
+            if after > before * (1.0 + speed_tol):
+                regressions.append(f"{name}: {metric} {before:.4g} -> {after:.4g} (+{after / before - 1:.0%})")
+    timings = report.get("guardrail")
+    # both sides are measured in this run, so no baseline is needed
+    if timings and timings["regex_flags_us"] >= timings["regex_text_us"]:
+        regressions.append(
+            f"guardrail: chunk flags {timings['regex_flags_us']:.1f}us/query not faster than "
+            f"matching context text {timings['regex_text_us']:.1f}us/query"
+        )
+    return regressions
+
+
+def _parse_chunkings(value: str) -> List[Tuple[str, int, int]]:
+    configs = []
+    for item in value.split(","):
+        chunker, size, overlap = item.split(":")
+        configs.append((chunker, int(size), int(overlap)))
+    return configs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=500, help="Synthetic documents to generate")
+    parser.add_argument("--queries", type=int, default=None, help="Limit the number of queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--chunking", default="chars:1000:200,tokens:128:16", help="Comma-separated chunker:size:overlap configs"
+    )
+    parser.add_argument("--index-types", default=",".join(ann_index.INDEX_TYPES))
+    parser.add_argument("--model", default="hash", help="'hash' (offline encoder) or a SentenceTransformer name")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=BACKENDS, help="Embedding backend of --model")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default="bench/out", help="Corpus and index artifacts")
+    parser.add_argument("--out", default="bench/out/results.json", help="Where to write the JSON report")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--update-baseline", action="store_true", help="Overwrite the baseline with this run")
+    parser.add_argument("--quality-tol", type=float, default=0.02, help="Allowed absolute recall/MRR drop")
+    parser.add_argument("--speed-tol", type=float, default=0.5, help="Allowed relative slowdown")
+    parser.add_argument("--rerank-depths", default="",
+                        help="Comma-separated cross-encoder candidate counts to benchmark (0: no re-ranking)")
+    parser.add_argument("--cross-encoder", default="lexical",
+                        help="'lexical' (offline scorer) or a sentence-transformers CrossEncoder name")
+    parser.add_argument("--guardrail-queries", type=int, default=2000,
+                        help="Questions for the guardrail timing (0: skip it)")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.work_dir,
+        n_docs=args.docs,
+        n_queries=args.queries,
+        k=args.k,
+        chunkings=_parse_chunkings(args.chunking),
+        index_types=args.index_types.split(","),
+        model_name=args.model,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        seed=args.seed,
+        rerank_depths=[int(n) for n in args.rerank_depths.split(",") if n],
+        cross_encoder=args.cross_encoder,
+        backend=args.backend,
+        guardrail_queries=args.guardrail_queries,
+    )
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Updated baseline {baseline_path}")
+    elif baseline_path.exists():
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.quality_tol, args.speed_tol)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(" -", line)
+            sys.exit(1)
+        print("No regressions against baseline")
+    else:
+        print(f"No baseline at {baseline_path}; rerun with --update-baseline to create one")
@@ -0,0 +1,186 @@
+"""Recall@k vs latency report for the ANN index types against the exact flat baseline.
+
+Vectors come from an existing ingest index (`--index-path`, reconstructed from the
+ID-mapped flat storage or read from the float32 sidecar of a compressed index) or are
+generated (`--synthetic N`). Queries are perturbed copies of corpus vectors, so no
+embedding model is needed.
+
+`--quantize` instead reports index memory, recall@k and latency for each vector
+encoding (float32, sq8, fp16, pq), with and without exact re-ranking from the sidecar.
+
+Usage:
+    python -m scripts.index_report --index-path artifacts/faiss.index --k 10
+    python -m scripts.index_report --synthetic 100000 --dim 384 --json report.json
+    python -m scripts.index_report --synthetic 100000 --dim 384 --quantize
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+from src import ann_index
+
+
+def load_vectors(index_path: Path) -> np.ndarray:
+    index = faiss.read_index(str(index_path))
+    sidecar = ann_index.open_vectors(ann_index.vectors_path(index_path), index.d)
+    if sidecar is not None and isinstance(index, faiss.IndexIDMap):
+        return np.array(sidecar[np.sort(faiss.vector_to_array(index.id_map))])
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if not isinstance(inner, faiss.IndexFlat):
+        raise SystemExit("Vectors can only be read back from a flat index; rebuild with --index-type flat")
+    return inner.reconstruct_n(0, inner.ntotal)
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # clustered data is closer to real embeddings than uniform noise
+    centers = rng.normal(size=(max(1, n // 100), dim)).astype("float32")
+    x = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.normal(size=(n, dim)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def make_queries(xb: np.ndarray, nq: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = xb[rng.integers(0, len(xb), nq)] + 0.05 * rng.normal(size=(nq, xb.shape[1])).astype("float32")
+    return q.astype("float32")
+
+
+def timed_search(index, xq: np.ndarray, k: int):
+    t0 = time.perf_counter()
+    _, I = index.search(xq, k)
+    return I, (time.perf_counter() - t0) * 1000.0 / len(xq)
+
+
+def build(xb: np.ndarray, params: dict, ids: Optional[np.ndarray] = None):
+    t0 = time.perf_counter()
+    ids = np.arange(len(xb), dtype="int64") if ids is None else ids
+    index = ann_index.build_index(xb.shape[1], params)
+    if not index.is_trained:
+        buf = ann_index.TrainingBuffer(index, params, xb.shape[1])
+        buf.add_with_ids(xb, ids)
+        index, params = buf.finish()
+    else:
+        index.add_with_ids(xb, ids)
+    return index, params, time.perf_counter() - t0
+
+
+def run_report(xb: np.ndarray, xq: np.ndarray, k: int, configs):
+    """Return one row per (index config, search knob) with recall@k and ms/query."""
+    flat, _, flat_build = build(xb, ann_index.resolve_params("flat"))
+    truth, flat_ms = timed_search(flat, xq, k)
+    rows = [{"index_type": "flat", "build_s": flat_build, "knob": None, "recall": 1.0, "ms_per_query": flat_ms}]
+    for index_type, overrides, knob_name, knob_values in configs:
+        index, params, build_s = build(xb, ann_index.resolve_params(index_type, **overrides))
+        for value in knob_values:
+            ann_index.apply_search_params(index, dict(params, **{knob_name: value}))
+            found, ms = timed_search(index, xq, k)
+            rows.append({
+                "index_type": index_type,
+                "params": {key: params[key] for key in ("nlist", "m", "ef_construction", "pq_m", "pq_bits")},
+                "build_s": build_s,
+                "knob": {knob_name: value},
+                "recall": ann_index.recall_at_k(truth, found, k),
+                "ms_per_query": ms,
+            })
+    return rows
+
+
+def index_bytes(index) -> int:
+    """Size of the serialized index, which is close to its resident memory."""
+    return int(faiss.serialize_index(index).size)
+
+
+def run_quantize_report(xb: np.ndarray, xq: np.ndarray, k: int, index_type: str = "flat", rerank: int = 4,
+                        overrides: Optional[dict] = None):
+    """Return one row per (vector encoding, re-rank factor) with bytes/vector, recall@k and ms/query.
+
+    Recall is measured against exact float32 search; re-ranking reads candidates from a
+    memory-mapped float32 sidecar, as the query path does.
+    """
+    flat, _, _ = build(xb, ann_index.resolve_params("flat"))
+    truth, _ = timed_search(flat, xq, k)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sidecar_path = Path(tmp) / "vectors.f32"
+        vector_file = ann_index.VectorFile(sidecar_path, xb.shape[1], truncate=True)
+        vector_file.add_with_ids(xb, np.arange(len(xb), dtype="int64"))
+        vector_file.close()
+        sidecar = ann_index.open_vectors(sidecar_path, xb.shape[1])
+        for quantize in (None,) + ann_index.QUANTIZERS:
+            params = ann_index.resolve_params(index_type, quantize=quantize, **(overrides or {}))
+            index, params, build_s = build(xb, params)
+            n_bytes = index_bytes(index)
+            for factor in (0, rerank) if ann_index.is_compressed(params) and rerank else (0,):
+                searcher = ann_index.RerankIndex(index, sidecar, factor) if factor else index
+                found, ms = timed_search(searcher, xq, k)
+                rows.append({
+                    "index_type": index_type,
+                    "quantize": quantize or "float32",
+                    "rerank": factor,
+                    "bytes_per_vector": n_bytes / len(xb),
+                    "index_mb": n_bytes / 2 ** 20,
+                    "build_s": build_s,
+                    "recall": ann_index.recall_at_k(truth, found, k),
+                    "ms_per_query": ms,
+                })
+        del sidecar
+    return rows
+
+
+def default_configs(n: int):
+    nlist = max(1, int(4 * np.sqrt(n)))
+    return [
+        ("hnsw", {"m": 32, "ef_construction": 200}, "ef_search", [16, 32, 64, 128, 256]),
+        ("ivf", {"nlist": nlist}, "nprobe", [1, 4, 16, 64]),
+        ("ivfpq", {"nlist": nlist}, "nprobe", [1, 4, 16, 64]),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-path", default="artifacts/faiss.index", help="Flat index built by ingest")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate N synthetic vectors instead")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write rows as JSON")
+    parser.add_argument("--quantize", action="store_true", help="Compare vector encodings instead of index types")
+    parser.add_argument("--index-type", default="flat", choices=ann_index.INDEX_TYPES[:3],
+                        help="--quantize: index family the encodings are applied to")
+    parser.add_argument("--rerank", type=int, default=4, help="--quantize: candidates per result re-ranked exactly")
+    args = parser.parse_args()
+
+    if faiss is None:
+        raise SystemExit("faiss is not available in this environment")
+    xb = synthetic_vectors(args.synthetic, args.dim) if args.synthetic else load_vectors(Path(args.index_path))
+    xq = make_queries(xb, args.queries)
+    print(f"{len(xb)} vectors, dim {xb.shape[1]}, {len(xq)} queries, k={args.k}")
+    if args.quantize:
+        overrides = {"nlist": max(1, int(4 * np.sqrt(len(xb))))} if args.index_type == "ivf" else {}
+        rows = run_quantize_report(xb, xq, args.k, args.index_type, args.rerank, overrides)
+        print(f"{'index':<6} {'codes':<8} {'rerank':>6} {'B/vector':>9} {'index MB':>9} {'recall@k':>9} {'ms/query':>9}")
+        for r in rows:
+            print(
+                f"{r['index_type']:<6} {r['quantize']:<8} {r['rerank']:>6} {r['bytes_per_vector']:>9.1f} "
+                f"{r['index_mb']:>9.2f} {r['recall']:>9.3f} {r['ms_per_query']:>9.3f}"
+            )
+    else:
+        rows = run_report(xb, xq, args.k, default_configs(len(xb)))
+        print(f"{'index':<8} {'knob':<16} {'recall@k':>9} {'ms/query':>9} {'build s':>8}")
+        for r in rows:
+            knob = ", ".join(f"{key}={v}" for key, v in (r["knob"] or {}).items()) or "-"
+            print(f"{r['index_type']:<8} {knob:<16} {r['recall']:>9.3f} {r['ms_per_query']:>9.3f} {r['build_s']:>8.2f}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,89 @@
+"""Concurrent load test for the query service (`src/server.py`).
+
+Reports p50/p99 latency and throughput (QPS).
+
+Usage:
+    python scripts/load_test.py --url http://127.0.0.1:8000/search --concurrency 16 --requests 2000
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+DEFAULT_QUERIES = [
+    "How do we reduce hallucinations?",
+    "What improves trustworthiness of model outputs?",
+    "Why cite sources in answers?",
+    "What does retrieval-augmented generation do?",
+]
+
+
+def _post(url: str, payload: dict, timeout: float) -> dict:
+    req = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def run_load(url: str, queries, concurrency: int, total: int, top_k: int = 5, timeout: float = 30.0) -> dict:
+    """Fire `total` requests from `concurrency` threads; return latency percentiles and QPS."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                _post(url, {"query": queries[i % len(queries)], "top_k": top_k}, timeout)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000.0
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "concurrency": concurrency,
+        "qps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(ms, 50)) if len(ms) else None,
+        "p99_ms": float(np.percentile(ms, 99)) if len(ms) else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000/search")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries-file", default=None, help="Optional file with one query per line")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    report = run_load(args.url, queries, args.concurrency, args.requests, args.top_k)
+    print(json.dumps(report, indent=2))
@@ -1,28 +1,33 @@
 import subprocess
-import json
+import sys
 from pathlib import Path
 import numpy as np
 from sentence_transformers import SentenceTransformer
 
+# ensure repo root is on sys.path so `src` imports work when run as a script
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src.chunk_store import open_chunk_store
+
 try:
     import faiss
 except Exception:
     faiss = None
 
 ARTIFACT_INDEX = Path("artifacts/faiss.index")
-ARTIFACT_META = Path("artifacts/meta.json")
+ARTIFACT_META = Path("artifacts/chunks")
 
 print("Running ingest...")
-subprocess.run(["python", "src/ingest.py", "--data-dir", "data", "--index-path", str(ARTIFACT_INDEX), "--meta-path", str(ARTIFACT_META)] , check=True)
+subprocess.run(["python", "-m", "src.ingest", "--data-dir", "data", "--index-path", str(ARTIFACT_INDEX), "--meta-path", str(ARTIFACT_META)] , check=True)
 
 if not ARTIFACT_INDEX.exists() or not ARTIFACT_META.exists():
     raise SystemExit("Index or metadata not found after ingest")
 
-print("Loading metadata...")
-with open(ARTIFACT_META, "r", encoding="utf-8") as f:
-    metas = json.load(f)
+print("Opening chunk store...")
+store = open_chunk_store(ARTIFACT_META)
 
-print(f"Loaded {len(metas)} chunks from metadata")
+print(f"Chunk store has {len(store)} chunk slots")
 
 model = SentenceTransformer("all-MiniLM-L6-v2")
 query = "How do we reduce hallucinations?"
@@ -35,10 +40,9 @@ index = faiss.read_index(str(ARTIFACT_INDEX))
 D, I = index.search(q_emb, 3)
 
 print("Top matches:")
-for idx in I[0]:
-    if idx < 0 or idx >= len(metas):
+for m in store.get(I[0]):
+    if m is None:
         continue
-    m = metas[idx]
     print('-', m.get('source'), 'chunk', m.get('chunk_index'))
     print('  excerpt:', (m.get('text') or '')[:200])
 
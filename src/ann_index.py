@@ -0,0 +1,335 @@
+"""FAISS index construction for the ingest pipeline.
+
+Supports exact (`flat`) and approximate (`hnsw`, `ivf`, `ivfpq`) indexes, always wrapped
+in an `IndexIDMap2` so vectors are addressed by chunk id. Build parameters are written
+next to the index (`<index_path>.json`) so the query side can restore the matching
+search-time knobs (`nprobe`, `efSearch`).
+
+`quantize` stores the vectors compressed instead of as float32: `sq8` (1 byte per
+dimension), `fp16` (2 bytes) or `pq` (`pq_m` codes of `pq_bits` bits). Compressed
+indexes can keep the float32 vectors in a memory-mapped sidecar (`<index_path>.vectors.f32`,
+see `VectorFile`) so `RerankIndex` re-ranks `rerank * k` candidates by exact distance.
+
+Usage:
+    from src.ann_index import build_index, save_params, load_params, apply_search_params
+"""
+
+import json
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+QUANTIZERS = ("sq8", "fp16", "pq")
+
+DEFAULT_PARAMS = {
+    "nlist": 1024,  # IVF coarse centroids
+    "m": 32,  # HNSW graph neighbours per node
+    "ef_construction": 200,  # HNSW build-time beam width
+    "pq_m": 16,  # IVF-PQ sub-quantizers (must divide the embedding dimension)
+    "pq_bits": 8,  # bits per PQ code
+    "nprobe": 16,  # IVF lists visited per query
+    "ef_search": 64,  # HNSW search-time beam width
+    "train_sample": 100_000,  # reservoir sample size used to train IVF quantizers
+    "quantize": None,  # vector codes: None (float32), "sq8", "fp16" or "pq"
+    "rerank": 4,  # compressed indexes: candidates per result re-ranked exactly (0: no float32 sidecar)
+}
+
+# faiss warns below ~39 training points per centroid
+_MIN_POINTS_PER_CENTROID = 39
+
+
+def _require_faiss():
+    if faiss is None:
+        raise RuntimeError("faiss is required (install faiss-cpu)")
+
+
+def resolve_params(index_type: str = "flat", **overrides) -> Dict:
+    """Merge user overrides into `DEFAULT_PARAMS` and validate the index type."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+    params = dict(DEFAULT_PARAMS)
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    params["index_type"] = index_type
+    if params["quantize"] not in (None,) + QUANTIZERS:
+        raise ValueError(f"Unknown quantizer {params['quantize']!r}; expected one of {', '.join(QUANTIZERS)}")
+    if index_type == "ivfpq" and params["quantize"] not in (None, "pq"):
+        raise ValueError("ivfpq indexes already store PQ codes; use --index-type ivf with --quantize")
+    return params
+
+
+def is_compressed(params: Dict) -> bool:
+    """True when the index does not hold the float32 vectors themselves."""
+    return bool(params.get("quantize")) or params.get("index_type") == "ivfpq"
+
+
+def uses_pq(params: Dict) -> bool:
+    return params["index_type"] == "ivfpq" or params.get("quantize") == "pq"
+
+
+def fit_to_training_size(params: Dict, n_train: int, dim: int) -> Dict:
+    """Shrink `nlist`/`pq_bits` so small corpora can still be trained, and check `pq_m`."""
+    params = dict(params)
+    if params["index_type"] in ("ivf", "ivfpq"):
+        params["nlist"] = max(1, min(params["nlist"], n_train // _MIN_POINTS_PER_CENTROID))
+    if uses_pq(params):
+        if dim % params["pq_m"]:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dim}")
+        max_bits = int(math.log2(max(2, n_train // _MIN_POINTS_PER_CENTROID)))
+        params["pq_bits"] = max(1, min(params["pq_bits"], max_bits))
+    return params
+
+
+def factory_string(params: Dict) -> str:
+    index_type = params["index_type"]
+    codes = {
+        None: "Flat",
+        "sq8": "SQ8",
+        "fp16": "SQfp16",
+        "pq": f"PQ{params['pq_m']}x{params['pq_bits']}",
+    }[params.get("quantize")]
+    if index_type == "flat":
+        return codes
+    if index_type == "hnsw":
+        return f"HNSW{params['m']}" + ("" if codes == "Flat" else f"_{codes}")
+    if index_type == "ivf":
+        return f"IVF{params['nlist']},{codes}"
+    return f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_bits']}"
+
+
+def build_index(dim: int, params: Dict):
+    """Create an empty ID-mapped index for `params` (see `resolve_params`)."""
+    _require_faiss()
+    inner = faiss.index_factory(dim, factory_string(params))
+    if params["index_type"] == "hnsw":
+        inner.hnsw.efConstruction = params["ef_construction"]
+    if uses_pq(params):
+        # polysemous codes only help Hamming-filtered search, which we do not use
+        pq_index = faiss.downcast_index(inner.storage) if params["index_type"] == "hnsw" else inner
+        pq_index.do_polysemous_training = False
+    index = faiss.IndexIDMap2(inner)
+    apply_search_params(index, params)
+    return index
+
+
+def supports_removal(params: Dict) -> bool:
+    # HNSW graphs cannot delete nodes; everything else supports remove_ids
+    return params.get("index_type", "flat") != "hnsw"
+
+
+def apply_search_params(index, params: Optional[Dict], nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Set the search-time knobs recorded in `params` (explicit arguments win)."""
+    if not params:
+        return index
+    index_type = params.get("index_type", "flat")
+    ps = faiss.ParameterSpace()
+    if index_type in ("ivf", "ivfpq"):
+        ps.set_index_parameter(index, "nprobe", int(nprobe or params.get("nprobe", DEFAULT_PARAMS["nprobe"])))
+    elif index_type == "hnsw":
+        ps.set_index_parameter(index, "efSearch", int(ef_search or params.get("ef_search", DEFAULT_PARAMS["ef_search"])))
+    return index
+
+
+def load_index(index_path, nprobe: Optional[int] = None, ef_search: Optional[int] = None, rerank: Optional[int] = None):
+    """Read a FAISS index and restore the search-time knobs saved by ingest.
+
+    `nprobe` (IVF) and `ef_search` (HNSW) override the saved defaults when given. For a
+    compressed index with a float32 sidecar, returns a `RerankIndex` that re-ranks
+    `rerank * k` candidates exactly (`rerank=0` searches the compressed codes only).
+    """
+    _require_faiss()
+    index = faiss.read_index(str(index_path))
+    params = load_params(index_path)
+    index = apply_search_params(index, params, nprobe=nprobe, ef_search=ef_search)
+    factor = rerank if rerank is not None else (params or {}).get("rerank", 0)
+    if params and is_compressed(params) and factor:
+        vectors = open_vectors(vectors_path(index_path), index.d)
+        if vectors is not None:
+            return RerankIndex(index, vectors, factor)
+    return index
+
+
+def params_path(index_path) -> Path:
+    return Path(str(index_path) + ".json")
+
+
+def save_params(index_path, params: Dict):
+    with open(params_path(index_path), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2, sort_keys=True)
+
+
+def load_params(index_path) -> Optional[Dict]:
+    """Return the build parameters saved next to `index_path`, or None for legacy indexes."""
+    p = params_path(index_path)
+    if not p.exists():
+        return None
+    with open(p, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ReservoirSample:
+    """Uniform fixed-size sample over a stream of vector batches (Algorithm R)."""
+
+    def __init__(self, size: int, dim: int, seed: int = 0):
+        self.size = size
+        self.buf = np.empty((size, dim), dtype="float32")
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, vectors: np.ndarray):
+        free = max(0, min(self.size - self.seen, len(vectors)))
+        self.buf[self.seen:self.seen + free] = vectors[:free]
+        rest = vectors[free:]
+        if len(rest):
+            # row n of the batch replaces a uniform slot in [0, seen_before_it]
+            j = self._rng.integers(0, self.seen + free + np.arange(len(rest)) + 1)
+            rows = np.flatnonzero(j < self.size)[::-1]
+            # a slot drawn twice keeps the later row, as in the sequential algorithm
+            slots, first = np.unique(j[rows], return_index=True)
+            self.buf[slots] = rest[rows[first]]
+        self.seen += len(vectors)
+
+    @property
+    def sample(self) -> np.ndarray:
+        return self.buf[: min(self.seen, self.size)]
+
+
+class TrainingBuffer:
+    """Stand-in for an untrained index during ingest.
+
+    `add_with_ids` spools vectors to a temporary file while feeding a reservoir sample;
+    `finish` trains the real index on the sample and replays the spool into it, so memory
+    stays bounded by the sample size rather than the corpus.
+    """
+
+    def __init__(self, index, params: Dict, dim: int, tmp_dir=None, replay_batch: int = 65536):
+        self.index = index
+        self.params = params
+        self.dim = dim
+        self.replay_batch = replay_batch
+        self.reservoir = ReservoirSample(params["train_sample"], dim)
+        fd, self._spool_path = tempfile.mkstemp(suffix=".spool", dir=tmp_dir)
+        self._spool = os.fdopen(fd, "wb")
+        self._ids = []
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        self._spool.write(vectors.tobytes())
+        self._ids.append(np.asarray(ids, dtype="int64"))
+        self.reservoir.add(vectors)
+
+    def finish(self):
+        """Train, replay the spooled vectors and return `(index, params)` with resolved params."""
+        self._spool.close()
+        try:
+            params = fit_to_training_size(self.params, self.reservoir.seen, self.dim)
+            if params != self.params:
+                self.index = build_index(self.dim, params)
+            sample = self.reservoir.sample
+            if len(sample):
+                self.index.train(sample)
+            ids = np.concatenate(self._ids) if self._ids else np.empty(0, dtype="int64")
+            if len(ids):
+                spool = np.memmap(self._spool_path, dtype="float32", mode="r", shape=(len(ids), self.dim))
+                for start in range(0, len(ids), self.replay_batch):
+                    end = start + self.replay_batch
+                    self.index.add_with_ids(np.array(spool[start:end]), ids[start:end])
+                del spool
+        finally:
+            os.unlink(self._spool_path)
+        return self.index, params
+
+
+def vectors_path(index_path) -> Path:
+    return Path(str(index_path) + ".vectors.f32")
+
+
+class VectorFile:
+    """Float32 vectors by chunk id in a flat file: row `i` starts at byte `i * dim * 4`.
+
+    Chunk ids without a vector (removed or duplicate chunks) read back as zeros; they
+    never come out of the index, so they are never looked up.
+    """
+
+    def __init__(self, path, dim: int, truncate: bool = False):
+        self.path = Path(path)
+        self.dim = dim
+        self._f = open(self.path, "w+b" if truncate or not self.path.exists() else "r+b")
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        row_bytes = self.dim * 4
+        for chunk_id, row in zip(np.asarray(ids).tolist(), vectors):
+            self._f.seek(chunk_id * row_bytes)
+            self._f.write(row.tobytes())
+
+    def close(self):
+        self._f.close()
+
+
+class SidecarSink:
+    """Index stand-in for ingest that also writes every added vector to a `VectorFile`."""
+
+    def __init__(self, sink, vectors: VectorFile):
+        self.sink = sink
+        self.vectors = vectors
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray):
+        self.vectors.add_with_ids(vectors, ids)
+        self.sink.add_with_ids(vectors, ids)
+
+
+def open_vectors(path, dim: int) -> Optional[np.ndarray]:
+    """Memory-map a `VectorFile` as an (n, dim) float32 array, or None if it is missing."""
+    path = Path(path)
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    return np.memmap(path, dtype="float32", mode="r").reshape(-1, dim)
+
+
+class RerankIndex:
+    """Search a compressed index for `factor * k` candidates, then re-rank them exactly.
+
+    Exact squared L2 distances come from the memory-mapped float32 vectors, so only the
+    candidate rows are paged in. Other attributes are those of the wrapped index.
+    """
+
+    def __init__(self, index, vectors: np.ndarray, factor: int = 4):
+        self.index = index
+        self.vectors = vectors
+        self.factor = max(1, int(factor))
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, x: np.ndarray, k: int, params=None):
+        _, I = self.index.search(x, k * self.factor, params=params)
+        D_out = np.full((len(x), k), np.inf, dtype="float32")
+        I_out = np.full((len(x), k), -1, dtype="int64")
+        for row, (q, ids) in enumerate(zip(x, I)):
+            ids = np.sort(ids[(ids >= 0) & (ids < len(self.vectors))])
+            if not len(ids):
+                continue
+            dists = ((np.asarray(self.vectors[ids]) - q) ** 2).sum(axis=1)
+            order = np.argsort(dists, kind="stable")[:k]
+            D_out[row, :len(order)] = dists[order]
+            I_out[row, :len(order)] = ids[order]
+        return D_out, I_out
+
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray, k: int) -> float:
+    """Mean fraction of the exact top-k ids (`truth`) that also appear in `found[:, :k]`."""
+    hits = 0
+    for t, f in zip(truth[:, :k], found[:, :k]):
+        hits += len(set(t[t >= 0]) & set(f[f >= 0]))
+    return hits / float(truth[:, :k].size)
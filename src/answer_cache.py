@@ -0,0 +1,187 @@
+"""Answer cache for the grounded LLM path.
+
+Grounded answers are generated at temperature 0 from the question and the packed
+context, so a repeated question over the same chunks gets the same answer. Answers are
+stored in buckets keyed by
+
+    (prompt version, LLM model, index fingerprint, sorted ids of the context chunks)
+
+and a bucket serves a question when its normalized text matches a stored one or, with an
+`embed` function, when its embedding is within `threshold` cosine similarity of a stored
+question's (a paraphrase over the same retrieved set). Questions are embedded lazily,
+only when a bucket for their retrieved set already exists, so a plain miss costs no
+extra encode. The prompt version is a digest of `SYSTEM_PROMPT` and
+`USER_PROMPT_TEMPLATE`, and the index fingerprint changes on every rebuild (see
+`src.cache.index_fingerprint`), so editing the prompts or re-ingesting invalidates old
+answers. Buckets live in a size-bounded `src.cache.LRUCache` with a TTL,
+optionally backed by a `src.cache.DiskCache`. Refusals are decided before the cache is
+consulted and are never stored.
+
+Usage:
+    from src.answer_cache import AnswerCache
+    answers = AnswerCache(index_path="artifacts/faiss.index", embed=lambda q: encode_queries(model, [q])[0])
+    answer = answer_question(client, query, results, answer_cache=answers)
+    answers.stats()
+"""
+
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from src import metrics
+from src.cache import DiskCache, LRUCache, index_fingerprint, normalize_query
+from src.llm import DEFAULT_MODEL
+from src.prompt_template import SYSTEM_PROMPT, USER_PROMPT_TEMPLATE
+
+DEFAULT_THRESHOLD = 0.95
+
+
+def prompt_version(system_prompt: str = SYSTEM_PROMPT, user_template: str = USER_PROMPT_TEMPLATE) -> str:
+    """Digest of the grounded prompt templates; part of every cache key."""
+    data = f"{system_prompt}\x1f{user_template}".encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def llm_model(client) -> str:
+    """Model name a chat client generates with (`src.llm.DEFAULT_MODEL` for plain clients)."""
+    return getattr(client, "model", None) or DEFAULT_MODEL
+
+
+class AnswerCache:
+    """Exact and semantic grounded-answer cache (see module docstring).
+
+    `maxsize` bounds the number of buckets and `per_bucket` the questions kept per
+    bucket; `ttl` is in seconds. `embed(question)` returns a question embedding; without
+    it only exact (normalized) questions are served.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = 24 * 3600.0,
+        index_path=None,
+        embed: Optional[Callable[[str], np.ndarray]] = None,
+        threshold: float = DEFAULT_THRESHOLD,
+        per_bucket: int = 8,
+        disk_path=None,
+        disk_maxsize: int = 100_000,
+    ):
+        self.index_path = index_path
+        self.embed = embed
+        self.threshold = threshold
+        self.per_bucket = per_bucket
+        self.prompt_version = prompt_version()
+        self.buckets = LRUCache(maxsize, ttl)
+        self.embeddings = LRUCache(maxsize, ttl)  # normalized question -> unit embedding
+        self.disk = DiskCache(disk_path, "answers", disk_maxsize, ttl) if disk_path is not None else None
+        self.hits = self.semantic_hits = self.misses = 0
+        self._fingerprint = index_fingerprint(index_path)
+        self._lock = threading.Lock()
+
+    def check_index(self):
+        """Drop in-memory answers when the index changed since the last check."""
+        fingerprint = index_fingerprint(self.index_path)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.buckets.clear()
+
+    def key(self, chunk_ids: Iterable[int], model: str = DEFAULT_MODEL) -> str:
+        ids = ",".join(str(i) for i in sorted(int(i) for i in chunk_ids))
+        return f"{self.prompt_version}:{model}:{self._fingerprint}:{ids}"
+
+    def _embedding(self, question: str) -> Optional[np.ndarray]:
+        if self.embed is None:
+            return None
+        emb = self.embeddings.get(question)
+        if emb is None:
+            emb = np.asarray(self.embed(question), dtype="float32").ravel()
+            norm = np.linalg.norm(emb)
+            emb = emb / norm if norm else emb
+            self.embeddings.put(question, emb)
+        return emb
+
+    def _bucket(self, key: str) -> Optional[List[Dict]]:
+        entries = self.buckets.get(key)
+        if entries is None and self.disk is not None:
+            raw = self.disk.get(key)
+            if raw is not None:
+                entries = [
+                    dict(entry, emb=None if entry["emb"] is None else np.array(entry["emb"], dtype="float32"))
+                    for entry in json.loads(raw)
+                ]
+                self.buckets.put(key, entries)
+        return entries
+
+    def get(self, question: str, chunk_ids: Iterable[int], model: str = DEFAULT_MODEL) -> Optional[str]:
+        """The cached answer to `question` over the context chunks `chunk_ids`, or None."""
+        self.check_index()
+        key, question = self.key(chunk_ids, model), normalize_query(question)
+        entries = self._bucket(key) or []
+        answer, kind = next((e["answer"] for e in entries if e["question"] == question), None), "exact"
+        if answer is None and entries and self.embed is not None:
+            # questions are only embedded once a bucket for the same retrieved set exists
+            emb = self._embedding(question)
+            for entry in entries:
+                if entry["emb"] is None:
+                    entry["emb"] = self._embedding(entry["question"])
+            similarity, best = max((float(e["emb"] @ emb), e["answer"]) for e in entries)
+            if similarity >= self.threshold:
+                answer, kind = best, "semantic"
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.semantic_hits += kind == "semantic"
+        if answer is None:
+            metrics.inc("rag_answer_cache_misses_total")
+        else:
+            metrics.inc("rag_answer_cache_hits_total", kind=kind)
+        return answer
+
+    def put(self, question: str, chunk_ids: Iterable[int], answer: str, model: str = DEFAULT_MODEL):
+        key, question = self.key(chunk_ids, model), normalize_query(question)
+        entry = {"question": question, "emb": self.embeddings.get(question), "answer": answer}
+        with self._lock:
+            entries = [e for e in self._bucket(key) or [] if e["question"] != question]
+            entries = (entries + [entry])[-self.per_bucket:]
+            self.buckets.put(key, entries)
+            if self.disk is not None:
+                payload = [dict(e, emb=None if e["emb"] is None else e["emb"].tolist()) for e in entries]
+                self.disk.put(key, json.dumps(payload).encode("utf-8"))
+
+    def stream(
+        self, question: str, chunk_ids: Iterable[int], tokens: Iterator[str], model: str = DEFAULT_MODEL
+    ) -> Iterator[str]:
+        """Yield the cached answer, or the `tokens` stream, storing it once it completes."""
+        chunk_ids = list(chunk_ids)
+        answer = self.get(question, chunk_ids, model)
+        if answer is not None:
+            yield answer
+            return
+        parts = []
+        for token in tokens:
+            parts.append(token)
+            yield token
+        self.put(question, chunk_ids, "".join(parts), model)
+
+    def clear(self):
+        self.buckets.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict:
+        out = {
+            "hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses,
+            "size": len(self.buckets), "maxsize": self.buckets.maxsize,
+        }
+        if self.disk is not None:
+            out["disk"] = self.disk.stats()
+        return out
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
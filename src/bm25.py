@@ -0,0 +1,246 @@
+"""Sparse BM25 retriever over the chunk store, for hybrid search with the FAISS index.
+
+The inverted index is array-backed (CSR layout): a sorted `terms` array, `indptr` into
+flat `doc_ids` / `impacts` posting arrays. Each posting stores its precomputed BM25
+contribution, so scoring a query is one vectorized sum over the postings of its terms,
+grouped by chunk id, followed by a partial sort of the touched chunks; no per-posting
+Python work at query time. Incremental ingest updates the index with the added and
+removed chunks (`BM25Index.update`) instead of re-tokenizing the store.
+
+Chunk ids are the same ids as the FAISS index and the chunk store, so dense and sparse
+results can be fused directly (see `src.query.fuse`).
+
+Usage:
+    from src.bm25 import BM25Index, bm25_path
+    bm25 = BM25Index.from_store(store)
+    bm25.save(bm25_path("artifacts/faiss.index"))
+    scores, ids = BM25Index.load(bm25_path("artifacts/faiss.index")).search(["ERR_CONN_RESET"], 5)
+
+Build one for an existing chunk store (ingest does this automatically):
+    python -m src.bm25 build artifacts/chunks artifacts/faiss.index
+"""
+
+import argparse
+import re
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# identifiers, error codes and versions stay whole ("err_conn_reset", "e-1042", "v2.1")
+_TOKEN_RE = re.compile(r"\w+(?:[-.]\w+)*")
+_SPLIT_RE = re.compile(r"[-._]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; compound identifiers also emit their parts."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = _SPLIT_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+
+def bm25_path(index_path) -> Path:
+    return Path(str(index_path) + ".bm25.npz")
+
+
+class BM25Index:
+    """Okapi BM25 over chunk ids with array-backed postings.
+
+    Alongside the impacts it keeps each posting's term frequency (`tfs`) and each chunk's
+    token count (`doc_len`), so `update` can add and remove chunks without re-tokenizing
+    the rest of the store. Indexes saved before these were recorded load with `tfs=None`
+    and can only be rebuilt.
+    """
+
+    def __init__(
+        self, terms: np.ndarray, indptr: np.ndarray, doc_ids: np.ndarray, impacts: np.ndarray, n_slots: int,
+        tfs: Optional[np.ndarray] = None, doc_len: Optional[np.ndarray] = None, k1: float = 1.2, b: float = 0.75,
+    ):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.n_slots = n_slots
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    @staticmethod
+    def _tokenize_records(records: Iterable[Tuple[int, Dict]], doc_len: np.ndarray):
+        """(terms, term_ids, doc_ids, tfs) postings of `records`; fills in their `doc_len`."""
+        vocab = {}
+        term_ids, doc_ids, tfs = array("i"), array("q"), array("f")
+        for chunk_id, record in records:
+            tokens = tokenize(record.get("text") or "")
+            doc_len[chunk_id] = len(tokens)
+            for token, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(token, len(vocab)))
+                doc_ids.append(chunk_id)
+                tfs.append(tf)
+
+        # renumber terms in sorted order so lookups are a binary search over `terms`
+        sorted_terms = sorted(vocab)
+        terms = np.array(sorted_terms, dtype=str) if vocab else np.array([], dtype=str)
+        rank = np.empty(len(vocab), dtype="int64")
+        for pos, term in enumerate(sorted_terms):
+            rank[vocab[term]] = pos
+        term_ids = np.frombuffer(term_ids, dtype="int32")
+        term_ids = rank[term_ids] if len(term_ids) else term_ids.astype("int64")
+        return terms, term_ids, np.frombuffer(doc_ids, dtype="int64"), np.frombuffer(tfs, dtype="float32")
+
+    @classmethod
+    def _from_postings(cls, terms, term_ids, doc_ids, tfs, doc_len, k1: float, b: float):
+        # stable sort by (term, chunk id); kept postings are already in order, which it exploits
+        order = np.argsort(term_ids * max(len(doc_len), 1) + doc_ids, kind="stable")
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        n_docs = int(np.count_nonzero(doc_len))
+
+        df = np.bincount(term_ids, minlength=len(terms))
+        indptr = np.zeros(len(terms) + 1, dtype="int64")
+        np.cumsum(df, out=indptr[1:])
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+        avgdl = float(doc_len.sum() / n_docs) if n_docs else 1.0
+        norm = k1 * (1.0 - b + b * doc_len[doc_ids] / avgdl)
+        impacts = (idf[term_ids] * tfs * (k1 + 1.0) / (tfs + norm)).astype("float32")
+        return cls(terms, indptr, doc_ids, impacts, len(doc_len), tfs, doc_len, k1, b)
+
+    @classmethod
+    def build(cls, records: Iterable[Tuple[int, Dict]], n_slots: int, k1: float = 1.2, b: float = 0.75):
+        """Index the `text` of (chunk_id, record) pairs; `n_slots` bounds the chunk ids."""
+        doc_len = np.zeros(n_slots, dtype="float32")
+        terms, term_ids, doc_ids, tfs = cls._tokenize_records(records, doc_len)
+        return cls._from_postings(terms, term_ids, doc_ids, tfs, doc_len, k1, b)
+
+    @classmethod
+    def from_store(cls, store, k1: float = 1.2, b: float = 0.75):
+        """Index every live record of a chunk store (or `JsonMetaStore`), except duplicates.
+
+        Duplicate chunks (see `src.dedup`) are found through their canonical chunk, as in
+        the FAISS index.
+        """
+        records = ((i, r) for i, r in store.iter_records() if store.canonical_of(i) == i)
+        return cls.build(records, len(store), k1=k1, b=b)
+
+    def update(self, records: Iterable[Tuple[int, Dict]], removed_ids: Iterable[int], n_slots: int) -> "BM25Index":
+        """A new index without `removed_ids` and with the (chunk_id, record) pairs added.
+
+        Only the added texts are tokenized; idf, the average length and every impact are
+        recomputed from the stored term frequencies, so the result equals a full `build`.
+        """
+        if self.tfs is None:
+            raise ValueError("this BM25 index has no term frequencies; rebuild it with from_store")
+        doc_len = np.zeros(max(n_slots, self.n_slots), dtype="float32")
+        doc_len[: len(self.doc_len)] = self.doc_len
+        records = list(records)
+        removed = np.union1d(np.asarray(list(removed_ids), dtype="int64"), np.array([i for i, _ in records], dtype="int64"))
+        doc_len[removed] = 0
+        keep = ~np.isin(self.doc_ids, removed)
+        old_term_ids = np.repeat(np.arange(len(self.terms), dtype="int64"), np.diff(self.indptr))[keep]
+        new_terms, new_term_ids, new_doc_ids, new_tfs = self._tokenize_records(records, doc_len)
+
+        terms = np.union1d(self.terms, new_terms).astype(str)
+        term_ids = np.concatenate([
+            np.searchsorted(terms, self.terms)[old_term_ids], np.searchsorted(terms, new_terms)[new_term_ids],
+        ])
+        # drop terms no chunk uses any more, as a fresh build would
+        used = np.zeros(len(terms), dtype=bool)
+        used[term_ids] = True
+        renumber = np.cumsum(used) - 1
+        return self._from_postings(
+            terms[used], renumber[term_ids],
+            np.concatenate([self.doc_ids[keep], new_doc_ids]), np.concatenate([self.tfs[keep], new_tfs]),
+            doc_len, self.k1, self.b,
+        )
+
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        extra = {} if self.tfs is None else {"tfs": self.tfs, "doc_len": self.doc_len, "k1_b": np.array([self.k1, self.b])}
+        np.savez(
+            tmp,
+            terms=self.terms,
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            impacts=self.impacts,
+            n_slots=np.array(self.n_slots),
+            **extra,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data["terms"], data["indptr"], data["doc_ids"], data["impacts"], int(data["n_slots"]))
+            if "tfs" in data:
+                index.tfs, index.doc_len = data["tfs"], data["doc_len"]
+                index.k1, index.b = (float(v) for v in data["k1_b"])
+        return index
+
+    def _postings(self, term: str):
+        pos = int(np.searchsorted(self.terms, term))
+        if pos == len(self.terms) or self.terms[pos] != term:
+            return None
+        start, end = self.indptr[pos], self.indptr[pos + 1]
+        return self.doc_ids[start:end], self.impacts[start:end]
+
+    def search_one(self, query: str, top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, ids) of the best `top_k` chunks for one query, best first.
+
+        With a boolean `mask` over chunk ids (see `src.filters`) only chunks it selects rank.
+        """
+        ids, impacts = [], []
+        for term in set(tokenize(query)):
+            postings = self._postings(term)
+            if postings is not None:
+                ids.append(postings[0])
+                impacts.append(postings[1])
+        if not ids:
+            return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+        # sum the impacts per touched chunk; nothing is allocated per chunk slot
+        candidates, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        cand_scores = np.bincount(inverse, weights=np.concatenate(impacts)).astype("float32")
+        if mask is not None:
+            selected = candidates < len(mask)
+            selected[selected] = mask[candidates[selected]]
+            candidates, cand_scores = candidates[selected], cand_scores[selected]
+        if len(candidates) > top_k:
+            top = np.argpartition(-cand_scores, top_k - 1)[:top_k]
+            candidates, cand_scores = candidates[top], cand_scores[top]
+        order = np.lexsort((candidates, -cand_scores))
+        return cand_scores[order], candidates[order]
+
+    def search(self, queries: List[str], top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Batch form of `search_one`, padded like `index.search`: (scores, ids) with -1 ids."""
+        S = np.zeros((len(queries), top_k), dtype="float32")
+        I = np.full((len(queries), top_k), -1, dtype="int64")
+        for row, query in enumerate(queries):
+            scores, ids = self.search_one(query, top_k, mask)
+            S[row, :len(ids)] = scores
+            I[row, :len(ids)] = ids
+        return S, I
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="(Re)build the BM25 index for an existing chunk store")
+    build.add_argument("meta_path", help="Chunk store directory (or legacy meta.json)")
+    build.add_argument("index_path", help="FAISS index the chunk ids belong to")
+    args = parser.parse_args()
+
+    from src.chunk_store import open_chunk_store
+
+    with open_chunk_store(args.meta_path) as store:
+        bm25 = BM25Index.from_store(store)
+    bm25.save(bm25_path(args.index_path))
+    print(f"Wrote {len(bm25)} terms to {bm25_path(args.index_path)}")
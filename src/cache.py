@@ -0,0 +1,248 @@
+"""Size-bounded LRU/TTL caches for the query path.
+
+`QueryCache` has two levels:
+
+1. normalized query string -> query embedding;
+2. (embedding digest, top_k, index fingerprint, search params) -> retrieved (ids, distances).
+
+Each level is an in-memory `LRUCache`, optionally backed by a `DiskCache` (SQLite) so
+warm entries survive restarts. The retrieval level is keyed on the index file's
+fingerprint (size + mtime), so rebuilding the index invalidates it automatically, and on
+the search-time overrides the index was loaded with (`nprobe`, `ef_search`, `rerank`; see
+`src.ann_index.load_index`), so results found with other knobs are not served.
+
+Usage:
+    from src.cache import QueryCache
+    cache = QueryCache(maxsize=10000, ttl=3600, index_path="artifacts/faiss.index", search_params={"nprobe": 32})
+    results = search(model, index, store, [query], top_k, cache=cache)
+    cache.stats()
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with optional per-entry TTL and hit/miss counters."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, stored_at = entry
+                if self.ttl is None or self._clock() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, self._clock())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+
+class DiskCache:
+    """SQLite-backed byte cache with LRU (by last use) and TTL eviction."""
+
+    def __init__(self, path, table: str, maxsize: int = 100_000, ttl: Optional[float] = None, clock=time.time):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and (self.ttl is None or now - row[1] < self.ttl):
+                self._conn.execute(f"UPDATE {self.table} SET used = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return row[0]
+            if row is not None:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: bytes):
+        now = self._clock()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+            if count > self.maxsize:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY used LIMIT ?)",
+                    (count - self.maxsize,),
+                )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+    def close(self):
+        self._conn.close()
+
+    def stats(self) -> Dict:
+        (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "size": count, "maxsize": self.maxsize}
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def index_fingerprint(index_path) -> str:
+    """Cheap identity of an index file: size and mtime (changes on every rebuild)."""
+    if index_path is None:
+        return ""
+    if os.path.isdir(index_path):
+        index_path = os.path.join(index_path, "shards.json")  # rewritten by every shard build
+    st = os.stat(index_path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class QueryCache:
+    """Two-level query-embedding and retrieval cache (see module docstring).
+
+    `model_name` names the query encoder (`src.embeddings.encoder_key`, which includes a
+    non-default backend) and is part of every embedding key. `search_params` holds the
+    `load_index` overrides of the searched index; None values (the saved defaults, which
+    change with the index file) are left out of the key.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10_000,
+        ttl: Optional[float] = 3600.0,
+        index_path=None,
+        disk_path=None,
+        disk_maxsize: int = 100_000,
+        model_name: str = "",
+        search_params: Optional[Dict] = None,
+    ):
+        self.index_path = index_path
+        self.model_name = model_name
+        overrides = {k: v for k, v in (search_params or {}).items() if v is not None}
+        self._search_params = json.dumps(overrides, sort_keys=True) if overrides else ""
+        self.embeddings = LRUCache(maxsize, ttl)
+        self.retrievals = LRUCache(maxsize, ttl)
+        self.disk_embeddings = self.disk_retrievals = None
+        if disk_path is not None:
+            self.disk_embeddings = DiskCache(disk_path, "embeddings", disk_maxsize, ttl)
+            self.disk_retrievals = DiskCache(disk_path, "retrievals", disk_maxsize, ttl)
+        self._fingerprint = index_fingerprint(index_path)
+
+    def _embedding_key(self, query: str) -> str:
+        return f"{self.model_name}\x1f{normalize_query(query)}"
+
+    def get_embedding(self, query: str) -> Optional[np.ndarray]:
+        key = self._embedding_key(query)
+        emb = self.embeddings.get(key)
+        if emb is None and self.disk_embeddings is not None:
+            raw = self.disk_embeddings.get(key)
+            if raw is not None:
+                emb = np.frombuffer(raw, dtype="float32")
+                self.embeddings.put(key, emb)
+        return emb
+
+    def put_embedding(self, query: str, emb: np.ndarray):
+        key = self._embedding_key(query)
+        emb = np.ascontiguousarray(emb, dtype="float32")
+        self.embeddings.put(key, emb)
+        if self.disk_embeddings is not None:
+            self.disk_embeddings.put(key, emb.tobytes())
+
+    def check_index(self):
+        """Drop in-memory retrievals when the index file changed since the last check."""
+        fingerprint = index_fingerprint(self.index_path)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.retrievals.clear()
+
+    def _retrieval_key(self, emb: np.ndarray, top_k: int) -> str:
+        digest = _digest(np.ascontiguousarray(emb, dtype="float32").tobytes())
+        return f"{digest}:{top_k}:{self._fingerprint}:{self._search_params}"
+
+    def get_retrieval(self, emb: np.ndarray, top_k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        key = self._retrieval_key(emb, top_k)
+        hit = self.retrievals.get(key)
+        if hit is None and self.disk_retrievals is not None:
+            raw = self.disk_retrievals.get(key)
+            if raw is not None:
+                payload = json.loads(raw)
+                hit = (np.array(payload["ids"], dtype="int64"), np.array(payload["distances"], dtype="float32"))
+                self.retrievals.put(key, hit)
+        return hit
+
+    def put_retrieval(self, emb: np.ndarray, top_k: int, ids: np.ndarray, distances: np.ndarray):
+        key = self._retrieval_key(emb, top_k)
+        self.retrievals.put(key, (np.array(ids), np.array(distances)))
+        if self.disk_retrievals is not None:
+            payload = {"ids": [int(i) for i in ids], "distances": [float(d) for d in distances]}
+            self.disk_retrievals.put(key, json.dumps(payload).encode("utf-8"))
+
+    def stats(self) -> Dict:
+        out = {"embedding": self.embeddings.stats(), "retrieval": self.retrievals.stats()}
+        if self.disk_embeddings is not None:
+            out["disk_embedding"] = self.disk_embeddings.stats()
+            out["disk_retrieval"] = self.disk_retrievals.stats()
+        return out
+
+    def close(self):
+        for disk in (self.disk_embeddings, self.disk_retrievals):
+            if disk is not None:
+                disk.close()
@@ -0,0 +1,486 @@
+"""Memory-mapped, random-access chunk metadata store.
+
+Replaces the monolithic `meta.json`: a store is a directory holding
+
+- `records.bin`: compact UTF-8 JSON records, one per chunk, concatenated;
+- `offsets.bin`: one little-endian int64 `(start, length)` pair per chunk id;
+- `docs.bin`, `doc_offsets.bin`, `doc_keys.txt`: deduplicated document text, the int64
+  start of each document in `docs.bin`, and the content key (sha256) of each document
+  (`-` for a discarded document, whose text is never reused);
+- `duplicates.bin`: int64 `(chunk_id, canonical_id)` links from duplicate chunks to the
+  chunk holding their vector (see `src.dedup`); a later link overrides an earlier one and
+  a canonical id of -1 unlinks the chunk;
+- `files.jsonl`, `chunk_files.bin`: filterable file attributes (source, relative path,
+  extension, mtime, tags; one JSON line per ingested file) and the int32 row of each
+  chunk's file in `files.jsonl` (-1: none), the columnar side index behind `src.filters`;
+- `sensitive-<version>.bin`: one uint8 sensitive-topic flag per chunk id (0: no, 1: yes,
+  2: unknown), matched by the writer with `src.guardrail` whose keyword list `version`
+  names the file.
+
+Chunk id == slot number, matching the FAISS ids written by ingest. A length of 0 marks a
+removed chunk. Records written by ingest hold `doc`, `start` and `end` (byte offsets into
+that document's text) instead of a copy of the chunk text; readers add `text` from the
+shared document text, so overlapping chunks and identical files are stored once. Readers
+mmap the files, so fetching k rows costs O(k) regardless of corpus size.
+
+Usage:
+    from src.chunk_store import open_chunk_store
+    store = open_chunk_store("artifacts/chunks")
+    records = store.get(I[0])
+
+Convert an existing `meta.json`:
+    python -m src.chunk_store convert artifacts/meta.json artifacts/chunks
+"""
+
+import argparse
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src import guardrail
+from src.dedup import DEDUP_FILE
+
+
+RECORDS_FILE = "records.bin"
+OFFSETS_FILE = "offsets.bin"
+DOCS_FILE = "docs.bin"
+DOC_OFFSETS_FILE = "doc_offsets.bin"
+DOC_KEYS_FILE = "doc_keys.txt"
+DUPLICATES_FILE = "duplicates.bin"
+FILES_FILE = "files.jsonl"
+CHUNK_FILES_FILE = "chunk_files.bin"
+SENSITIVE_FILE = f"sensitive-{guardrail.VERSION}.bin"
+_OFFSET_DTYPE = np.dtype("<i8")
+_FILE_ROW_DTYPE = np.dtype("<i4")
+_DISCARDED_KEY = "-"
+
+
+def _encode(record: Dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _map(path: Path, dtype=None):
+    """mmap `path` read-only (bytes or a typed array); empty or missing files map to empty."""
+    if not path.exists() or path.stat().st_size == 0:
+        return b"" if dtype is None else np.empty(0, dtype=dtype)
+    if dtype is not None:
+        return np.memmap(path, dtype=dtype, mode="r")
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_duplicate_links(path) -> Dict[int, int]:
+    """Return {duplicate chunk id: canonical chunk id} from a store's `duplicates.bin`."""
+    links = {}
+    pairs = _map(Path(path) / DUPLICATES_FILE, _OFFSET_DTYPE).reshape(-1, 2)
+    for chunk_id, canonical in pairs.tolist():
+        if canonical < 0:
+            links.pop(chunk_id, None)
+        else:
+            links[chunk_id] = canonical
+    return links
+
+
+def _dependents(links: Dict[int, int]) -> Dict[int, List[int]]:
+    out = {}
+    for chunk_id, canonical in sorted(links.items()):
+        out.setdefault(canonical, []).append(chunk_id)
+    return out
+
+
+class ChunkStore:
+    """Read-only view over a chunk store directory."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._records_f = open(self.path / RECORDS_FILE, "rb")
+        size = os.fstat(self._records_f.fileno()).st_size
+        self._records = mmap.mmap(self._records_f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        n_bytes = os.path.getsize(self.path / OFFSETS_FILE)
+        if n_bytes:
+            self._offsets = np.memmap(self.path / OFFSETS_FILE, dtype=_OFFSET_DTYPE, mode="r").reshape(-1, 2)
+        else:
+            self._offsets = np.empty((0, 2), dtype=_OFFSET_DTYPE)
+        self._docs = _map(self.path / DOCS_FILE)
+        self._doc_starts = _map(self.path / DOC_OFFSETS_FILE, _OFFSET_DTYPE)
+        self._chunk_files = _map(self.path / CHUNK_FILES_FILE, _FILE_ROW_DTYPE)
+        self._sensitive = _map(self.path / SENSITIVE_FILE, np.uint8)
+        self._links = None
+        # written by ingest when duplicate chunks were linked instead of embedded
+        self.deduplicated = (self.path / DEDUP_FILE).exists()
+
+    def __len__(self) -> int:
+        """Number of id slots, including removed chunks."""
+        return len(self._offsets)
+
+    def __getitem__(self, chunk_id: int) -> Optional[Dict]:
+        if chunk_id < 0 or chunk_id >= len(self._offsets):
+            return None
+        start, length = self._offsets[chunk_id]
+        if length <= 0:
+            return None
+        record = json.loads(self._records[start:start + length].decode("utf-8"))
+        doc = record.get("doc")
+        if doc is not None and "text" not in record:
+            base = int(self._doc_starts[doc])
+            record["text"] = self._docs[base + record["start"]:base + record["end"]].decode("utf-8")
+        return record
+
+    def get(self, ids: Iterable[int]) -> List[Optional[Dict]]:
+        """Return the records for `ids` (None for missing/removed ids), in order."""
+        return [self[int(i)] for i in ids]
+
+    def iter_records(self) -> Iterator[Tuple[int, Dict]]:
+        for chunk_id in range(len(self)):
+            record = self[chunk_id]
+            if record is not None:
+                yield chunk_id, record
+
+    def _load_links(self):
+        if self._links is None:
+            links = load_duplicate_links(self.path)
+            self._links = links, _dependents(links)
+        return self._links
+
+    def canonical_of(self, chunk_id: int) -> int:
+        """Id of the chunk whose vector stands for `chunk_id` (itself unless it is a duplicate)."""
+        return self._load_links()[0].get(int(chunk_id), int(chunk_id))
+
+    def duplicate_links(self) -> Dict[int, int]:
+        """{duplicate chunk id: canonical chunk id}."""
+        return self._load_links()[0]
+
+    def file_attributes(self) -> Optional[Tuple[np.ndarray, List[Dict], np.ndarray]]:
+        """(file row per chunk id, file attribute rows, live mask per chunk id), or None for
+        stores written before file attributes were recorded."""
+        if not (self.path / FILES_FILE).exists():
+            return None
+        with open(self.path / FILES_FILE, "r", encoding="utf-8") as f:
+            files = [json.loads(line) for line in f]
+        chunk_files = np.full(len(self), -1, dtype=_FILE_ROW_DTYPE)
+        n = min(len(self), len(self._chunk_files))
+        chunk_files[:n] = self._chunk_files[:n]
+        return chunk_files, files, np.asarray(self._offsets[:, 1] > 0)
+
+    def sensitive_flags(self, ids: Iterable[int]) -> np.ndarray:
+        """`src.guardrail` flag of each chunk in `ids` (`UNKNOWN` where none was recorded)."""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self._sensitive))
+        flags = np.full(len(ids), guardrail.UNKNOWN, dtype=np.uint8)
+        flags[known] = self._sensitive[ids[known]]
+        return flags
+
+    def duplicates_of(self, chunk_id: int) -> List[int]:
+        """Live chunk ids linked to the canonical chunk `chunk_id`."""
+        return [d for d in self._load_links()[1].get(int(chunk_id), []) if self[d] is not None]
+
+    def close(self):
+        for mapped in (self._records, self._docs):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._records_f.close()
+        self._offsets = np.empty((0, 2), dtype=_OFFSET_DTYPE)
+        self._doc_starts = np.empty(0, dtype=_OFFSET_DTYPE)
+        self._chunk_files = np.empty(0, dtype=_FILE_ROW_DTYPE)
+        self._sensitive = np.empty(0, dtype=np.uint8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChunkStoreWriter:
+    """Append-only writer; `delete` tombstones ids in place.
+
+    Ids must be appended in increasing order; gaps are filled with removed slots.
+
+    `link_duplicates` records which chunks are duplicates of a canonical chunk.
+
+    Records carrying `doc_key` (a content hash), `fresh`, `start` and `end` (see
+    `src.chunker.Chunk`) are stored by reference: the `fresh` pieces of a document's
+    chunks are appended to `docs.bin` once per distinct `doc_key` (the first chunk of
+    each source opens the document) and the record keeps only `doc`, `start` and `end`.
+
+    A record's `file` dict (see `src.filters.file_attributes`) is moved to `files.jsonl`
+    the same way, once per source, and the chunk points at its row; `update_file` repoints
+    a file's chunks at a new row when only its attributes changed.
+
+    Each chunk's `text` is matched by `src.guardrail` once, here, for its sensitive flag.
+    """
+
+    def __init__(self, path, truncate: bool = False):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        mode = "wb" if truncate else "ab"
+        self._records = open(self.path / RECORDS_FILE, mode)
+        self._offsets = open(self.path / OFFSETS_FILE, mode)
+        self._docs = open(self.path / DOCS_FILE, mode)
+        self._doc_offsets = open(self.path / DOC_OFFSETS_FILE, mode)
+        if truncate or not (self.path / DOC_KEYS_FILE).exists():
+            keys = []
+        else:
+            keys = (self.path / DOC_KEYS_FILE).read_text(encoding="utf-8").split()
+        self._doc_keys = open(self.path / DOC_KEYS_FILE, mode.replace("b", "") + "t", encoding="utf-8")
+        self._doc_ids = {key: doc for doc, key in enumerate(keys) if key != _DISCARDED_KEY}
+        self._n_docs = len(keys)
+        if truncate:
+            (self.path / DUPLICATES_FILE).unlink(missing_ok=True)
+        self.links = load_duplicate_links(self.path)
+        self._duplicates = open(self.path / DUPLICATES_FILE, "ab")
+        self._open_doc = None
+        self._open_key = None  # (source, doc_key) of the document being appended
+        self._pos = self._records.tell()
+        self._doc_pos = self._docs.tell()
+        self._n = self._offsets.tell() // (2 * _OFFSET_DTYPE.itemsize)
+        if truncate or not (self.path / FILES_FILE).exists():
+            self._n_files = 0
+        else:
+            with open(self.path / FILES_FILE, "rb") as f:
+                self._n_files = sum(1 for _ in f)
+        self._files = open(self.path / FILES_FILE, mode.replace("b", "") + "t", encoding="utf-8")
+        self._chunk_files = open(self.path / CHUNK_FILES_FILE, mode)
+        self._open_file = -1
+        self._open_source = None
+        n_rows = self._chunk_files.tell() // _FILE_ROW_DTYPE.itemsize
+        self._chunk_files.write(np.full(max(0, self._n - n_rows), -1, dtype=_FILE_ROW_DTYPE).tobytes())
+        if truncate:
+            for stale in self.path.glob("sensitive-*.bin"):
+                stale.unlink()
+        # chunks written before (or with another keyword list) are UNKNOWN
+        self._sensitive = open(self.path / SENSITIVE_FILE, mode)
+        self._sensitive.write(np.full(max(0, self._n - self._sensitive.tell()), guardrail.UNKNOWN, np.uint8).tobytes())
+
+    def __len__(self) -> int:
+        return self._n
+
+    def append(self, chunk_id: int, record: Dict):
+        self.append_many([chunk_id], [record])
+
+    def append_many(self, ids: Iterable[int], records: Iterable[Dict]):
+        pairs, file_rows, flags = [], [], []
+        for chunk_id, record in zip(ids, records):
+            chunk_id = int(chunk_id)
+            if chunk_id < self._n:
+                raise ValueError(f"chunk id {chunk_id} already written (store has {self._n} slots)")
+            pairs.extend([0, 0] * (chunk_id - self._n))
+            file_rows.extend([-1] * (chunk_id - self._n))
+            flags.extend([guardrail.UNKNOWN] * (chunk_id - self._n))
+            file_rows.append(self._file_row(record))
+            flags.append(guardrail.is_sensitive(record.get("text") or ""))
+            if "doc_key" in record:
+                record = self._store_by_reference(record)
+            elif "file" in record:
+                record = {key: value for key, value in record.items() if key != "file"}
+            data = _encode(record)
+            self._records.write(data)
+            pairs.extend([self._pos, len(data)])
+            self._pos += len(data)
+            self._n = chunk_id + 1
+        self._offsets.write(np.asarray(pairs, dtype=_OFFSET_DTYPE).tobytes())
+        self._chunk_files.write(np.asarray(file_rows, dtype=_FILE_ROW_DTYPE).tobytes())
+        self._sensitive.write(np.asarray(flags, dtype=np.uint8).tobytes())
+
+    def _file_row(self, record: Dict) -> int:
+        attributes = record.get("file")
+        if attributes is None:
+            return -1
+        source = record.get("source")
+        if source != self._open_source or self._open_file < 0:
+            self._open_source = source
+            self._files.write(json.dumps(attributes, ensure_ascii=False) + "\n")
+            self._open_file = self._n_files
+            self._n_files += 1
+        return self._open_file
+
+    def _store_by_reference(self, record: Dict) -> Dict:
+        record = dict(record)
+        key = record.pop("doc_key")
+        fresh = record.pop("fresh")
+        record.pop("text", None)
+        record.pop("file", None)
+        # chunk indexes may skip (blank windows), so a new source or key opens the document
+        if (record.get("source"), key) != self._open_key:
+            self._open_key = (record.get("source"), key)
+            if key in self._doc_ids:
+                self._open_doc = None  # identical content is already stored
+            else:
+                self._open_doc = self._doc_ids[key] = self._n_docs
+                self._n_docs += 1
+                self._doc_offsets.write(np.asarray([self._doc_pos], dtype=_OFFSET_DTYPE).tobytes())
+                self._doc_keys.write(key + "\n")
+        doc = self._doc_ids[key]
+        if doc == self._open_doc and fresh:
+            data = fresh.encode("utf-8")
+            self._docs.write(data)
+            self._doc_pos += len(data)
+        record["doc"] = doc
+        return record
+
+    def discard_doc(self, source: str, key: str):
+        """Forget the document `source` opened under `key` when the file was read only in part.
+
+        Its text stays in `docs.bin` for the chunks already written, but a later file with
+        the same content key stores its own copy instead of reusing the truncated one.
+        """
+        if self._open_key != (source, key) or self._open_doc is None:
+            return  # nothing stored for this file, or it reused an earlier copy
+        doc = self._doc_ids.pop(key)
+        self._open_doc = self._open_key = None
+        self._doc_keys.flush()
+        path = self.path / DOC_KEYS_FILE
+        lines = path.read_text(encoding="utf-8").split("\n")
+        lines[doc] = _DISCARDED_KEY
+        path.write_text("\n".join(lines), encoding="utf-8")
+
+    def update_file(self, ids: Iterable[int], attributes: Dict):
+        """Point the chunks `ids` of one file at a new `files.jsonl` row of `attributes`."""
+        self._files.write(json.dumps(attributes, ensure_ascii=False) + "\n")
+        row = self._n_files
+        self._n_files += 1
+        self._open_file, self._open_source = -1, None
+        self._chunk_files.flush()
+        with open(self.path / CHUNK_FILES_FILE, "r+b") as f:
+            for chunk_id in ids:
+                if 0 <= chunk_id < self._n:
+                    f.seek(int(chunk_id) * _FILE_ROW_DTYPE.itemsize)
+                    f.write(np.asarray([row], dtype=_FILE_ROW_DTYPE).tobytes())
+
+    def pad_to(self, n: int):
+        """Extend the store with removed slots up to `n` ids."""
+        if n > self._n:
+            self._offsets.write(np.zeros(2 * (n - self._n), dtype=_OFFSET_DTYPE).tobytes())
+            self._chunk_files.write(np.full(n - self._n, -1, dtype=_FILE_ROW_DTYPE).tobytes())
+            self._sensitive.write(np.full(n - self._n, guardrail.UNKNOWN, dtype=np.uint8).tobytes())
+            self._n = n
+
+    def link_duplicates(self, ids: Iterable[int], canonical_ids: Iterable[int]):
+        """Link each chunk in `ids` to its canonical chunk (-1 removes the link)."""
+        pairs = []
+        for chunk_id, canonical in zip(ids, canonical_ids):
+            chunk_id, canonical = int(chunk_id), int(canonical)
+            pairs.extend([chunk_id, canonical])
+            if canonical < 0:
+                self.links.pop(chunk_id, None)
+            else:
+                self.links[chunk_id] = canonical
+        if pairs:
+            self._duplicates.write(np.asarray(pairs, dtype=_OFFSET_DTYPE).tobytes())
+
+    def dependents(self) -> Dict[int, List[int]]:
+        """{canonical chunk id: [linked duplicate ids]} over the current links."""
+        return _dependents(self.links)
+
+    def delete(self, ids: Iterable[int]):
+        """Mark `ids` as removed. Their bytes stay in `records.bin` until the next full rebuild."""
+        self._offsets.flush()
+        with open(self.path / OFFSETS_FILE, "r+b") as f:
+            for chunk_id in ids:
+                if 0 <= chunk_id < self._n:
+                    f.seek((2 * int(chunk_id) + 1) * _OFFSET_DTYPE.itemsize)
+                    f.write(np.asarray([0], dtype=_OFFSET_DTYPE).tobytes())
+
+    def close(self):
+        for f in (
+            self._records, self._offsets, self._docs, self._doc_offsets, self._doc_keys, self._duplicates, self._files,
+            self._chunk_files, self._sensitive,
+        ):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonMetaStore:
+    """Adapter with the `ChunkStore` read API over a legacy `meta.json` list.
+
+    Parses the whole file; kept so artifacts built before the chunk store still load.
+    """
+
+    deduplicated = False
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            self._records = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, chunk_id: int) -> Optional[Dict]:
+        if chunk_id < 0 or chunk_id >= len(self._records):
+            return None
+        return self._records[chunk_id]
+
+    def get(self, ids: Iterable[int]) -> List[Optional[Dict]]:
+        return [self[int(i)] for i in ids]
+
+    def iter_records(self) -> Iterator[Tuple[int, Dict]]:
+        for chunk_id, record in enumerate(self._records):
+            if record is not None:
+                yield chunk_id, record
+
+    def canonical_of(self, chunk_id: int) -> int:
+        return int(chunk_id)
+
+    def duplicates_of(self, chunk_id: int) -> List[int]:
+        return []
+
+    def duplicate_links(self) -> Dict[int, int]:
+        return {}
+
+    def sensitive_flags(self, ids: Iterable[int]) -> np.ndarray:
+        return np.full(len(list(ids)), guardrail.UNKNOWN, dtype=np.uint8)
+
+    def close(self):
+        self._records = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_chunk_store(path):
+    """Open a chunk store directory, a sharded root (see `src.shards`), or a legacy `meta.json` file."""
+    path = Path(path)
+    if path.is_file() and path.suffix.lower() == ".json":
+        return JsonMetaStore(path)
+    if (path / "shards.json").is_file():
+        from src.shards import ShardedStore  # src.shards imports this module
+
+        return ShardedStore(path)
+    return ChunkStore(path)
+
+
+def convert_meta_json(json_path, store_path) -> int:
+    """Write the records of a legacy `meta.json` into a new chunk store; returns the slot count."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    with ChunkStoreWriter(store_path, truncate=True) as writer:
+        for chunk_id, record in enumerate(records):
+            if record is not None:
+                writer.append(chunk_id, record)
+        # keep trailing removed slots so len(store) matches the old list
+        writer.pad_to(len(records))
+        return len(writer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="Convert a legacy meta.json into a chunk store")
+    convert.add_argument("json_path")
+    convert.add_argument("store_path")
+    args = parser.parse_args()
+    n = convert_meta_json(args.json_path, args.store_path)
+    print(f"Wrote {n} chunk slots to {args.store_path}")
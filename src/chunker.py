@@ -0,0 +1,236 @@
+"""Streaming chunkers that emit chunk text plus byte offsets into the source document.
+
+`iter_token_chunks` packs whole sentences (paragraph breaks are boundaries too) into
+chunks of at most `max_tokens` embedding-tokenizer tokens, carrying up to
+`overlap_tokens` of trailing sentences into the next chunk. It consumes the document as
+a stream of text blocks and only buffers the sentences of the chunk being built, so huge
+files are never held in memory. Sentences longer than the budget are split at whitespace.
+
+`iter_char_chunks` is the previous fixed-size character window chunker, kept as a
+fallback for encoders without a tokenizer budget.
+
+Both yield `Chunk(index, text, start, end, fresh)`: `start`/`end` are UTF-8 byte offsets
+into the document text and `fresh` is the document text not covered by earlier chunks,
+so concatenating the `fresh` pieces rebuilds the document text once, without the
+overlapped copies (see `src.chunk_store.ChunkStoreWriter`).
+
+Usage:
+    from src.chunker import iter_token_chunks, make_token_counter
+    count = make_token_counter(model.tokenizer)
+    for chunk in iter_token_chunks(blocks, count, max_tokens=254, overlap_tokens=32):
+        ...
+"""
+
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+# sentence ends (optionally followed by closing quotes/brackets) and blank lines
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n\s*\n")
+_WORD_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+# force a break when a block stream has no sentence boundary for this long
+_MAX_PENDING_CHARS = 1 << 18
+
+
+class Chunk(NamedTuple):
+    index: int
+    text: str
+    start: int
+    end: int
+    fresh: str
+
+
+class _Unit(NamedTuple):
+    lead: str  # document text between the previous unit and this one
+    text: str
+    start: int
+    end: int
+    tokens: int
+
+
+TokenCounter = Callable[[List[str]], List[int]]
+
+
+def make_token_counter(tokenizer=None) -> TokenCounter:
+    """Return a batch token counter for a Hugging Face tokenizer (e.g. `model.tokenizer`).
+
+    Without a tokenizer, words and punctuation marks are counted, which is a lower bound
+    on WordPiece/BPE token counts.
+    """
+    if tokenizer is None:
+        return lambda texts: [len(_WORD_PIECE_RE.findall(t)) for t in texts]
+
+    def count(texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        encoded = tokenizer(
+            list(texts), add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False,
+            verbose=False,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    return count
+
+
+def model_token_budget(model, default: int = 256) -> int:
+    """Tokens of text an encoder embeds without truncation (its max length minus [CLS]/[SEP])."""
+    return max(8, int(getattr(model, "max_seq_length", None) or default) - 2)
+
+
+def _split_sentences(buf: str, final: bool):
+    """Return ([(start, end)] of complete sentences in `buf`, consumed end offset)."""
+    spans = []
+    pos = 0
+    for m in _BOUNDARY_RE.finditer(buf):
+        if m.end() == len(buf) and not final:
+            break  # the boundary may continue in the next block
+        spans.append((pos, m.start()))
+        pos = m.end()
+    if final:
+        spans.append((pos, len(buf)))
+        pos = len(buf)
+    elif not spans and len(buf) > _MAX_PENDING_CHARS:
+        cut = max(buf.rfind(" ", 0, len(buf) - 1), 1)
+        spans.append((0, cut))
+        pos = cut
+    out = []
+    for s, e in spans:
+        seg = buf[s:e]
+        stripped = seg.strip()
+        if stripped:
+            s += len(seg) - len(seg.lstrip())
+            out.append((s, s + len(stripped)))
+    end = out[-1][1] if out else 0
+    return out, (end if spans else 0)
+
+
+def _split_long(unit: _Unit, max_tokens: int, count: TokenCounter) -> List[_Unit]:
+    """Split a unit over the token budget into whitespace-separated pieces within it."""
+    words = [(m.start(), m.end()) for m in re.finditer(r"\S+", unit.text)]
+    pieces = []
+    i = 0
+    while i < len(words):
+        # estimate from the unit's chars/token ratio, then shrink until the piece fits
+        chars = max(1, int(max_tokens * len(unit.text) / max(unit.tokens, 1) * 0.9))
+        j = i + 1
+        while j < len(words) and words[j][1] - words[i][0] <= chars:
+            j += 1
+        while True:
+            text = unit.text[words[i][0]:words[j - 1][1]]
+            (tokens,) = count([text])
+            if tokens <= max_tokens or j - i == 1:
+                break
+            j = i + max(1, (j - i) // 2)
+        pieces.append((words[i][0], words[j - 1][1], tokens))
+        i = j
+    out = []
+    prev = 0
+    byte = unit.start
+    for n, (s, e, tokens) in enumerate(pieces):
+        lead = unit.lead if n == 0 else unit.text[prev:s]
+        if n:
+            byte += len(lead.encode("utf-8"))
+        text = unit.text[s:e]
+        size = len(text.encode("utf-8"))
+        out.append(_Unit(lead, text, byte, byte + size, tokens))
+        byte += size
+        prev = e
+    return out
+
+
+def _iter_units(blocks: Iterable[str], count: TokenCounter, max_tokens: int) -> Iterator[_Unit]:
+    buf = ""
+    byte_pos = 0
+    blocks = iter(blocks)
+    final = False
+    while not final:
+        block = next(blocks, None)
+        if block is None:
+            final = True
+        else:
+            buf += block
+        spans, consumed = _split_sentences(buf, final)
+        if not spans:
+            continue
+        tokens = count([buf[s:e] for s, e in spans])
+        prev = 0
+        for (s, e), n_tokens in zip(spans, tokens):
+            lead = buf[prev:s]
+            text = buf[s:e]
+            start = byte_pos + len(lead.encode("utf-8"))
+            byte_pos = start + len(text.encode("utf-8"))
+            unit = _Unit(lead, text, start, byte_pos, n_tokens)
+            if n_tokens > max_tokens:
+                yield from _split_long(unit, max_tokens, count)
+            else:
+                yield unit
+            prev = e
+        buf = buf[consumed:]
+
+
+def iter_token_chunks(
+    blocks: Iterable[str], count: Optional[TokenCounter] = None, max_tokens: int = 254, overlap_tokens: int = 32
+) -> Iterator[Chunk]:
+    """Pack sentences from a stream of text blocks into chunks of at most `max_tokens` tokens."""
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError(f"overlap_tokens must be in [0, max_tokens); got {overlap_tokens}, {max_tokens}")
+    count = count or make_token_counter()
+    pending = deque()  # units of the chunk being built; the first `carried` came from the last chunk
+    carried = 0
+    budget = 0
+    index = 0
+
+    def emit():
+        units = list(pending)
+        text = units[0].text + "".join(u.lead + u.text for u in units[1:])
+        fresh = "".join(u.lead + u.text for u in units[carried:])
+        return Chunk(index, text, units[0].start, units[-1].end, fresh)
+
+    for unit in _iter_units(blocks, count, max_tokens):
+        if pending and budget + unit.tokens > max_tokens:
+            if len(pending) > carried:
+                yield emit()
+                index += 1
+            # carry trailing units into the next chunk, within the overlap budget
+            keep = 0
+            kept_tokens = 0
+            for u in reversed(pending):
+                if kept_tokens + u.tokens > overlap_tokens or kept_tokens + u.tokens + unit.tokens > max_tokens:
+                    break
+                kept_tokens += u.tokens
+                keep += 1
+            keep = min(keep, len(pending) - 1)
+            while len(pending) > keep:
+                pending.popleft()
+            carried = keep
+            budget = kept_tokens
+        pending.append(unit)
+        budget += unit.tokens
+    if len(pending) > carried:
+        yield emit()
+
+
+def iter_char_chunks(blocks: Iterable[str], chunk_size: int = 1000, overlap: int = 200) -> Iterator[Chunk]:
+    """Fixed windows of `chunk_size` characters sharing `overlap` characters (whitespace-trimmed).
+
+    Reads the whole document; use `iter_token_chunks` for large files.
+    """
+    text = "".join(blocks)
+    emitted = 0  # chars of `text` already covered by `fresh`
+    cursor = cursor_bytes = 0  # window starts only move forward, so offsets are counted incrementally
+    start = 0
+    i = 0
+    while start < len(text):
+        end = start + chunk_size
+        window = text[start:end]
+        stripped = window.strip()
+        if stripped:
+            s = start + len(window) - len(window.lstrip())
+            e = s + len(stripped)
+            cursor_bytes += len(text[cursor:s].encode("utf-8"))
+            cursor = s
+            fresh = text[emitted:e] if e > emitted else ""
+            emitted = max(emitted, e)
+            yield Chunk(i, stripped, cursor_bytes, cursor_bytes + len(stripped.encode("utf-8")), fresh)
+        i += 1
+        start = max(0, end - overlap)
@@ -0,0 +1,213 @@
+"""Exact and near-duplicate chunk detection (normalized-text hash + MinHash/LSH).
+
+Ingest checks every chunk against a `DedupIndex` of canonical chunks: a chunk whose
+normalized text hashes like a canonical one, or whose MinHash signature agrees with a
+canonical signature on at least `threshold` of its slots (an estimate of word-shingle
+Jaccard similarity), is a duplicate. Duplicates are not embedded; the chunk store links
+them to their canonical id (see `ChunkStoreWriter.link_duplicates`), so a hit on the
+canonical chunk reports every source it appears in.
+
+`collapse_hits` applies the same test to retrieved rows at query time.
+
+Usage:
+    from src.dedup import DedupIndex
+    dedup = DedupIndex()
+    canonical = dedup.add(chunk_id, text)   # None if `chunk_id` is new content
+"""
+
+import hashlib
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEDUP_FILE = "dedup.npz"
+_WORD_RE = re.compile(r"\w+")
+_MASK32 = np.uint64(0xFFFFFFFF)
+_SHINGLE_MUL = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def normalize(text: str) -> str:
+    return " ".join(_words(text))
+
+
+def _digest(words: List[str]) -> bytes:
+    return hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=16).digest()
+
+
+def text_digest(text: str) -> bytes:
+    return _digest(_words(text))
+
+
+def _shingles(words: List[str], n: int = 3) -> np.ndarray:
+    """Hashes of the word n-grams of `words` (all of them when there are fewer)."""
+    words = words or [""]
+    h = np.array([zlib.crc32(w.encode("utf-8")) for w in words], dtype="uint64")
+    n = min(n, len(h))
+    with np.errstate(over="ignore"):
+        grams = h[:len(h) - n + 1].copy()
+        for i in range(1, n):
+            grams = grams * _SHINGLE_MUL + h[i:len(h) - n + 1 + i]
+    return grams & _MASK32  # repeats do not change a minimum, so no np.unique
+
+
+class MinHasher:
+    """MinHash over word 3-gram shingles with multiply-shift hash functions."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype="uint64") | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype="uint64")
+
+    def signature(self, text: str) -> np.ndarray:
+        return self._signature(_words(text))
+
+    def _signature(self, words: List[str]) -> np.ndarray:
+        shingles = _shingles(words)
+        with np.errstate(over="ignore"):
+            # (a * x + b) mod 2^64, top 32 bits: a universal family, no big-int arithmetic
+            hashed = (self._a[:, None] * shingles[None, :] + self._b[:, None]) >> np.uint64(32)
+        return (hashed & _MASK32).min(axis=1).astype("uint32")
+
+
+def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return float(np.mean(sig_a == sig_b))
+
+
+class DedupIndex:
+    """Canonical chunks by exact digest and by MinHash LSH bands."""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 8):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm)
+        self._rows = num_perm // bands
+        self._exact = {}  # digest -> canonical id
+        self._digests = {}  # canonical id -> digest
+        self._signatures = {}  # canonical id -> signature
+        self._buckets = {}  # (band, band bytes) -> [canonical ids]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self._rows:(band + 1) * self._rows].tobytes()
+
+    def find(self, text: str, digest: Optional[bytes] = None, signature: Optional[np.ndarray] = None) -> Optional[int]:
+        """Return the canonical id that `text` duplicates, or None."""
+        digest = digest if digest is not None else text_digest(text)
+        hit = self._exact.get(digest)
+        if hit is not None:
+            return hit
+        signature = signature if signature is not None else self.hasher.signature(text)
+        best, best_sim = None, self.threshold
+        seen = set()
+        for key in self._band_keys(signature):
+            for cid in self._buckets.get(key, ()):
+                if cid in seen:
+                    continue
+                seen.add(cid)
+                sim = similarity(signature, self._signatures[cid])
+                if sim >= best_sim and (best is None or sim > best_sim or cid < best):
+                    best, best_sim = cid, sim
+        return best
+
+    def add(self, chunk_id: int, text: str) -> Optional[int]:
+        """Register `chunk_id` as canonical unless it duplicates one; returns that canonical id."""
+        words = _words(text)
+        digest = _digest(words)
+        canonical = self._exact.get(digest)
+        if canonical is not None:
+            return canonical
+        signature = self.hasher._signature(words)
+        canonical = self.find(text, digest, signature)
+        if canonical is None:
+            self._insert(chunk_id, digest, signature)
+        return canonical
+
+    def _insert(self, chunk_id: int, digest: bytes, signature: np.ndarray):
+        self._exact.setdefault(digest, chunk_id)
+        self._digests[chunk_id] = digest
+        self._signatures[chunk_id] = signature
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(chunk_id)
+
+    def is_canonical(self, chunk_id: int) -> bool:
+        return chunk_id in self._signatures
+
+    def remove(self, chunk_id: int, replacement: Optional[int] = None):
+        """Drop a canonical chunk; with `replacement`, that chunk takes over its entry."""
+        digest = self._digests.pop(chunk_id, None)
+        if digest is None:
+            return
+        signature = self._signatures.pop(chunk_id)
+        if self._exact.get(digest) == chunk_id:
+            del self._exact[digest]
+        for key in self._band_keys(signature):
+            bucket = self._buckets[key]
+            bucket.remove(chunk_id)
+            if not bucket:
+                del self._buckets[key]
+        if replacement is not None:
+            self._insert(replacement, digest, signature)
+
+    def save(self, path):
+        path = Path(path)
+        ids = np.array(sorted(self._signatures), dtype="int64")
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            tmp,
+            ids=ids,
+            digests=np.frombuffer(b"".join(self._digests[i] for i in ids), dtype="uint8").reshape(-1, 16),
+            signatures=np.array([self._signatures[i] for i in ids], dtype="uint32").reshape(len(ids), -1),
+            config=np.array([self.threshold, self.hasher.num_perm, self.bands]),
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path) -> "DedupIndex":
+        with np.load(path) as data:
+            threshold, num_perm, bands = data["config"]
+            index = cls(float(threshold), int(num_perm), int(bands))
+            for chunk_id, digest, signature in zip(data["ids"], data["digests"], data["signatures"]):
+                index._insert(int(chunk_id), digest.tobytes(), signature)
+        return index
+
+
+def collapse_hits(rows: List[Dict], top_k: int, threshold: float = 0.8, hasher: Optional[MinHasher] = None) -> List[Dict]:
+    """Merge retrieved rows whose text duplicates a better-ranked row; keep the first `top_k`.
+
+    A merged row's `sources` are added to the row it duplicates.
+    """
+    hasher = hasher or _DEFAULT_HASHER
+    kept, kept_keys = [], []
+    for row in rows:
+        words = _words(row.get("text") or "")
+        digest, signature = _digest(words), hasher._signature(words)
+        for other, (other_digest, other_sig) in zip(kept, kept_keys):
+            if digest == other_digest or similarity(signature, other_sig) >= threshold:
+                sources = other.setdefault("sources", [other.get("source")])
+                for source in row.get("sources") or [row.get("source")]:
+                    if source not in sources:
+                        sources.append(source)
+                break
+        else:
+            if len(kept) == top_k:
+                break
+            kept.append(row)
+            kept_keys.append((digest, signature))
+    return kept
+
+
+_DEFAULT_HASHER = MinHasher()
@@ -0,0 +1,347 @@
+"""Persistent embedding cache shared by ingest runs, keyed by (model, chunk text hash).
+
+Re-chunking, rebuilding an index or re-running ingest in CI embeds mostly text that was
+embedded before. `EmbeddingCache` keeps every vector it has seen in a directory:
+
+- `vectors-<model hash>.<generation>.f32`: append-only float32 rows, one file per model
+  (read through `np.memmap`, so only the rows looked up are paged in);
+- `index.sqlite`: the hash index, (model, text hash) -> row, with created / last-used
+  times, and per-model encode totals used to estimate the time hits save.
+
+The text hash is a BLAKE2b digest of the NFC-normalized text with whitespace runs
+collapsed, so chunks differing only in layout share a vector. Appends and evictions take
+an exclusive `flock` on `lock`, lookups a shared one, so concurrent ingest processes can
+share a cache. Evicting by model or by age drops the index rows and rewrites the
+affected vector files into a new generation.
+
+Ingest wraps its encoder in `CachedEncoder`: each batch is looked up in bulk and only the
+misses reach `model.encode` (`--embedding-cache`, default `artifacts/embedding_cache`).
+
+Usage:
+    python -m src.embedding_cache stats
+    python -m src.embedding_cache evict --model all-MiniLM-L6-v2
+    python -m src.embedding_cache evict --older-than-days 30
+"""
+
+import argparse
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src import metrics
+
+try:
+    import fcntl
+except Exception:  # not on POSIX: a single process at a time
+    fcntl = None
+
+DEFAULT_DIR = "artifacts/embedding_cache"
+INDEX_FILE = "index.sqlite"
+LOCK_FILE = "lock"
+_DTYPE = np.dtype("<f4")
+# SQLite's default limit on bound parameters is 999
+_LOOKUP_BATCH = 900
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """NFC-normalized text with whitespace runs collapsed to one space."""
+    return _SPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """On-disk (model, text hash) -> float32 vector store; see the module docstring."""
+
+    def __init__(self, path=DEFAULT_DIR):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+        self._lock = threading.Lock()
+        self._lock_file = open(self.path / LOCK_FILE, "a+b")
+        self._maps = {}  # file name -> (inode, memmap)
+        self._conn = sqlite3.connect(str(self.path / INDEX_FILE), check_same_thread=False, timeout=60.0,
+                                     isolation_level=None)
+        with self._locked(exclusive=True):
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, dim INTEGER NOT NULL, file TEXT NOT NULL, "
+                "encoded INTEGER NOT NULL DEFAULT 0, encode_seconds REAL NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (model TEXT NOT NULL, key BLOB NOT NULL, row INTEGER NOT NULL, "
+                "created REAL NOT NULL, used REAL NOT NULL, PRIMARY KEY (model, key)) WITHOUT ROWID"
+            )
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _model(self, model: str) -> Optional[Tuple[int, str]]:
+        row = self._conn.execute("SELECT dim, file FROM models WHERE model = ?", (model,)).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def _rows(self, file: str, dim: int) -> np.ndarray:
+        st = (self.path / file).stat()
+        n = st.st_size // (dim * _DTYPE.itemsize)
+        inode, vectors = self._maps.get(file, (None, None))
+        # another process may have appended, or evicted the model and started the file over
+        if vectors is None or inode != st.st_ino or len(vectors) < n:
+            vectors = np.memmap(self.path / file, dtype=_DTYPE, mode="r", shape=(n, dim))
+            self._maps[file] = (st.st_ino, vectors)
+        return vectors
+
+    def lookup(self, model: str, keys: Sequence[bytes]) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """(vectors, found) for `keys`: rows of `vectors` are valid where `found` is True.
+
+        `vectors` is None when nothing is cached for `model`.
+        """
+        found = np.zeros(len(keys), dtype=bool)
+        with self._locked(exclusive=False):
+            meta = self._model(model)
+            if meta is None or not len(keys):
+                return None, found
+            dim, file = meta
+            rows = np.full(len(keys), -1, dtype="int64")
+            position = {}
+            for n, key in enumerate(keys):
+                position.setdefault(key, []).append(n)
+            unique = list(position)
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                part = unique[start:start + _LOOKUP_BATCH]
+                marks = ",".join("?" * len(part))
+                for key, row in self._conn.execute(
+                    f"SELECT key, row FROM entries WHERE model = ? AND key IN ({marks})", [model, *part]
+                ):
+                    rows[position[bytes(key)]] = row
+            found = rows >= 0
+            vectors = np.zeros((len(keys), dim), dtype=_DTYPE)
+            if found.any():
+                stored = self._rows(file, dim)
+                vectors[found] = stored[rows[found]]
+                hit_keys = [key for key in unique if rows[position[key][0]] >= 0]
+                now = time.time()
+                for start in range(0, len(hit_keys), _LOOKUP_BATCH):
+                    part = hit_keys[start:start + _LOOKUP_BATCH]
+                    self._conn.execute(
+                        f"UPDATE entries SET used = ? WHERE model = ? AND key IN ({','.join('?' * len(part))})",
+                        [now, model, *part],
+                    )
+        return vectors, found
+
+    def add(self, model: str, keys: Sequence[bytes], vectors: np.ndarray, encode_seconds: float = 0.0):
+        """Append `vectors` for `keys` (keys already cached keep their first vector)."""
+        vectors = np.ascontiguousarray(vectors, dtype=_DTYPE)
+        if not len(keys):
+            return
+        with self._locked(exclusive=True):
+            meta = self._model(model)
+            if meta is None:
+                dim, file = vectors.shape[1], f"vectors-{hashlib.sha1(model.encode()).hexdigest()[:16]}.0.f32"
+                self._conn.execute("INSERT INTO models (model, dim, file) VALUES (?, ?, ?)", (model, dim, file))
+            else:
+                dim, file = meta
+            if vectors.shape[1] != dim:
+                raise ValueError(f"{model}: cached vectors have dimension {dim}, got {vectors.shape[1]}")
+            row_bytes = dim * _DTYPE.itemsize
+            with open(self.path / file, "ab") as f:
+                first, torn = divmod(f.tell(), row_bytes)
+                if torn:  # a partial row from a writer that crashed mid-append
+                    f.truncate(first * row_bytes)
+                f.write(vectors.tobytes())
+            now = time.time()
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entries (model, key, row, created, used) VALUES (?, ?, ?, ?, ?)",
+                [(model, key, first + n, now, now) for n, key in enumerate(keys)],
+            )
+            self._conn.execute(
+                "UPDATE models SET encoded = encoded + ?, encode_seconds = encode_seconds + ? WHERE model = ?",
+                (len(keys), encode_seconds, model),
+            )
+            self._conn.execute("COMMIT")
+
+    def encode(self, encoder, model: str, texts: List[str], **kwargs) -> np.ndarray:
+        """`encoder.encode(texts)` served from the cache where possible; misses are added."""
+        if not texts:
+            return encoder.encode(texts, **kwargs)
+        keys = [text_key(t) for t in texts]
+        vectors, found = self.lookup(model, keys)
+        # texts repeated within the batch are encoded once
+        first = {}
+        for i in np.flatnonzero(~found):
+            first.setdefault(keys[i], int(i))
+        self.hits += len(texts) - len(first)
+        self.misses += len(first)
+        metrics.inc("rag_embedding_cache_hits_total", len(texts) - len(first))
+        metrics.inc("rag_embedding_cache_misses_total", len(first))
+        if not first:
+            return vectors
+        t0 = time.perf_counter()
+        encoded = np.asarray(encoder.encode([texts[i] for i in first.values()], **kwargs), dtype=_DTYPE)
+        elapsed = time.perf_counter() - t0
+        self.encode_seconds += elapsed
+        self.add(model, list(first), encoded, elapsed)
+        if vectors is None:
+            vectors = np.zeros((len(texts), encoded.shape[1]), dtype=_DTYPE)
+        row = {key: n for n, key in enumerate(first)}
+        missing = np.flatnonzero(~found)
+        vectors[missing] = encoded[[row[keys[i]] for i in missing]]
+        return vectors
+
+    def reset_stats(self):
+        self.hits = self.misses = 0
+        self.encode_seconds = 0.0
+
+    def seconds_per_text(self, model: str) -> Optional[float]:
+        row = self._conn.execute("SELECT encoded, encode_seconds FROM models WHERE model = ?", (model,)).fetchone()
+        return row[1] / row[0] if row and row[0] else None
+
+    def report(self, model: str) -> Dict:
+        """Hit rate of the lookups since `reset_stats` and the encode time the hits saved
+        (estimated from the model's mean encode time per text)."""
+        total = self.hits + self.misses
+        per_text = self.seconds_per_text(model)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "encode_seconds": self.encode_seconds,
+            "saved_seconds": self.hits * per_text if per_text is not None else None,
+        }
+
+    def evict(self, model: Optional[str] = None, older_than: Optional[float] = None) -> int:
+        """Drop the vectors of `model` and/or those unused for `older_than` seconds.
+
+        Returns the number of entries removed; the remaining rows of affected models are
+        compacted into new vector files.
+        """
+        if model is None and older_than is None:
+            raise ValueError("evict needs a model, an age, or both")
+        where, args = [], []
+        if model is not None:
+            where.append("model = ?")
+            args.append(model)
+        if older_than is not None:
+            where.append("used < ?")
+            args.append(time.time() - older_than)
+        with self._locked(exclusive=True):
+            clause = " AND ".join(where)
+            affected = [m for (m,) in self._conn.execute(f"SELECT DISTINCT model FROM entries WHERE {clause}", args)]
+            if model is not None and self._model(model) is not None and model not in affected:
+                affected.append(model)
+            self._conn.execute("BEGIN")
+            removed = self._conn.execute(f"DELETE FROM entries WHERE {clause}", args).rowcount
+            self._conn.execute("COMMIT")
+            for name in affected:
+                self._compact(name)
+        return removed
+
+    def _compact(self, model: str):
+        dim, file = self._model(model)
+        live = self._conn.execute("SELECT key, row FROM entries WHERE model = ? ORDER BY row", (model,)).fetchall()
+        self._maps.pop(file, None)
+        if not live:
+            self._conn.execute("DELETE FROM models WHERE model = ?", (model,))
+            (self.path / file).unlink(missing_ok=True)
+            return
+        stem, generation, suffix = file.rsplit(".", 2)
+        new_file = f"{stem}.{int(generation) + 1}.{suffix}"
+        old = self._rows(file, dim)
+        self._maps.pop(file, None)
+        rows = np.array([row for _, row in live], dtype="int64")
+        with open(self.path / new_file, "wb") as f:
+            for start in range(0, len(rows), 65536):
+                f.write(np.ascontiguousarray(old[rows[start:start + 65536]]).tobytes())
+        del old
+        self._conn.execute("BEGIN")
+        self._conn.executemany("UPDATE entries SET row = ? WHERE model = ? AND key = ?",
+                               [(n, model, key) for n, (key, _) in enumerate(live)])
+        self._conn.execute("UPDATE models SET file = ? WHERE model = ?", (new_file, model))
+        self._conn.execute("COMMIT")
+        (self.path / file).unlink(missing_ok=True)
+
+    def stats(self) -> List[Dict]:
+        """Per model: cached entries, vector file bytes and mean encode time per text."""
+        out = []
+        with self._locked(exclusive=False):
+            for model, dim, file, encoded, seconds in self._conn.execute(
+                "SELECT model, dim, file, encoded, encode_seconds FROM models ORDER BY model"
+            ).fetchall():
+                (n,) = self._conn.execute("SELECT COUNT(*) FROM entries WHERE model = ?", (model,)).fetchone()
+                path = self.path / file
+                out.append({
+                    "model": model, "dim": dim, "entries": n, "bytes": path.stat().st_size if path.exists() else 0,
+                    "ms_per_text": 1000.0 * seconds / encoded if encoded else None,
+                })
+        return out
+
+    def close(self):
+        self._maps.clear()
+        self._conn.close()
+        self._lock_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CachedEncoder:
+    """Encoder wrapper whose `encode` goes through an `EmbeddingCache` under `model_key`.
+
+    Other attributes (tokenizer, dimension, ...) are those of the wrapped encoder.
+    """
+
+    def __init__(self, encoder, cache: EmbeddingCache, model_key: str):
+        self.encoder = encoder
+        self.cache = cache
+        self.model_key = model_key
+
+    def __getattr__(self, name):
+        return getattr(self.encoder, name)
+
+    def encode(self, sentences, **kwargs):
+        return self.cache.encode(self.encoder, self.model_key, list(sentences), **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-dir", default=DEFAULT_DIR, help="Embedding cache directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Entries, size and encode cost per model")
+    evict = sub.add_parser("evict", help="Drop cached vectors by model and/or age")
+    evict.add_argument("--model", default=None, help="Cache key of the model (name, or name@backend)")
+    evict.add_argument("--older-than-days", type=float, default=None, help="Drop entries unused for this long")
+    args = parser.parse_args()
+
+    with EmbeddingCache(args.cache_dir) as cache:
+        if args.command == "stats":
+            for row in cache.stats():
+                ms = f"{row['ms_per_text']:.2f} ms/text" if row["ms_per_text"] is not None else "-"
+                print(f"{row['model']}: {row['entries']} vectors (dim {row['dim']}), "
+                      f"{row['bytes'] / 1e6:.1f} MB, encode {ms}")
+        else:
+            older_than = args.older_than_days * 86400.0 if args.older_than_days is not None else None
+            print(f"Evicted {cache.evict(args.model, older_than)} entries")
@@ -0,0 +1,306 @@
+"""Embedding backends behind the `SentenceTransformer.encode` interface.
+
+Ingest, query, the server and the Streamlit app get their encoder from
+`load_encoder(model_name, backend)`; nothing imports torch or sentence-transformers
+until a backend that needs them is loaded.
+
+- `torch`: the sentence-transformers model (the default, and the reference).
+- `torch-int8`: the same model with its linear layers dynamically quantized to int8.
+- `onnx` / `onnx-int8`: an ONNX export of the transformer run by onnxruntime, with the
+  `tokenizers` fast tokenizer and numpy pooling. Loading it imports neither torch nor
+  transformers, so a cold CLI start takes a fraction of the time.
+
+`export_onnx` writes the export (once, with torch): `model.onnx`, its dynamically
+int8-quantized copy `model.int8.onnx`, `tokenizer.json` and `encoder.json` (pooling,
+normalization, max length). It checks that each variant reproduces the reference
+embeddings: an index built by `ingest.py` with one backend can be queried with another
+as long as the cosine similarity stays above `MIN_COSINE`. The `bench` command reports
+cold start (a fresh interpreter importing and loading the backend), encode throughput
+and agreement for each backend.
+
+Usage:
+    python -m src.embeddings export --model all-MiniLM-L6-v2
+    python -m src.query --backend onnx-int8
+    python -m src.embeddings bench --model all-MiniLM-L6-v2 --backends torch,torch-int8,onnx,onnx-int8
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+import warnings
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+DEFAULT_BACKEND = "torch"
+ONNX_ROOT = Path("artifacts/onnx")
+ENCODER_FILE = "encoder.json"
+# embeddings of a backend are interchangeable with the reference above this cosine similarity
+MIN_COSINE = 0.99
+
+_WORDS = (
+    "retrieval grounding citation index vector chunk token answer source policy document search query model "
+    "latency cache budget shard embedding ranking fusion recall precision prompt context evidence summary"
+).split()
+
+
+def encoder_key(model_name: str, backend: str = DEFAULT_BACKEND) -> str:
+    """Names the vectors an encoder produces, for embedding caches: `model` or `model@backend`."""
+    return model_name if backend == DEFAULT_BACKEND else f"{model_name}@{backend}"
+
+
+def default_onnx_dir(model_name: str) -> Path:
+    """Where `export_onnx` puts the export of `model_name` unless told otherwise."""
+    if (Path(model_name) / ENCODER_FILE).exists():
+        return Path(model_name)
+    return ONNX_ROOT / model_name.replace("/", "__")
+
+
+def load_encoder(model_name: str, backend: str = DEFAULT_BACKEND, onnx_dir=None):
+    """Return an encoder with `encode`, `get_sentence_embedding_dimension` and `tokenizer`."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {BACKENDS}")
+    if backend.startswith("onnx"):
+        return OnnxEncoder(onnx_dir or default_onnx_dir(model_name), int8=backend == "onnx-int8")
+    try:
+        from sentence_transformers import SentenceTransformer
+    except Exception as e:
+        raise RuntimeError("sentence-transformers is required for the torch backends") from e
+    model = SentenceTransformer(model_name)
+    if backend == "torch-int8":
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+
+        with warnings.catch_warnings():  # eager-mode quantization is deprecated in favour of torchao
+            warnings.simplefilter("ignore")
+            model = quantize_dynamic(model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class FastTokenizer:
+    """Callable `tokenizers.Tokenizer` wrapper shaped like a Hugging Face tokenizer.
+
+    Covers what `src.chunker.make_token_counter` needs and pickles for the parse workers.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._load()
+
+    def _load(self):
+        try:
+            from tokenizers import Tokenizer
+        except Exception as e:
+            raise RuntimeError("The tokenizers package is required for the onnx backends") from e
+        self._tokenizer = Tokenizer.from_file(self.path)
+        self._tokenizer.no_truncation()
+        self._tokenizer.no_padding()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._load()
+
+    def __call__(self, texts, add_special_tokens: bool = True, **kwargs) -> Dict[str, List[List[int]]]:
+        encodings = self._tokenizer.encode_batch(list(texts), add_special_tokens=add_special_tokens)
+        return {"input_ids": [e.ids for e in encodings]}
+
+
+class OnnxEncoder:
+    """Runs an `export_onnx` directory with onnxruntime; mirrors `SentenceTransformer.encode`."""
+
+    def __init__(self, path, int8: bool = False, threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except Exception as e:
+            raise RuntimeError("onnxruntime is required for the onnx backends (pip install onnxruntime)") from e
+        path = Path(path)
+        if not (path / ENCODER_FILE).exists():
+            raise RuntimeError(f"No ONNX export in {path}; run python -m src.embeddings export first")
+        self.config = json.loads((path / ENCODER_FILE).read_text(encoding="utf-8"))
+        self.model_name = self.config["model"]
+        self.max_seq_length = self.config["max_seq_length"]
+        self.tokenizer = FastTokenizer(path / "tokenizer.json")
+        self._tokenizer = FastTokenizer(path / "tokenizer.json")._tokenizer
+        self._tokenizer.enable_truncation(self.max_seq_length)
+        self._tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = path / ("model.int8.onnx" if int8 else "model.onnx")
+        self.session = ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        mode = self.config["pooling"]
+        if mode == "cls":
+            return hidden[:, 0]
+        if mode == "max":
+            return np.where(mask[:, :, None] > 0, hidden, -1e9).max(axis=1)
+        weights = mask[:, :, None].astype("float32")
+        return (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+    def encode(self, sentences, batch_size: int = 32, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Embed `sentences` (float32 rows); other `SentenceTransformer.encode` options are ignored."""
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size, normalize_embeddings)[0]
+        sentences = list(sentences)
+        out = np.zeros((len(sentences), self.config["dim"]), dtype="float32")
+        # similar lengths share a batch, so little of each batch is padding
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            encodings = self._tokenizer.encode_batch([sentences[i] for i in rows])
+            mask = np.array([e.attention_mask for e in encodings], dtype="int64")
+            feeds = {"input_ids": np.array([e.ids for e in encodings], dtype="int64"), "attention_mask": mask}
+            if "token_type_ids" in self._inputs:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype="int64")
+            hidden = self.session.run(None, feeds)[0]
+            out[rows] = self._pool(hidden, mask)
+        if self.config["normalize"] or normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+def sample_texts(n: int = 256, seed: int = 0) -> List[str]:
+    """Deterministic sentences of 5-60 words for agreement checks and throughput runs."""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(5, 60))) + "." for _ in range(n)]
+
+
+def agreement(reference: np.ndarray, other: np.ndarray) -> float:
+    """Smallest cosine similarity between matching rows of two embedding matrices."""
+    ref = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    oth = other / np.maximum(np.linalg.norm(other, axis=1, keepdims=True), 1e-12)
+    return float((ref * oth).sum(axis=1).min())
+
+
+def export_onnx(model_name: str, out_dir=None, int8: bool = True, opset: int = 17) -> Dict[str, float]:
+    """Export `model_name` for the onnx backends; returns each variant's `agreement`."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = Path(out_dir) if out_dir else default_onnx_dir(model_name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu").eval()
+    transformer, pooling = model[0], model[1]
+    tokenizer = model.tokenizer
+    if not getattr(tokenizer, "is_fast", False):
+        raise RuntimeError(f"{model_name} has no fast tokenizer; the onnx backends need tokenizer.json")
+    tokenizer.backend_tokenizer.save(str(out_dir / "tokenizer.json"))
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in tokenizer.model_input_names]
+
+    class Wrapper(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    dummy = tokenizer(["an example sentence", "another one"], padding=True, return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            Wrapper(transformer.auto_model), tuple(dummy[n] for n in input_names), str(out_dir / "model.onnx"),
+            input_names=input_names, output_names=["last_hidden_state"], opset_version=opset, dynamo=False,
+            dynamic_axes={n: {0: "batch", 1: "sequence"} for n in input_names + ["last_hidden_state"]},
+        )
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(out_dir / "model.onnx"), str(out_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    pooling_mode = pooling.get_pooling_mode_str() if hasattr(pooling, "get_pooling_mode_str") else "mean"
+    config = {
+        "model": model_name,
+        "dim": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pooling": pooling_mode if pooling_mode in ("cls", "max") else "mean",
+        "normalize": any(type(module).__name__ == "Normalize" for module in model),
+        "pad_id": tokenizer.pad_token_id or 0,
+        "pad_token": tokenizer.pad_token or "[PAD]",
+        "inputs": input_names,
+    }
+    (out_dir / ENCODER_FILE).write_text(json.dumps(config, indent=2), encoding="utf-8")
+
+    texts = sample_texts()
+    reference = model.encode(texts, convert_to_numpy=True)
+    scores = {}
+    for backend in ("onnx", "onnx-int8") if int8 else ("onnx",):
+        scores[backend] = agreement(reference, OnnxEncoder(out_dir, int8=backend == "onnx-int8").encode(texts))
+    config["agreement"] = scores
+    (out_dir / ENCODER_FILE).write_text(json.dumps(config, indent=2), encoding="utf-8")
+    return scores
+
+
+def cold_start_seconds(model_name: str, backend: str, onnx_dir=None) -> float:
+    """Seconds for a fresh interpreter to import the backend, load it and embed one query."""
+    code = (
+        "import time; t0 = time.perf_counter(); from src.embeddings import load_encoder; "
+        f"load_encoder({model_name!r}, {backend!r}, {None if onnx_dir is None else str(onnx_dir)!r})"
+        ".encode(['warm up']); print(time.perf_counter() - t0)"
+    )
+    root = Path(__file__).resolve().parents[1]
+    out = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def benchmark(model_name: str, backends=BACKENDS, n: int = 1024, batch_size: int = 32, onnx_dir=None) -> List[Dict]:
+    """Cold start, encode throughput and agreement with the first backend, per backend."""
+    texts = sample_texts(n)
+    rows, reference = [], None
+    for backend in backends:
+        encoder = load_encoder(model_name, backend, onnx_dir)
+        encoder.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+        t0 = time.perf_counter()
+        vectors = np.asarray(encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype="float32")
+        elapsed = time.perf_counter() - t0
+        reference = vectors if reference is None else reference
+        rows.append({
+            "backend": backend,
+            "cold_start_s": cold_start_seconds(model_name, backend, onnx_dir),
+            "texts_per_s": n / elapsed,
+            "min_cosine": agreement(reference, vectors),
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Export a sentence-transformers model for the onnx backends")
+    export.add_argument("--model", default="all-MiniLM-L6-v2")
+    export.add_argument("--out", default=None, help="Export directory (default: artifacts/onnx/<model>)")
+    export.add_argument("--no-int8", dest="int8", action="store_false", help="Skip the int8-quantized copy")
+    bench = sub.add_parser("bench", help="Compare cold start, throughput and agreement of backends")
+    bench.add_argument("--model", default="all-MiniLM-L6-v2")
+    bench.add_argument("--onnx-dir", default=None)
+    bench.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated; the first is the reference")
+    bench.add_argument("--texts", type=int, default=1024)
+    bench.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+    if args.command == "export":
+        scores = export_onnx(args.model, args.out, int8=args.int8)
+        print(f"Exported {args.model} to {args.out or default_onnx_dir(args.model)}")
+        for backend, score in scores.items():
+            status = "ok" if score >= MIN_COSINE else f"below {MIN_COSINE}: rebuild indexes with this backend"
+            print(f"  {backend}: min cosine vs torch {score:.4f} ({status})")
+    else:
+        print(f"{'backend':<12} {'cold start':>11} {'texts/s':>9} {'min cosine':>11}")
+        for row in benchmark(args.model, args.backends.split(","), args.texts, args.batch_size, args.onnx_dir):
+            print(
+                f"{row['backend']:<12} {row['cold_start_s']:>10.2f}s {row['texts_per_s']:>9.0f} "
+                f"{row['min_cosine']:>11.4f}"
+            )
@@ -0,0 +1,415 @@
+"""Metadata filters: filter expressions, a per-file attribute index and filtered search.
+
+Ingest records the attributes of every file (see `file_attributes`): its path, relative
+path, extension, mtime and tags from `--tag PATTERN=t1,t2` globs. The chunk store keeps
+them once per file plus the file row of each chunk (`files.jsonl`, `chunk_files.bin`,
+see `src.chunk_store`). `FilterIndex` turns an expression into a boolean mask over chunk
+ids by evaluating it on the (few) file rows and gathering through the chunk column.
+
+Expressions combine terms with `and` (also implicit), `or`, `not` and parentheses:
+
+    path:docs/policies          source or data-dir-relative path starts with the prefix
+    ext:md,pdf                  extension is one of
+    tag:hr,legal                file carries any of the tags
+    mtime>=2024-01-01           modified at/after (>, >=, <, <=; ISO date/datetime or epoch)
+
+Values containing spaces or parentheses are double-quoted (`path:"My Docs/"`).
+
+`search_filtered` keeps the filtered top-k exact instead of post-filtering an
+unfiltered top-k: selections of at most `EXACT_MAX` vectors are scanned exactly, larger
+ones search the ANN index with a FAISS `IDSelectorBitmap`, probing IVF partitions in
+proportion to how selective the filter is; rows that come back short are rerun exactly.
+
+Usage:
+    from src.filters import filter_index, search_filtered
+    index_filter = filter_index(store)
+    mask = index_filter.select_vectors("ext:md and mtime>=2024-01-01")
+    D, I = search_filtered(index, query_vectors, 5, mask)
+"""
+
+import fnmatch
+import math
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.ann_index import RerankIndex
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+FIELDS = ("path", "ext", "tag", "mtime")
+# selections of at most this many vectors are searched by brute force
+EXACT_MAX = 4096
+_CACHE_SIZE = 64
+_COMPARISONS = (">=", "<=", ">", "<")
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|([A-Za-z_]+\s*(?:>=|<=|>|<|=|:)\s*(?:"[^"]*"|[^\s()"]+))|([^\s()]+))')
+_TERM_RE = re.compile(r'([A-Za-z_]+)\s*(>=|<=|>|<|=|:)\s*(.*)', re.S)
+
+
+def tags_for(rel_path: str, tags: Optional[Dict[str, List[str]]]) -> List[str]:
+    """Sorted tags of every glob in `tags` ({pattern: [tag, ...]}) matching `rel_path`."""
+    found = set()
+    for pattern, names in (tags or {}).items():
+        if fnmatch.fnmatch(rel_path, pattern):
+            found.update(names)
+    return sorted(found)
+
+
+def file_attributes(path, st, data_dir=None, tags: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """Filterable attributes of a file; `st` is its `os.stat_result`."""
+    path = Path(path)
+    try:
+        rel = path.relative_to(data_dir).as_posix() if data_dir is not None else path.as_posix()
+    except ValueError:
+        rel = path.as_posix()
+    return {
+        "source": str(path),
+        "rel": rel,
+        "ext": path.suffix.lower().lstrip("."),
+        "mtime": st.st_mtime,
+        "tags": tags_for(rel, tags),
+    }
+
+
+def parse_tags(specs: Iterable[str]) -> Dict[str, List[str]]:
+    """Parse `PATTERN=tag1,tag2` specs (as given to `--tag`) into {pattern: [tags]}."""
+    tags = {}
+    for spec in specs:
+        pattern, sep, names = spec.rpartition("=")
+        names = [n.strip() for n in names.split(",") if n.strip()]
+        if not sep or not pattern or not names:
+            raise ValueError(f"tag spec must look like PATTERN=tag1,tag2; got {spec!r}")
+        tags.setdefault(pattern, [])
+        tags[pattern] += [n for n in names if n not in tags[pattern]]
+    return tags
+
+
+def _tokens(expr: str) -> List[str]:
+    tokens, pos = [], 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = _TOKEN_RE.match(expr, pos)
+        if m is None or m.end() == pos:
+            raise ValueError(f"cannot parse filter at {expr[pos:]!r}")
+        tokens.append(next(g for g in m.groups() if g is not None))
+        pos = m.end()
+    return tokens
+
+
+def _timestamp(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"mtime must be an ISO date/datetime or epoch seconds; got {value!r}") from None
+
+
+def _term(token: str) -> Tuple:
+    m = _TERM_RE.fullmatch(token)
+    if m is None:
+        raise ValueError(f"expected FIELD:VALUE or mtime>=DATE in filter; got {token!r}")
+    field, op, value = m.group(1).lower(), m.group(2), m.group(3).strip('"')
+    if field not in FIELDS:
+        raise ValueError(f"unknown filter field {field!r}; expected one of {', '.join(FIELDS)}")
+    if field == "mtime":
+        if op not in _COMPARISONS:
+            raise ValueError(f"mtime takes one of {', '.join(_COMPARISONS)}; got {token!r}")
+        return ("term", field, op, _timestamp(value))
+    if op not in (":", "="):
+        raise ValueError(f"{field} takes FIELD:VALUE; got {token!r}")
+    if field == "path":
+        return ("term", field, op, value[2:] if value.startswith("./") else value)
+    values = [v.strip().lower().lstrip(".") if field == "ext" else v.strip() for v in value.split(",")]
+    return ("term", field, op, frozenset(v for v in values if v))
+
+
+def parse(expr: str) -> Tuple:
+    """Parse a filter expression into a tuple tree; raises ValueError on bad syntax."""
+    tokens = _tokens(expr)
+    if not tokens:
+        raise ValueError("empty filter expression")
+    pos = 0
+
+    def peek():
+        return tokens[pos].lower() if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == "or":
+            take()
+            node = ("or", node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() not in (None, "or", ")"):
+            if peek() == "and":
+                take()
+            node = ("and", node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() == "not":
+            take()
+            return ("not", parse_not())
+        if peek() == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError(f"missing ')' in filter {expr!r}")
+            take()
+            return node
+        if peek() in (None, ")", "and", "or"):
+            raise ValueError(f"expected a filter term in {expr!r}")
+        return _term(take())
+
+    tree = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"unexpected {tokens[pos]!r} in filter {expr!r}")
+    return tree
+
+
+def _quote(value: str) -> str:
+    return f'"{value}"' if re.search(r'[\s()]', value) else value
+
+
+def build_expression(path: str = "", ext: Iterable[str] = (), since: str = "", until: str = "",
+                     tags: Iterable[str] = ()) -> str:
+    """Expression ANDing the given constraints (empty arguments are skipped)."""
+    terms = []
+    if path:
+        terms.append(f"path:{_quote(path)}")
+    ext = [e.strip().lstrip(".") for e in ext if e.strip()]
+    if ext:
+        terms.append("ext:" + ",".join(ext))
+    tags = [t.strip() for t in tags if t.strip()]
+    if tags:
+        terms.append("tag:" + _quote(",".join(tags)))
+    if since:
+        terms.append(f"mtime>={since}")
+    if until:
+        terms.append(f"mtime<{until}")
+    return " and ".join(terms)
+
+
+class FilterIndex:
+    """Columnar file attributes of a chunk store, evaluated into chunk-id masks.
+
+    `chunk_files[chunk_id]` is the row in `files` of the chunk's file (-1: none), `live`
+    marks stored chunks and `links` maps duplicate chunks to their canonical chunk.
+    Masks of the last few expressions are cached.
+    """
+
+    def __init__(self, chunk_files: np.ndarray, files: List[Dict], live: Optional[np.ndarray] = None,
+                 links: Optional[Dict[int, int]] = None):
+        self.chunk_files = np.asarray(chunk_files, dtype="int64")
+        self.files = files
+        n = len(self.chunk_files)
+        self._has_file = self.chunk_files >= 0
+        if live is not None:
+            self._has_file &= np.asarray(live, dtype=bool)[:n]
+        self._rows = np.where(self._has_file, self.chunk_files, 0)
+        self._source = [str(f.get("source", "")) for f in files]
+        self._rel = [str(f.get("rel") or "") for f in files]
+        self._ext = np.array([f.get("ext", "") for f in files], dtype=object)
+        self._mtime = np.array([f.get("mtime", np.nan) for f in files], dtype="float64")
+        self._tags = [frozenset(f.get("tags") or ()) for f in files]
+        links = {d: c for d, c in (links or {}).items() if 0 <= d < n and 0 <= c < n}
+        self._dup = np.fromiter(links.keys(), dtype="int64", count=len(links))
+        self._canon = np.fromiter(links.values(), dtype="int64", count=len(links))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store) -> "FilterIndex":
+        """Read the attribute columns of a chunk store, `ShardedStore` or legacy store.
+
+        Stores written before attributes were recorded fall back to the `source` of each
+        record (path and extension filters only).
+        """
+        table = store.file_attributes() if hasattr(store, "file_attributes") else None
+        links = store.duplicate_links() if hasattr(store, "duplicate_links") else None
+        if table is not None:
+            chunk_files, files, live = table
+            return cls(chunk_files, files, live, links)
+        chunk_files = np.full(len(store), -1, dtype="int64")
+        files, rows = [], {}
+        for chunk_id, record in store.iter_records():
+            source = str(record.get("source", ""))
+            if source not in rows:
+                rows[source] = len(files)
+                files.append({"source": source, "rel": source, "ext": Path(source).suffix.lower().lstrip("."),
+                              "tags": []})
+            chunk_files[chunk_id] = rows[source]
+        return cls(chunk_files, files, None, links)
+
+    def __len__(self) -> int:
+        return len(self.chunk_files)
+
+    def _files_matching(self, node) -> np.ndarray:
+        kind = node[0]
+        if kind == "and":
+            return self._files_matching(node[1]) & self._files_matching(node[2])
+        if kind == "or":
+            return self._files_matching(node[1]) | self._files_matching(node[2])
+        if kind == "not":
+            return ~self._files_matching(node[1])
+        _, field, op, value = node
+        if field == "path":
+            return np.array([s.startswith(value) or r.startswith(value) for s, r in zip(self._source, self._rel)],
+                            dtype=bool)
+        if field == "ext":
+            return np.isin(self._ext, list(value))
+        if field == "tag":
+            return np.array([not value.isdisjoint(t) for t in self._tags], dtype=bool)
+        with np.errstate(invalid="ignore"):
+            return {">=": np.greater_equal, ">": np.greater, "<=": np.less_equal, "<": np.less}[op](self._mtime, value)
+
+    def _masks(self, expr: str) -> Tuple[np.ndarray, np.ndarray]:
+        key = expr.strip()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        file_mask = self._files_matching(parse(key)).astype(bool)
+        chunks = (file_mask[self._rows] if len(file_mask) else np.zeros(len(self), dtype=bool)) & self._has_file
+        # duplicates have no vector of their own: their canonical chunk stands in for them
+        vectors = chunks.copy()
+        if len(self._dup):
+            picked = chunks[self._dup]
+            vectors[self._dup] = False
+            vectors[self._canon[picked]] = True
+        with self._lock:
+            self._cache[key] = (chunks, vectors)
+            while len(self._cache) > _CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return chunks, vectors
+
+    def select(self, expr: str) -> np.ndarray:
+        """Boolean mask over chunk ids of the live chunks whose file matches `expr`."""
+        return self._masks(expr)[0]
+
+    def select_vectors(self, expr: str) -> np.ndarray:
+        """`select` with each selected duplicate replaced by its canonical chunk (the ids
+        the FAISS and BM25 indexes hold)."""
+        return self._masks(expr)[1]
+
+
+_INDEXES = weakref.WeakKeyDictionary()
+_INDEXES_LOCK = threading.Lock()
+
+
+def filter_index(store) -> FilterIndex:
+    """The `FilterIndex` of `store`, built on first use and kept while the store is open."""
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(store)
+        if index is None:
+            index = _INDEXES[store] = FilterIndex.from_store(store)
+        return index
+
+
+def _empty(n: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    return np.full((n, k), np.inf, dtype="float32"), np.full((n, k), -1, dtype="int64")
+
+
+def _brute_force(vectors: np.ndarray, ids: np.ndarray, x: np.ndarray, k: int):
+    """Exact squared-L2 top-k of `x` over `vectors` (rows of `ids`)."""
+    D, I = _empty(len(x), k)
+    if not len(ids):
+        return D, I
+    vectors = np.asarray(vectors, dtype="float32")
+    dists = (x * x).sum(axis=1)[:, None] - 2.0 * (x @ vectors.T) + (vectors * vectors).sum(axis=1)[None, :]
+    np.maximum(dists, 0.0, out=dists)
+    kk = min(k, len(ids))
+    top = np.argpartition(dists, kk - 1, axis=1)[:, :kk] if kk < len(ids) else np.tile(np.arange(kk), (len(x), 1))
+    for row in range(len(x)):
+        cand = top[row][np.lexsort((ids[top[row]], dists[row, top[row]]))]
+        D[row, :kk] = dists[row, cand]
+        I[row, :kk] = ids[cand]
+    return D, I
+
+
+def _structure(index):
+    """(IVF index or None, HNSW index or None) under the IdMap/RerankIndex wrappers."""
+    inner = index.index if isinstance(index, RerankIndex) else index
+    if isinstance(inner, faiss.IndexIDMap):
+        inner = inner.index
+    try:
+        return faiss.extract_index_ivf(inner), None
+    except RuntimeError:
+        pass
+    inner = faiss.downcast_index(inner)
+    return None, (inner if isinstance(inner, faiss.IndexHNSW) else None)
+
+
+def _selector_search(index, x: np.ndarray, k: int, mask: np.ndarray, n_selected: int, exhaustive: bool = False):
+    bits = np.packbits(mask, bitorder="little")  # must outlive the search
+    selector = faiss.IDSelectorBitmap(len(bits), faiss.swig_ptr(bits))
+    ivf, hnsw = _structure(index)
+    fraction = n_selected / max(1, index.ntotal)
+    if ivf is not None:
+        # probe partitions in proportion to selectivity so about as many selected vectors are scanned as unfiltered
+        nprobe = ivf.nlist if exhaustive else min(ivf.nlist, math.ceil(ivf.nprobe / max(fraction, 1e-9)))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=int(nprobe))
+    elif hnsw is not None:
+        ef = max(hnsw.hnsw.efSearch, k)
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=int(min(index.ntotal, math.ceil(ef / fraction))))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(x, k, params=params)
+
+
+def _exact(index, x: np.ndarray, k: int, mask: np.ndarray, ids: np.ndarray):
+    vectors = getattr(index, "vectors", None)
+    if isinstance(index, RerankIndex) and vectors is not None:
+        ids = ids[ids < len(vectors)]
+        return _brute_force(vectors[ids], ids, x, k)
+    ivf, _ = _structure(index)
+    if ivf is None:
+        try:
+            return _brute_force(index.reconstruct_batch(ids), ids, x, k)
+        except RuntimeError:  # an id without a vector; the selector skips those
+            pass
+    # IVF lists hold no id -> vector map: scan every partition, skipping unselected entries
+    return _selector_search(index, x, k, mask, len(ids), exhaustive=True)
+
+
+def search_filtered(index, x: np.ndarray, k: int, mask: np.ndarray, exact_max: int = EXACT_MAX):
+    """`index.search(x, k)` restricted to the chunk ids set in the boolean `mask`.
+
+    Returns (D, I) padded like `index.search`. `index` is a FAISS index (IdMap), a
+    `RerankIndex` or a `src.shards.ShardedIndex` (which filters inside each shard).
+    """
+    x = np.ascontiguousarray(x, dtype="float32")
+    if hasattr(index, "num_shards"):
+        return index.search(x, k, mask=mask)
+    if faiss is None:
+        raise RuntimeError("faiss is required (install faiss-cpu)")
+    mask = np.asarray(mask, dtype=bool)
+    ids = np.flatnonzero(mask)
+    if not len(ids) or index.ntotal == 0:
+        return _empty(len(x), k)
+    if len(ids) <= exact_max:
+        return _exact(index, x, k, mask, ids)
+    D, I = _selector_search(index, x, k, mask, len(ids))
+    if (I[:, :min(k, len(ids))] < 0).any():
+        # the ANN search ran out of selected candidates; the exact answer has k of them
+        return _exact(index, x, k, mask, ids)
+    return D, I
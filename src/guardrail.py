@@ -0,0 +1,171 @@
+"""Sensitive-topic guardrail for grounded answers.
+
+A question about a legal, medical or policy topic is refused unless the context sent to
+the LLM contains such material itself. `SENSITIVE_KEYWORDS` is compiled once into a
+single regex with word boundaries, matched against lowercased text (an optional plural
+`s` is allowed), so "law" matches "Laws" but not "flaw" or "lawn".
+
+Ingest runs the same matcher over every chunk and the chunk store keeps one flag per
+chunk id (see `src.chunk_store`). The evidence check then reads the `sensitive` flag
+that `src.query.search` attaches to each retrieved record, instead of rescanning the
+context text. Records without a flag (stores built before the flags were recorded, or
+with another keyword list) fall back to matching their text.
+
+Refusals start with `src.prompt_template.REFUSAL_PREFIX`, the prefix `SYSTEM_PROMPT` also
+asks the LLM to use when the sources fall short, so callers detect both the same way.
+
+Usage:
+    from src.guardrail import sensitive_refusal
+    refusal = sensitive_refusal(question, [results[i] for i in context.used])
+
+    python -m src.guardrail --queries 2000   # per-query overhead of the check
+"""
+
+import argparse
+import hashlib
+import random
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from src.prompt_template import format_refusal
+
+SENSITIVE_KEYWORDS = [
+    "legal", "law", "legal advice", "attorney", "court", "litigation",
+    "medical", "medicine", "doctor", "diagnosis", "treatment", "clinic",
+    "policy", "regulation", "regulatory", "compliance", "policy guidance",
+]
+
+# chunk store flag values
+NOT_SENSITIVE, SENSITIVE, UNKNOWN = 0, 1, 2
+
+
+def _trie_pattern(trie: Dict) -> str:
+    alternatives, optional = [], False
+    for char, sub in sorted(trie.items()):
+        if char == "":
+            optional = True
+        else:
+            alternatives.append((r"\s+" if char == " " else re.escape(char)) + _trie_pattern(sub))
+    if not alternatives:
+        return ""
+    body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+    return f"(?:{body})?" if optional else body
+
+
+def compile_keywords(keywords: Iterable[str]) -> "re.Pattern":
+    """One regex over lowercase text matching any of `keywords` as whole words.
+
+    The keywords are merged into a prefix trie ("medic(?:al|ine)"), so the engine tries
+    a single branch per starting letter instead of every keyword in turn.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in " ".join(keyword.lower().split()):
+            node = node.setdefault(char, {})
+        if node is not trie:
+            node[""] = {}
+    return re.compile(rf"\b{_trie_pattern(trie)}s?\b")
+
+
+PATTERN = compile_keywords(SENSITIVE_KEYWORDS)
+# names the flag file, so flags written for another keyword list are not trusted
+VERSION = hashlib.blake2b(PATTERN.pattern.encode("utf-8"), digest_size=6).hexdigest()
+
+
+def is_sensitive(text: str) -> bool:
+    return PATTERN.search(text.lower()) is not None
+
+
+def sensitive_flags(texts: Iterable[str]) -> np.ndarray:
+    """Flag per text: `SENSITIVE` or `NOT_SENSITIVE`."""
+    return np.fromiter((is_sensitive(t) for t in texts), dtype=np.uint8)
+
+
+def has_evidence(context: Iterable[Union[Dict, str]]) -> bool:
+    """Whether any context chunk mentions a sensitive topic.
+
+    `context` holds chunk records (their precomputed `sensitive` flag is used, else
+    their `text` is matched) or plain excerpt strings.
+    """
+    for item in context:
+        if isinstance(item, str):
+            flag = is_sensitive(item)
+        else:
+            flag = item.get("sensitive")
+            if flag is None:
+                flag = is_sensitive(item.get("text") or "")
+        if flag:
+            return True
+    return False
+
+
+def sensitive_refusal(query: str, context: Iterable[Union[Dict, str]]) -> Optional[str]:
+    """Auto-refusal for sensitive domains (legal / medical / policy) when not present in context.
+
+    Returns the refusal message, or None when the question may be answered. The context
+    is only looked at for sensitive questions.
+    """
+    if is_sensitive(query) and not has_evidence(context):
+        reason = (
+            "Question requests legal/medical/policy advice but the provided sources do not "
+            "explicitly contain such information."
+        )
+        suggestion = "Provide authoritative documents or consult a qualified professional."
+        return format_refusal(reason, suggestion)
+    return None
+
+
+def _substring_refusal(query: str, excerpts: List[str]) -> bool:
+    """The previous check: substring search over the question and the joined context."""
+    if not any(kw in query.lower() for kw in SENSITIVE_KEYWORDS):
+        return False
+    joined = "\n".join(excerpts).lower()
+    return not any(kw in joined for kw in SENSITIVE_KEYWORDS)
+
+
+def benchmark(queries: int = 2000, chunks: int = 5, chunk_chars: int = 1000, seed: int = 0) -> Dict:
+    """Microseconds per query of the substring scan vs the compiled matcher, with
+    context text and with precomputed chunk flags (half the questions are sensitive)."""
+    rng = random.Random(seed)
+    words = ["retrieval", "index", "answer", "document", "vector", "budget", "team", "report", "lawn", "clinical"]
+
+    def text(n_chars):
+        out = []
+        while sum(len(w) + 1 for w in out) < n_chars:
+            out.append(rng.choice(words))
+        return " ".join(out)
+
+    cases = []
+    for n in range(queries):
+        question = text(60) + (" is this legal?" if n % 2 else "?")
+        rows = [{"text": text(chunk_chars)} for _ in range(chunks)]
+        cases.append((question, rows, [f"Source: doc{i}.txt\n{r['text']}" for i, r in enumerate(rows)]))
+    flagged = [(q, [dict(r, sensitive=is_sensitive(r["text"])) for r in rows]) for q, rows, _ in cases]
+
+    def timed(fn, items):
+        t0 = time.perf_counter()
+        for item in items:
+            fn(*item)
+        return (time.perf_counter() - t0) / len(items) * 1e6
+
+    return {
+        "substring_us": timed(_substring_refusal, [(q, excerpts) for q, _, excerpts in cases]),
+        "regex_text_us": timed(sensitive_refusal, [(q, excerpts) for q, _, excerpts in cases]),
+        "regex_flags_us": timed(sensitive_refusal, flagged),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the per-query overhead of the sensitive-topic check")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=5, help="Context chunks per question")
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    args = parser.parse_args()
+    report = benchmark(args.queries, args.chunks, args.chunk_chars)
+    print(f"substring scan of question and context: {report['substring_us']:8.1f} us/query")
+    print(f"compiled matcher over context text:     {report['regex_text_us']:8.1f} us/query")
+    print(f"compiled matcher + chunk flags:         {report['regex_flags_us']:8.1f} us/query")
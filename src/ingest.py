@@ -1,11 +1,26 @@
 import os
 import argparse
+import functools
+import hashlib
 import json
+import queue
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 from tqdm import tqdm
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from src import ann_index, filters, metrics
+from src.bm25 import BM25Index, bm25_path
+from src.chunk_store import OFFSETS_FILE, ChunkStoreWriter, open_chunk_store
+from src.chunker import iter_char_chunks, iter_token_chunks, make_token_counter, model_token_budget
+from src.dedup import DEDUP_FILE, DedupIndex
+from src.embedding_cache import DEFAULT_DIR as EMBEDDING_CACHE_DIR, CachedEncoder, EmbeddingCache
+from src.embeddings import BACKENDS, DEFAULT_BACKEND, encoder_key, load_encoder
+from src.shards import shard_of
 
 try:
     import faiss
@@ -18,70 +33,748 @@ except Exception:
     PdfReader = None
 
 
-def read_file(path: Path) -> str:
+def iter_file_blocks(path: Path, block_chars: int = 1 << 16):
+    """Yield the text of `path` in pieces (blocks for .txt/.md, pages for .pdf) without reading it whole."""
     if path.suffix.lower() in (".txt", ".md"):
-        return path.read_text(encoding="utf-8", errors="ignore")
-    if path.suffix.lower() == ".pdf":
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for block in iter(lambda: f.read(block_chars), ""):
+                yield block
+    elif path.suffix.lower() == ".pdf":
         if PdfReader is None:
             raise RuntimeError("PyPDF2 is required to read PDFs")
-        text = []
-        reader = PdfReader(str(path))
-        for p in reader.pages:
-            text.append(p.extract_text() or "")
-        return "\n".join(text)
-    return ""
+        for n, page in enumerate(PdfReader(str(path)).pages):
+            yield ("\n" if n else "") + (page.extract_text() or "")
 
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200):
-    start = 0
-    length = len(text)
-    while start < length:
-        end = start + chunk_size
-        yield text[start:end]
-        start = max(0, end - overlap)
+MANIFEST_VERSION = 2
+SUPPORTED_SUFFIXES = (".txt", ".md", ".pdf")
+CHUNKERS = ("tokens", "chars")
+# manifests written before the chunking entry existed used the character chunker
+DEFAULT_CHUNKING = {"chunker": "chars", "chunk_size": 1000, "overlap": 200}
+# files at least this large are chunked lazily in the ingest process, never fully in memory
+LAZY_PARSE_BYTES = 32 << 20
+_WORKER_TOKENIZER = None
 
 
-def main(data_dir, index_path, meta_path, model_name):
+def list_files(data_dir, shard=None):
+    """Supported documents under `data_dir`, sorted; with `shard=(n, num_shards)` only that shard's."""
     data_dir = Path(data_dir)
-    files = [p for p in data_dir.rglob("*") if p.suffix.lower() in (".txt", ".md", ".pdf")]
-    if not files:
-        print("No documents found in", data_dir)
-        return
+    files = sorted(p for p in data_dir.rglob("*") if p.suffix.lower() in SUPPORTED_SUFFIXES)
+    if shard is not None:
+        n, num_shards = shard
+        files = [f for f in files if shard_of(f.relative_to(data_dir).as_posix(), num_shards) == n]
+    return files
+
+
+def file_digest(path: Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
 
-    model = SentenceTransformer(model_name)
+def load_manifest(manifest_path: Path):
+    """Return the manifest written by a previous run, or None if it is missing or unusable."""
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
 
-    docs = []
-    metadatas = []
+
+def save_manifest(manifest_path: Path, manifest: dict):
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = manifest_path.with_suffix(manifest_path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, manifest_path)
+
+
+def plan_changes(files, previous_files: dict):
+    """Compare files on disk against the manifest entries of the previous run.
+
+    A file is unchanged when its size and mtime match; otherwise its content hash
+    decides, so a `touch` does not trigger re-embedding.
+
+    Returns:
+        (unchanged, to_embed, stale_ids) where `unchanged` maps path -> manifest entry,
+        `to_embed` lists (path, stat, digest) for new or modified files and `stale_ids`
+        are the chunk ids of modified or deleted files.
+    """
+    unchanged = {}
+    to_embed = []
+    stale_ids = []
+    seen = set()
     for f in files:
+        key = str(f)
+        seen.add(key)
+        st = f.stat()
+        entry = previous_files.get(key)
+        if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+            unchanged[key] = entry
+            continue
+        digest = file_digest(f)
+        if entry and entry["sha256"] == digest:
+            unchanged[key] = dict(entry, size=st.st_size, mtime=st.st_mtime_ns)
+            continue
+        if entry:
+            stale_ids.extend(entry["chunk_ids"])
+        to_embed.append((f, st, digest))
+    for key, entry in previous_files.items():
+        if key not in seen:
+            stale_ids.extend(entry["chunk_ids"])
+    return unchanged, to_embed, stale_ids
+
+
+def _init_parse_worker(tokenizer):
+    global _WORKER_TOKENIZER
+    _WORKER_TOKENIZER = tokenizer
+
+
+def iter_chunks(path: Path, chunking: dict, tokenizer=None):
+    """Lazily chunk one file according to `chunking` (see `main`); yields `src.chunker.Chunk`."""
+    blocks = iter_file_blocks(path)
+    if chunking["chunker"] == "chars":
+        return iter_char_chunks(blocks, chunking["chunk_size"], chunking["overlap"])
+    count = make_token_counter(tokenizer if tokenizer is not None else _WORKER_TOKENIZER)
+    return iter_token_chunks(blocks, count, chunking["chunk_tokens"], chunking["overlap_tokens"])
+
+
+def parse_file(path: str, digest=None, chunking=None, tokenizer=None, lazy=False):
+    """Read and chunk one file; runs inside the parse process pool unless `lazy`.
+
+    Returns:
+        (path, digest, chunks, error) where `chunks` lists `src.chunker.Chunk`s, or is a
+        generator over them when `lazy` (read errors then surface while iterating).
+    """
+    path = Path(path)
+    chunking = chunking or DEFAULT_CHUNKING
+    try:
+        if digest is None:
+            digest = file_digest(path)
+        if path.suffix.lower() == ".pdf" and PdfReader is None:
+            raise RuntimeError("PyPDF2 is required to read PDFs")
+        chunks = iter_chunks(path, chunking, tokenizer)
+        if not lazy:
+            chunks = list(chunks)
+    except Exception as e:
+        return str(path), digest, None, str(e)
+    return str(path), digest, chunks, None
+
+
+def iter_parsed(items, workers: int = 1, chunking=None, tokenizer=None):
+    """Yield `parse_file` results for (path, digest) items in input order.
+
+    With `workers > 1` files are parsed in a process pool, keeping at most
+    `2 * workers` files in flight so parsed text never piles up ahead of the embedder.
+    Files of `LAZY_PARSE_BYTES` or more (and all files with one worker) are chunked
+    lazily in this process instead, so their chunks stream straight to the embedder.
+    """
+    if workers <= 1:
+        for path, digest in items:
+            yield parse_file(path, digest, chunking, tokenizer, lazy=True)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker, initargs=(tokenizer,)) as pool:
+        pending = deque()
+        for path, digest in items:
+            if Path(path).stat().st_size >= LAZY_PARSE_BYTES:
+                pending.append((path, digest))
+            else:
+                pending.append(pool.submit(parse_file, str(path), digest, chunking))
+            if len(pending) >= 2 * workers:
+                yield _resolve(pending.popleft(), chunking, tokenizer)
+        while pending:
+            yield _resolve(pending.popleft(), chunking, tokenizer)
+
+
+def _resolve(item, chunking, tokenizer):
+    if isinstance(item, tuple):
+        path, digest = item
+        return parse_file(path, digest, chunking, tokenizer, lazy=True)
+    return item.result()
+
+
+_DONE = object()
+
+
+class _SkippedFile(NamedTuple):
+    """Pipeline marker queued after the chunks of a file that failed part-way."""
+
+    source: str
+    doc_key: str
+
+
+class _Stage(threading.Thread):
+    """Daemon thread that records its exception and sets `stop` so the other stages unwind."""
+
+    def __init__(self, target, stop: threading.Event):
+        super().__init__(daemon=True)
+        self._target_fn = target
+        self._stop_event = stop
+        self.error = None
+
+    def run(self):
+        try:
+            self._target_fn()
+        except BaseException as e:
+            self.error = e
+            self._stop_event.set()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    while not stop.is_set():
         try:
-            text = read_file(f)
-        except Exception as e:
-            print(f"Skipping {f}: {e}")
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
             continue
-        for i, chunk in enumerate(chunk_text(text)):
-            chunk = chunk.strip()
-            if not chunk:
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(
+    to_embed, model, index, store, files_manifest, next_id, workers=1, batch_size=256, chunking=None, dedup=None,
+    file_attrs=None,
+):
+    """Stream files through parse -> embed -> write stages.
+
+    A producer thread pulls parsed files from the process pool, assigns chunk ids and
+    feeds a bounded chunk queue; the calling thread encodes fixed-size batches; a writer
+    thread adds each finished batch to `index` and appends its records to `store` (a
+    `ChunkStoreWriter`). Chunk ids, records and vectors are the same as encoding all
+    chunks in one call. `chunking` selects the chunker (see `main`); token budgets are
+    counted with `model.tokenizer` when the model has one.
+
+    With a `src.dedup.DedupIndex`, chunks that duplicate an earlier chunk are stored and
+    linked to it (`ChunkStoreWriter.link_duplicates`) but not embedded.
+
+    `file_attrs(path, stat)` returns the filterable attributes stored for each file (see
+    `src.filters.file_attributes`).
+
+    A file that fails to parse is skipped. Lazily chunked files can fail after some of
+    their chunks were queued; those chunks are removed from `store` at the end, and the
+    partial document text they were stored against is never reused
+    (`ChunkStoreWriter.discard_doc`).
+
+    Returns:
+        (n_embedded, next_id, skipped_ids) where `skipped_ids` are the chunks of skipped
+        files that were embedded anyway; the caller removes them from the final index.
+    """
+    chunk_q = queue.Queue(maxsize=4 * batch_size)
+    write_q = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    state = {"next_id": next_id, "n_chunks": 0}
+    skipped, skipped_new = [], []  # chunks of files that failed part-way, and those of them embedded
+
+    def produce():
+        items = [(f, digest) for f, _, digest in to_embed]
+        stats = {str(f): st for f, st, _ in to_embed}
+        tokenizer = getattr(model, "tokenizer", None)
+        for path, digest, chunks, error in iter_parsed(items, workers, chunking, tokenizer):
+            if stop.is_set():
+                return
+            if error is not None:
+                print(f"Skipping {path}: {error}")
+                metrics.inc("rag_ingest_errors_total")
+                continue
+            metrics.inc("rag_ingest_files_total")
+            st = stats[path]
+            attributes = file_attrs(path, st) if file_attrs is not None else None
+            chunk_ids, new_ids = [], []
+            try:
+                for chunk in chunks:
+                    cid = state["next_id"]
+                    state["next_id"] += 1
+                    chunk_ids.append(cid)
+                    canonical = None
+                    if dedup is not None:
+                        with metrics.span("dedup"):
+                            canonical = dedup.add(cid, chunk.text)
+                    if canonical is None:
+                        new_ids.append(cid)
+                    meta = {
+                        "source": path,
+                        "chunk_index": chunk.index,
+                        "text": chunk.text,
+                        "doc_key": digest,
+                        "start": chunk.start,
+                        "end": chunk.end,
+                        "fresh": chunk.fresh,
+                    }
+                    if attributes is not None:
+                        meta["file"] = attributes
+                    _put(chunk_q, (cid, meta, canonical), stop)
+            except Exception as e:
+                # lazily chunked files only fail while iterating; drop what was queued
+                print(f"Skipping {path}: {e}")
+                metrics.inc("rag_ingest_errors_total")
+                if dedup is not None:
+                    for cid in chunk_ids:
+                        dedup.remove(cid)
+                skipped.extend(chunk_ids)
+                skipped_new.extend(new_ids)
+                _put(chunk_q, _SkippedFile(path, digest), stop)
                 continue
-            docs.append(chunk)
-            metadatas.append({"source": str(f), "chunk_index": i, "text": chunk})
+            files_manifest[path] = {
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "sha256": digest,
+                "chunk_ids": chunk_ids,
+            }
+        _put(chunk_q, _DONE, stop)
+
+    def write():
+        while True:
+            item = _get(write_q, stop)
+            if item is _DONE:
+                return
+            if isinstance(item, _SkippedFile):
+                # its chunks are all written by now, and no later file's chunk yet
+                store.discard_doc(item.source, item.doc_key)
+                continue
+            ids, metas, vector_ids, embeddings, duplicates = item
+            if len(vector_ids):
+                with metrics.span("index_add"):
+                    index.add_with_ids(embeddings, vector_ids)
+            with metrics.span("store_write"):
+                store.append_many(ids, metas)
+                if duplicates:
+                    store.link_duplicates(*zip(*duplicates))
+
+    def flush(batch):
+        ids = np.array([cid for cid, _, _ in batch], dtype="int64")
+        metas = [meta for _, meta, _ in batch]
+        new = [(cid, meta) for cid, meta, canonical in batch if canonical is None]
+        duplicates = [(cid, canonical) for cid, _, canonical in batch if canonical is not None]
+        vector_ids = np.array([cid for cid, _ in new], dtype="int64")
+        with metrics.span("encode"):
+            embeddings = model.encode([m["text"] for _, m in new], convert_to_numpy=True) if new else []
+        metrics.inc("rag_chunks_embedded_total", len(new))
+        metrics.inc("rag_chunks_duplicate_total", len(duplicates))
+        _put(write_q, (ids, metas, vector_ids, np.array(embeddings).astype("float32"), duplicates), stop)
+        state["n_chunks"] += len(new)
+        progress.update(len(batch))
+
+    producer = _Stage(produce, stop)
+    writer = _Stage(write, stop)
+    producer.start()
+    writer.start()
+    progress = tqdm(unit="chunk", desc="Embedding")
+    try:
+        batch = []
+        while True:
+            item = _get(chunk_q, stop)
+            if item is _DONE:
+                break
+            if isinstance(item, _SkippedFile):
+                if batch:
+                    flush(batch)
+                    batch = []
+                _put(write_q, item, stop)
+                continue
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch and not stop.is_set():
+            flush(batch)
+        _put(write_q, _DONE, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        progress.close()
+        producer.join()
+        writer.join()
+
+    for stage in (producer, writer):
+        if stage.error is not None:
+            raise stage.error
+    if skipped:
+        store.delete(skipped)
+        linked = [cid for cid in skipped if cid in store.links]
+        store.link_duplicates(linked, [-1] * len(linked))
+    return state["n_chunks"] - len(skipped_new), state["next_id"], skipped_new
+
+
+def _load_previous(
+    index_path: Path, meta_path: Path, manifest_path: Path, model_name: str, params: dict, chunking: dict,
+    dedup: dict = None, tags: dict = None,
+):
+    manifest = load_manifest(manifest_path)
+    if manifest is None or manifest.get("model") != model_name or manifest.get("index") != params:
+        return None
+    if manifest.get("tags") != tags:
+        return None
+    if manifest.get("chunking", DEFAULT_CHUNKING) != chunking or manifest.get("dedup") != dedup:
+        return None
+    if not index_path.exists() or not (meta_path / OFFSETS_FILE).exists():
+        return None
+    if dedup is not None and not (meta_path / DEDUP_FILE).exists():
+        return None
+    if ann_index.is_compressed(params) and params["rerank"] and not ann_index.vectors_path(index_path).exists():
+        return None
+    index = faiss.read_index(str(index_path))
+    if not isinstance(index, faiss.IndexIDMap2):
+        # indexes built before the manifest existed cannot remove vectors by id
+        return None
+    store = ChunkStoreWriter(meta_path)
+    if len(store) > manifest["next_id"]:
+        store.close()
+        return None
+    store.pad_to(manifest["next_id"])
+    return manifest, index, store
+
+
+def _remove_stale(stale_ids, index, store, dedup):
+    """Remove stale chunks from `index` and `store`; return the duplicates promoted to canonical.
+
+    A stale canonical chunk with live duplicates hands its entry to the lowest of them,
+    which then needs a vector; its other duplicates are relinked to it.
+    """
+    stale = set(stale_ids)
+    dependents = store.dependents()
+    promoted = []
+    link_ids, link_to = [], []
+    for chunk_id in sorted(stale):
+        if chunk_id in store.links:
+            link_ids.append(chunk_id)
+            link_to.append(-1)
+            continue
+        live = [d for d in dependents.get(chunk_id, []) if d not in stale]
+        if live:
+            promoted.append(live[0])
+            link_ids.extend(live)
+            link_to.extend([-1] + [live[0]] * (len(live) - 1))
+        if dedup is not None:
+            dedup.remove(chunk_id, replacement=live[0] if live else None)
+    index.remove_ids(np.array(stale_ids, dtype="int64"))
+    store.delete(stale_ids)
+    store.link_duplicates(link_ids, link_to)
+    return promoted
+
+
+def _update_bm25(sparse_path: Path, reader, previous, first_id: int, promoted, stale_ids) -> BM25Index:
+    """The BM25 index of the previous run updated with this run's chunks, or a full build.
+
+    Only chunks that became canonical (new ones from `first_id` on, and promoted
+    duplicates) are tokenized; removed chunks are dropped from the postings.
+    """
+    bm25 = BM25Index.load(sparse_path) if previous is not None and sparse_path.exists() else None
+    if bm25 is None or bm25.tfs is None or bm25.n_slots != first_id:
+        return BM25Index.from_store(reader)
+    added = [i for i in [*promoted, *range(first_id, len(reader))] if reader.canonical_of(i) == i]
+    records = [(i, r) for i, r in zip(added, reader.get(added)) if r is not None]
+    return bm25.update(records, stale_ids, len(reader))
+
+
+def _replace_dir(src: Path, dst: Path):
+    """Move the directory `src` to `dst`, replacing whatever is there."""
+    old = dst.with_name(dst.name + ".old")
+    if old.exists():
+        shutil.rmtree(old)
+    if dst.exists():
+        os.replace(dst, old)
+    os.replace(src, dst)
+    shutil.rmtree(old, ignore_errors=True)
 
-    embeddings = model.encode(docs, show_progress_bar=True, convert_to_numpy=True)
-    embeddings = np.array(embeddings).astype("float32")
+
+def _resolve_chunking(chunking: dict, model) -> dict:
+    if chunking["chunker"] == "tokens" and chunking["chunk_tokens"] is None:
+        budget = model_token_budget(model)
+        if chunking["overlap_tokens"] >= budget:
+            raise ValueError(f"overlap_tokens must be below the model's {budget}-token budget")
+        return dict(chunking, chunk_tokens=budget)
+    return chunking
+
+
+def main(
+    data_dir,
+    index_path,
+    meta_path,
+    model_name,
+    manifest_path=None,
+    incremental=False,
+    workers=1,
+    batch_size=256,
+    index_type="flat",
+    index_params=None,
+    chunker="tokens",
+    chunk_tokens=None,
+    overlap_tokens=32,
+    chunk_size=1000,
+    overlap=200,
+    model=None,
+    sparse=True,
+    dedup=True,
+    dedup_threshold=0.8,
+    shard=None,
+    backend=DEFAULT_BACKEND,
+    tags=None,
+    embedding_cache=None,
+):
+    """Build the FAISS index and chunk metadata for every document under `data_dir`.
+
+    Vectors are stored in an `IndexIDMap2` keyed by chunk id and chunk metadata in the
+    chunk store at `meta_path` (see `src.chunk_store`), slot == chunk id. A manifest records
+    size, mtime, content hash and chunk ids per file; with `incremental=True` only new or
+    modified files are re-embedded and the vectors of modified or deleted files are
+    removed, which yields the same searchable content as a full rebuild. A full rebuild
+    writes the new chunk store next to `meta_path` and only replaces the live store and
+    index once it succeeds, so a failed run leaves the previous build searchable.
+
+    Parsing, embedding and index writes run as an overlapped pipeline (see `run_pipeline`);
+    `workers` sets the parse process pool size and `batch_size` the embedding batch size.
+
+    `index_type` selects `flat`, `hnsw`, `ivf` or `ivfpq` (see `src.ann_index`);
+    `index_params` overrides entries of `ann_index.DEFAULT_PARAMS`. IVF quantizers are
+    trained on a reservoir sample of the streamed embeddings. `index_params["quantize"]`
+    (`sq8`, `fp16` or `pq`) compresses the stored vectors; compressed indexes also write
+    the float32 vectors to a memory-mapped sidecar for exact re-ranking unless
+    `index_params["rerank"]` is 0.
+
+    `chunker="tokens"` packs sentences into chunks of at most `chunk_tokens` tokens of the
+    model's tokenizer (default: the model's max sequence length) with `overlap_tokens` of
+    overlap; `chunker="chars"` uses `chunk_size`-character windows sharing `overlap`
+    characters. Chunks are stored as offsets into deduplicated document text. Changing the
+    chunking forces a full rebuild. `model` may be a preloaded encoder (anything with
+    `encode` and `get_sentence_embedding_dimension`); by default `model_name` is loaded
+    with the `backend` embedding backend (see `src.embeddings`).
+    With `sparse=True` a BM25 index over the same chunk ids is written next to the FAISS
+    index (see `src.bm25`) for hybrid retrieval.
+
+    With `dedup=True` chunks whose normalized text matches an earlier chunk, or whose
+    estimated word-shingle Jaccard similarity to it is at least `dedup_threshold`, are
+    linked to that canonical chunk instead of embedded (see `src.dedup`).
+
+    `shard=(n, num_shards)` ingests only the files of shard `n` (see `src.shards`).
+
+    The path, extension, mtime and tags of each file are stored for metadata filters (see
+    `src.filters`); `tags` maps glob patterns over paths relative to `data_dir` to the tags
+    of matching files. Changing the tags forces a full rebuild; incremental runs refresh the
+    stored mtime of files touched without a content change.
+
+    `embedding_cache` (a directory or a `src.embedding_cache.EmbeddingCache`) serves the
+    vectors of chunk texts this model has embedded before, in any earlier run; only the
+    misses are encoded.
+    """
+    data_dir = Path(data_dir)
+    index_path = Path(index_path)
+    meta_path = Path(meta_path)
+    if meta_path.suffix.lower() == ".json":
+        raise ValueError(
+            f"{meta_path}: metadata is now written as a chunk store directory (e.g. artifacts/chunks); "
+            "convert old files with `python -m src.chunk_store convert`"
+        )
+    if chunker == "chars":
+        if not 0 <= overlap < chunk_size:
+            raise ValueError(f"overlap must be in [0, chunk_size); got chunk_size={chunk_size}, overlap={overlap}")
+        chunking = {"chunker": "chars", "chunk_size": chunk_size, "overlap": overlap}
+    elif chunker == "tokens":
+        if overlap_tokens < 0 or (chunk_tokens is not None and overlap_tokens >= chunk_tokens):
+            raise ValueError(f"overlap_tokens must be in [0, chunk_tokens); got {overlap_tokens}, {chunk_tokens}")
+        # chunk_tokens=None means "the model's budget", which the model name already pins down
+        chunking = {"chunker": "tokens", "chunk_tokens": chunk_tokens, "overlap_tokens": overlap_tokens}
+    else:
+        raise ValueError(f"Unknown chunker {chunker!r}; expected one of {CHUNKERS}")
+    if dedup and not 0.0 < dedup_threshold <= 1.0:
+        raise ValueError(f"dedup_threshold must be in (0, 1]; got {dedup_threshold}")
+    dedup_config = {"threshold": dedup_threshold} if dedup else None
+    tags = tags or None
+    manifest_path = Path(manifest_path) if manifest_path else index_path.parent / "manifest.json"
+
+    with metrics.span("list_files"):
+        files = list_files(data_dir, shard)
+    if not files:
+        print("No documents found in", data_dir)
+        return
 
     if faiss is None:
         raise RuntimeError("faiss is required (install faiss-cpu)")
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+
+    params = ann_index.resolve_params(index_type, **(index_params or {}))
+    previous = (
+        _load_previous(index_path, meta_path, manifest_path, model_name, params, chunking, dedup_config, tags)
+        if incremental
+        else None
+    )
+    if previous is not None:
+        manifest, index, store = previous
+        unchanged, to_embed, stale_ids = plan_changes(files, manifest["files"])
+        next_id = manifest["next_id"]
+        if stale_ids and not ann_index.supports_removal(params):
+            print(f"{index_type} indexes cannot remove vectors; running a full rebuild")
+            store.close()
+            previous = None
+    elif incremental:
+        print("No usable manifest found; running a full rebuild")
+    # a full rebuild writes a new store next to the live one and swaps it in once it succeeds
+    store_path = meta_path if previous is not None else meta_path.with_name(meta_path.name + ".build")
+    if previous is None:
+        if store_path.exists():
+            shutil.rmtree(store_path)  # left over from a failed rebuild
+        index, store = None, ChunkStoreWriter(store_path, truncate=True)
+        unchanged, to_embed, stale_ids = {}, [(f, f.stat(), None) for f in files], []
+        next_id = 0
+    first_id = next_id
+    dedup_path = store_path / DEDUP_FILE
+    if dedup_config is None:
+        dedup_index = None
+    elif previous is not None:
+        dedup_index = DedupIndex.load(dedup_path)
+    else:
+        dedup_index = DedupIndex(dedup_threshold)
+    cache = embedding_cache
+    if cache is not None and not isinstance(cache, EmbeddingCache):
+        cache = EmbeddingCache(cache)
+    if cache is not None:
+        cache.reset_stats()  # report this run's hit rate
+    cache_key = encoder_key(model_name, backend)
+    # compressed indexes keep exact float32 vectors on disk for re-ranking
+    keep_vectors = ann_index.is_compressed(params) and bool(params["rerank"])
+    vectors_path = ann_index.vectors_path(index_path)
+    build_vectors_path = vectors_path if previous is not None else Path(str(vectors_path) + ".build")
+    tmp_index_path = index_path.with_name(index_path.name + ".tmp")
+    vector_file = None
+    built = False
+
+    file_attrs = functools.partial(filters.file_attributes, data_dir=data_dir, tags=tags)
+
+    try:
+        files_manifest = dict(unchanged)
+        for key, entry in unchanged.items():
+            if entry["mtime"] != manifest["files"][key]["mtime"]:
+                # touched but identical: the chunks stay, their filterable mtime is refreshed
+                store.update_file(entry["chunk_ids"], file_attrs(key, Path(key).stat()))
+        if not to_embed and not stale_ids:
+            # refresh mtimes of touched-but-identical files so they are not re-hashed next run
+            save_manifest(manifest_path, dict(manifest, files=files_manifest))
+            print("Index is up to date; nothing to embed")
+            return
+
+        promoted = _remove_stale(stale_ids, index, store, dedup_index) if stale_ids else []
+
+        n_chunks, skipped_ids = 0, []
+        built_params = (ann_index.load_params(index_path) or params) if index is not None else params
+        if to_embed or index is None or promoted:
+            if model is None:
+                with metrics.span("model_load"):
+                    model = load_encoder(model_name, backend)
+            if cache is not None:
+                model = CachedEncoder(model, cache, cache_key)
+            dim = model.get_sentence_embedding_dimension()
+            if index is None:
+                index = ann_index.build_index(dim, params)
+            buffer = None if index.is_trained else ann_index.TrainingBuffer(index, params, dim, tmp_dir=index_path.parent)
+            sink = buffer or index
+            if keep_vectors:
+                vector_file = ann_index.VectorFile(build_vectors_path, dim, truncate=previous is None)
+                sink = ann_index.SidecarSink(sink, vector_file)
+            if promoted:
+                with open_chunk_store(meta_path) as reader:
+                    texts = [record["text"] for record in reader.get(promoted)]
+                vectors = np.array(model.encode(texts, convert_to_numpy=True)).astype("float32")
+                sink.add_with_ids(vectors, np.array(promoted, dtype="int64"))
+                n_chunks += len(promoted)
+            if to_embed:
+                n_new, next_id, skipped_ids = run_pipeline(
+                    to_embed,
+                    model,
+                    sink,
+                    store,
+                    files_manifest,
+                    next_id,
+                    workers=workers,
+                    batch_size=batch_size,
+                    chunking=_resolve_chunking(chunking, model),
+                    dedup=dedup_index,
+                    file_attrs=file_attrs,
+                )
+                n_chunks += n_new
+            if buffer is not None:
+                index, built_params = buffer.finish()
+            if skipped_ids and ann_index.supports_removal(built_params):
+                # HNSW keeps them; search skips ids without a store record
+                index.remove_ids(np.array(skipped_ids, dtype="int64"))
+
+        with metrics.span("index_write"):
+            faiss.write_index(index, str(tmp_index_path))
+        if dedup_index is not None:
+            dedup_index.save(dedup_path)
+        elif dedup_path.exists():
+            dedup_path.unlink()
+        built = True
+    finally:
+        store.close()
+        if vector_file is not None:
+            vector_file.close()
+        if not built:
+            # the live index and store are untouched by a failed rebuild
+            tmp_index_path.unlink(missing_ok=True)
+            if previous is None:
+                shutil.rmtree(store_path, ignore_errors=True)
+                Path(build_vectors_path).unlink(missing_ok=True)
+        if cache is not None:
+            cache_report = cache.report(cache_key)
+            if cache is not embedding_cache:
+                cache.close()
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+    if previous is None:
+        _replace_dir(store_path, meta_path)
+        if build_vectors_path.exists():
+            os.replace(build_vectors_path, vectors_path)
+    if not keep_vectors and vectors_path.exists():
+        vectors_path.unlink()
+    os.replace(tmp_index_path, index_path)
+    ann_index.save_params(index_path, built_params)
 
-    index_dir = Path(index_path)
-    index_dir.parent.mkdir(parents=True, exist_ok=True)
-    faiss.write_index(index, str(index_path))
+    sparse_path = bm25_path(index_path)
+    if sparse:
+        with metrics.span("bm25_build"), open_chunk_store(meta_path) as reader:
+            _update_bm25(sparse_path, reader, previous, first_id, promoted, stale_ids).save(sparse_path)
+    elif sparse_path.exists():
+        # a BM25 index from an earlier build would no longer match the chunk ids
+        sparse_path.unlink()
 
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(metadatas, f, ensure_ascii=False, indent=2)
+    save_manifest(manifest_path, {
+        "version": MANIFEST_VERSION,
+        "model": model_name,
+        "next_id": next_id,
+        "index": params,
+        "chunking": chunking,
+        "dedup": dedup_config,
+        "tags": tags,
+        "files": files_manifest,
+    })
 
+    n_duplicates = sum(len(files_manifest[str(f)]["chunk_ids"]) for f, _, _ in to_embed if str(f) in files_manifest)
+    n_duplicates -= n_chunks - len(promoted)
+    print(
+        f"Embedded {n_chunks} chunks from {len(to_embed)} files ({n_duplicates} duplicates linked), "
+        f"removed {len(stale_ids)} stale chunks"
+    )
+    if cache is not None:
+        saved = cache_report["saved_seconds"]
+        print(
+            f"Embedding cache: {cache_report['hits']}/{cache_report['hits'] + cache_report['misses']} hits "
+            f"({100.0 * cache_report['hit_rate']:.1f}%)" + (f", saved ~{saved:.1f} s of encoding" if saved else "")
+        )
     print(f"Wrote index to {index_path} and metadata to {meta_path}")
 
 
@@ -89,7 +782,82 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--data-dir", default="data", help="Directory with documents (.txt, .md, .pdf)")
     parser.add_argument("--index-path", default="artifacts/faiss.index", help="Path to write FAISS index")
-    parser.add_argument("--meta-path", default="artifacts/meta.json", help="Path to write metadata JSON")
+    parser.add_argument("--meta-path", default="artifacts/chunks", help="Chunk store directory to write")
     parser.add_argument("--model", default="all-MiniLM-L6-v2", help="SentenceTransformer model name")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=BACKENDS, help="Embedding backend")
+    parser.add_argument("--manifest-path", default=None, help="Path of the per-file manifest (default: next to the index)")
+    parser.add_argument("--incremental", action="store_true", help="Only re-embed new or changed files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parse worker processes")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding batch")
+    parser.add_argument("--chunker", default="tokens", choices=CHUNKERS, help="Sentence/token or character chunking")
+    parser.add_argument("--chunk-tokens", type=int, default=None, help="Token budget per chunk (default: model max)")
+    parser.add_argument("--overlap-tokens", type=int, default=32, help="Tokens of trailing sentences repeated")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="--chunker chars: characters per chunk")
+    parser.add_argument("--overlap", type=int, default=200, help="--chunker chars: characters shared by chunks")
+    parser.add_argument("--no-bm25", dest="sparse", action="store_false", help="Skip the BM25 index for hybrid search")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false", help="Embed duplicate chunks too")
+    parser.add_argument("--embedding-cache", default=EMBEDDING_CACHE_DIR,
+                        help="Directory of the persistent embedding cache shared by ingest runs")
+    parser.add_argument("--no-embedding-cache", dest="embedding_cache", action="store_const", const=None,
+                        help="Encode every chunk, without reading or filling the embedding cache")
+    parser.add_argument(
+        "--tag", action="append", default=[], metavar="PATTERN=TAG[,TAG]",
+        help="Tag files whose path under --data-dir matches the glob, for `tag:` filters (repeatable)",
+    )
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="Near-duplicate Jaccard threshold")
+    parser.add_argument("--index-type", default="flat", choices=ann_index.INDEX_TYPES, help="FAISS index family")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF: number of coarse centroids")
+    parser.add_argument("--m", type=int, default=None, help="HNSW: neighbours per node")
+    parser.add_argument("--ef-construction", type=int, default=None, help="HNSW: build-time beam width")
+    parser.add_argument("--pq-m", type=int, default=None, help="IVF-PQ: sub-quantizers (must divide the dimension)")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF: default lists probed at query time")
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW: default search-time beam width")
+    parser.add_argument("--quantize", default=None, choices=ann_index.QUANTIZERS, help="Compress stored vectors")
+    parser.add_argument(
+        "--rerank", type=int, default=None,
+        help="Compressed indexes: default candidates per result re-ranked from float32 vectors (0: no sidecar)",
+    )
+    parser.add_argument("--train-sample", type=int, default=None, help="IVF: reservoir sample size for training")
+    parser.add_argument("--metrics-out", default=None,
+                        help="Write per-stage timings and counters (.prom: Prometheus text, .jsonl: appended JSON lines)")
+    parser.add_argument("--profile", default=None, help="Write a cProfile dump of the run to this path")
     args = parser.parse_args()
-    main(args.data_dir, args.index_path, args.meta_path, args.model)
+    if args.metrics_out:
+        metrics.enable()
+    with metrics.profile(args.profile):
+        main(
+            args.data_dir,
+            args.index_path,
+            args.meta_path,
+            args.model,
+            args.manifest_path,
+            args.incremental,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            index_type=args.index_type,
+            index_params={
+                "nlist": args.nlist,
+                "m": args.m,
+                "ef_construction": args.ef_construction,
+                "pq_m": args.pq_m,
+                "nprobe": args.nprobe,
+                "ef_search": args.ef_search,
+                "train_sample": args.train_sample,
+                "quantize": args.quantize,
+                "rerank": args.rerank,
+            },
+            chunker=args.chunker,
+            chunk_tokens=args.chunk_tokens,
+            overlap_tokens=args.overlap_tokens,
+            chunk_size=args.chunk_size,
+            overlap=args.overlap,
+            sparse=args.sparse,
+            dedup=args.dedup,
+            dedup_threshold=args.dedup_threshold,
+            backend=args.backend,
+            tags=filters.parse_tags(args.tag),
+            embedding_cache=args.embedding_cache,
+        )
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
+        print(f"Wrote metrics to {args.metrics_out}")
@@ -0,0 +1,347 @@
+"""LLM client helpers for grounded generation.
+
+Provides a client factory, a retry helper with exponential backoff and jitter, a
+deterministic local `FakeChatClient` that mirrors the `client.chat.completions.create`
+call shape so the answer path can be exercised without network access, and a fake
+OpenAI-compatible HTTP server for end-to-end tests of the streaming client.
+
+`LLMClient` is the production client: one `AsyncOpenAI` client (and so one pooled set
+of keep-alive connections) driven by a private event loop thread. It streams token
+deltas, caps the number of in-flight requests, applies a per-request timeout and
+retries transient failures with full-jitter backoff as long as no token has been
+emitted yet. Synchronous callers (CLI, Streamlit, thread pools) use `stream` /
+`complete`; async callers use `astream` / `acomplete` on the client's loop.
+
+Usage:
+    from src.llm import make_client, stream_chat
+    client = make_client("openai")          # OPENAI_API_KEY, optional OPENAI_BASE_URL
+    for token in stream_chat(client, messages):
+        print(token, end="", flush=True)
+
+    python -m src.llm serve-fake --port 8001  # then OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from src import metrics
+
+
+def _openai():
+    """The openai module, or None; imported on first use since it takes most of a second."""
+    try:
+        import openai
+    except Exception:
+        return None
+    return openai
+
+
+DEFAULT_MODEL = "gpt-4.1"
+_TOKEN_RE = re.compile(r"\S+\s*")
+_DONE = object()
+
+
+def _fake_answer(messages: List[Dict]) -> str:
+    prompt = messages[-1]["content"]
+    sources = [line[len("Source:"):].strip() for line in prompt.splitlines() if line.startswith("Source:")]
+    return f"Based on [{sources[0]}]." if sources else "The provided documents do not contain this information."
+
+
+class FakeChatClient:
+    """Offline stand-in for `OpenAI(...)`.
+
+    Answers with the first source named in the prompt, so outputs are deterministic
+    and still depend on retrieval. `fail_times` makes the first N calls raise, to
+    exercise retry logic.
+    """
+
+    def __init__(self, fail_times: int = 0, latency_s: float = 0.0):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.calls = 0
+        self._fail_times = fail_times
+        self._latency_s = latency_s
+
+    def _create(self, model, messages, **kwargs):
+        self.calls += 1
+        if self._latency_s:
+            time.sleep(self._latency_s)
+        if self.calls <= self._fail_times:
+            raise ConnectionError("fake transient failure")
+        message = SimpleNamespace(role="assistant", content=_fake_answer(messages))
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+
+def _retryable(exc: BaseException) -> bool:
+    openai = _openai()
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError)):  # includes timeouts
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+class LLMClient:
+    """Pooled, streaming OpenAI-compatible chat client with concurrency, timeout and retry limits."""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = DEFAULT_MODEL,
+        max_concurrency: int = 8,
+        timeout: float = 60.0,
+        retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+    ):
+        openai = _openai()
+        if openai is None:
+            raise RuntimeError("openai is required for LLMClient (pip install openai)")
+        self.model = model
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # retries are ours: they must not replay a stream that already emitted tokens
+        self._client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True).start()
+            return self._loop
+
+    async def astream(self, messages: List[Dict], **kwargs) -> AsyncIterator[str]:
+        """Yield the answer's content deltas (must run on this client's loop, see `stream`)."""
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                started = False
+                metrics.inc("rag_llm_requests_total")
+                try:
+                    # read the raw SSE body to its end (past `[DONE]`) so the connection returns to the pool
+                    async with self._client.chat.completions.with_streaming_response.create(
+                        model=self.model, messages=messages, stream=True, **kwargs
+                    ) as response:
+                        async for line in response.iter_lines():
+                            if not line.startswith("data:") or line[5:].strip() == "[DONE]":
+                                continue
+                            choices = json.loads(line[5:]).get("choices") or [{}]
+                            delta = (choices[0].get("delta") or {}).get("content")
+                            if delta:
+                                started = True
+                                yield delta
+                    return
+                except Exception as e:
+                    if started or attempt == self.retries or not _retryable(e):
+                        metrics.inc("rag_llm_errors_total")
+                        raise
+                metrics.inc("rag_llm_retries_total")
+                await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt))))
+
+    async def acomplete(self, messages: List[Dict], **kwargs) -> str:
+        return "".join([token async for token in self.astream(messages, **kwargs)])
+
+    def stream(self, messages: List[Dict], **kwargs) -> Iterator[str]:
+        """Synchronous view of `astream`: tokens are yielded as they arrive."""
+        tokens = queue.Queue()
+
+        async def pump():
+            try:
+                async for token in self.astream(messages, **kwargs):
+                    tokens.put(token)
+            except Exception as e:
+                tokens.put(e)
+            finally:
+                tokens.put(_DONE)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._ensure_loop())
+        try:
+            while True:
+                item = tokens.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()  # the caller stopped early: release the connection
+
+    def complete(self, messages: List[Dict], **kwargs) -> str:
+        return "".join(self.stream(messages, **kwargs))
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), loop).result(timeout=10)
+            loop.call_soon_threadsafe(loop.stop)
+
+
+def make_client(kind: str = "openai", api_key: Optional[str] = None, base_url: Optional[str] = None, **kwargs):
+    """Return a chat client (an `LLMClient` for `openai`, or the local `fake`), or None if unavailable.
+
+    `base_url` (default: `OPENAI_BASE_URL`) points the client at any OpenAI-compatible
+    server; other keyword arguments go to `LLMClient`.
+    """
+    if kind == "fake":
+        return FakeChatClient()
+    if kind != "openai":
+        raise ValueError(f"Unknown LLM client {kind!r}; expected 'openai' or 'fake'")
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key or _openai() is None:
+        return None
+    return LLMClient(api_key=api_key, base_url=base_url or os.getenv("OPENAI_BASE_URL"), **kwargs)
+
+
+def stream_chat(client, messages: List[Dict], **kwargs) -> Iterator[str]:
+    """Yield the answer from `client`: token deltas from an `LLMClient`, one piece from other clients."""
+    if isinstance(client, LLMClient):
+        yield from client.stream(messages, **kwargs)
+        return
+    response = client.chat.completions.create(model=DEFAULT_MODEL, messages=messages, **kwargs)
+    yield response.choices[0].message.content
+
+
+def complete_chat(client, messages: List[Dict], **kwargs) -> str:
+    if isinstance(client, LLMClient):
+        return client.complete(messages, **kwargs)
+    return "".join(stream_chat(client, messages, **kwargs))
+
+
+def call_with_retry(
+    fn: Callable,
+    retries: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    sleep: Callable[[float], None] = time.sleep,
+):
+    """Call `fn()`; on failure retry up to `retries` times with full-jitter exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except retry_on:
+            if attempt == retries:
+                raise
+            sleep(random.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
+
+
+def _make_fake_handler():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with self.server.lock:
+                self.server.connections += 1
+
+        def _send_json(self, status: int, payload: Dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_event(self, payload, last: bool = False):
+            data = b"data: " + (payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")) + b"\n\n"
+            # the terminating chunk goes out with the last event, so clients can reuse the connection
+            self.wfile.write(b"%x\r\n%s\r\n%s" % (len(data), data, b"0\r\n\r\n" if last else b""))
+            self.wfile.flush()
+
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            server = self.server
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with server.lock:
+                server.requests += 1
+                failing = server.requests <= server.fail_times
+                server.inflight += 1
+                server.max_inflight = max(server.max_inflight, server.inflight)
+            try:
+                if server.latency_s:
+                    time.sleep(server.latency_s)
+                if failing:
+                    self._send_json(503, {"error": {"message": "fake transient failure", "type": "server_error"}})
+                    return
+                answer = _fake_answer(request["messages"])
+                base = {"id": f"chatcmpl-fake-{server.requests}", "created": 0, "model": request.get("model", "")}
+                if not request.get("stream"):
+                    message = {"role": "assistant", "content": answer}
+                    self._send_json(200, dict(base, object="chat.completion", choices=[
+                        {"index": 0, "message": message, "finish_reason": "stop"}
+                    ]))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in _TOKEN_RE.findall(answer):
+                    if server.token_delay_s:
+                        time.sleep(server.token_delay_s)
+                    self._send_event(dict(base, object="chat.completion.chunk", choices=[
+                        {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                    ]))
+                self._send_event(dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "delta": {}, "finish_reason": "stop"}
+                ]))
+                self._send_event(b"[DONE]", last=True)
+            finally:
+                with server.lock:
+                    server.inflight -= 1
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_fake_server(
+    host: str = "127.0.0.1", port: int = 0, fail_times: int = 0, latency_s: float = 0.0, token_delay_s: float = 0.0
+) -> ThreadingHTTPServer:
+    """OpenAI-compatible `/v1/chat/completions` server answering like `FakeChatClient`.
+
+    Streams one SSE chunk per word when asked to. The first `fail_times` requests get a
+    503; `connections`, `requests` and `max_inflight` count what clients did.
+    """
+    server = ThreadingHTTPServer((host, port), _make_fake_handler())
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.fail_times = fail_times
+    server.latency_s = latency_s
+    server.token_delay_s = token_delay_s
+    server.connections = server.requests = server.inflight = server.max_inflight = 0
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    fake = sub.add_parser("serve-fake", help="Run the fake OpenAI-compatible server")
+    fake.add_argument("--host", default="127.0.0.1")
+    fake.add_argument("--port", type=int, default=8001)
+    fake.add_argument("--latency-ms", type=float, default=0.0, help="Delay before the first token")
+    fake.add_argument("--token-delay-ms", type=float, default=0.0, help="Delay between streamed tokens")
+    args = parser.parse_args()
+    srv = make_fake_server(args.host, args.port, latency_s=args.latency_ms / 1000.0,
+                           token_delay_s=args.token_delay_ms / 1000.0)
+    print(f"Fake OpenAI server on http://{args.host}:{args.port}/v1")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
@@ -0,0 +1,246 @@
+"""Lightweight pipeline instrumentation: stage spans, counters and histograms.
+
+Ingest and query wrap each stage in `span("<stage>")`, a context manager that times
+the block into the `rag_stage_seconds{stage=...}` histogram, and bump counters with
+`inc(...)`. Everything goes to the process-wide `REGISTRY`, which is exported in the
+Prometheus text format or as JSON lines (`write`), or served by `src.server` at
+`GET /metrics`.
+
+Instrumentation is off until `enable()` is called (the CLIs do so for `--metrics-out`).
+While it is off and no `record_stages()` block is active, `span` returns a shared no-op
+context manager and `inc` / `observe` return immediately, so the instrumented code pays
+one function call and a flag check per stage.
+
+`record_stages()` collects the spans of the current thread into a {stage: ms} dict
+(used for the Streamlit stage breakdown); `profile(path)` runs a block under cProfile
+and dumps a `.prof` file for snakeviz, `flameprof` or `gprof2dot`.
+
+Usage:
+    from src import metrics
+    metrics.enable()
+    with metrics.span("encode"):
+        vectors = model.encode(texts)
+    metrics.inc("rag_chunks_embedded_total", len(texts))
+    metrics.write("metrics.prom")   # or metrics.jsonl
+"""
+
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+STAGE_HISTOGRAM = "rag_stage_seconds"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = False
+_local = threading.local()
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics)."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            yield bound, total
+
+
+def _labels_key(labels: Dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    """Thread-safe store of counters and histograms, keyed by name and label set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> float
+        self._histograms = {}  # (name, labels) -> Histogram
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        return self._counters.get((name, _labels_key(labels)), 0.0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self._histograms.get((name, _labels_key(labels)))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, key), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name in sorted({n for n, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, key), hist in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    for bound, total in hist.cumulative():
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {total}")
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {hist.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {hist.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self, timestamp: Optional[float] = None) -> str:
+        ts = time.time() if timestamp is None else timestamp
+        rows = []
+        with self._lock:
+            for (name, key), value in sorted(self._counters.items()):
+                rows.append({"ts": ts, "type": "counter", "name": name, "labels": dict(key), "value": value})
+            for (name, key), hist in sorted(self._histograms.items(), key=lambda item: item[0]):
+                rows.append({
+                    "ts": ts, "type": "histogram", "name": name, "labels": dict(key), "count": hist.count,
+                    "sum": hist.sum, "buckets": {f"{bound:g}": total for bound, total in hist.cumulative()},
+                })
+        return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+REGISTRY = Registry()
+
+
+def enable(on: bool = True):
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    if _enabled:
+        REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    if _enabled:
+        REGISTRY.observe(name, value, **labels)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "_t0")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._t0
+        if _enabled:
+            REGISTRY.observe(STAGE_HISTOGRAM, elapsed, stage=self.stage)
+        stages = getattr(_local, "stages", None)
+        if stages is not None:
+            stages[self.stage] = stages.get(self.stage, 0.0) + elapsed * 1000.0
+        return False
+
+
+def span(stage: str):
+    """Time the `with` block as `stage` (a no-op while instrumentation is off)."""
+    if not _enabled and getattr(_local, "stages", None) is None:
+        return _NOOP
+    return _Span(stage)
+
+
+@contextmanager
+def record_stages(stages: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, float]]:
+    """Collect this thread's span durations (ms, summed per stage) into the yielded dict.
+
+    Pass the dict of an earlier block as `stages` to keep adding to it.
+    """
+    previous = getattr(_local, "stages", None)
+    stages = _local.stages = {} if stages is None else stages
+    try:
+        yield stages
+    finally:
+        _local.stages = previous
+
+
+def write(path, registry: Registry = REGISTRY):
+    """Export `registry`: JSON lines appended for `.jsonl`/`.json`, else Prometheus text."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix in (".jsonl", ".json"):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(registry.to_json_lines())
+    else:
+        path.write_text(registry.to_prometheus(), encoding="utf-8")
+
+
+@contextmanager
+def profile(path=None):
+    """Run the block under cProfile and dump the stats to `path` (no-op when `path` is None)."""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(path))
+        print(f"Wrote profile to {path} (view with snakeviz, or flameprof for a flame graph)")
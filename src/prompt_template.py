@@ -8,9 +8,20 @@ Usage:
     prompt = build_prompt(query, contexts)
 
 `contexts` should be an iterable of dicts with keys: `source` and `text`.
+
+`pack_context` fits ranked retrieval results into a token budget for the grounded
+prompt (see its docstring):
+    packed = pack_context(results, max_tokens=3000)
+    packed.text, packed.tokens
 """
 
-from typing import Iterable, Dict, List
+import re
+from typing import Callable, Iterable, Dict, List, NamedTuple, Optional
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
 
 
 DEFAULT_INSTRUCTIONS = (
@@ -58,15 +69,121 @@ def build_prompt(
     return "\n".join(parts)
 
 
+DEFAULT_CONTEXT_TOKENS = 3000
+CONTEXT_SEPARATOR = "\n---\n"
+_WORD_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def make_llm_token_counter(model: str = "gpt-4.1") -> Callable[[str], int]:
+    """Return a prompt token counter: tiktoken's encoding for `model` when installed.
+
+    Otherwise the larger of the word/punctuation count and characters / 4 is used, which
+    is close to BPE counts for English prose and rarely below them.
+    """
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    return lambda text: max(len(_WORD_PIECE_RE.findall(text)), (len(text) + 3) // 4)
+
+
+class PackedContext(NamedTuple):
+    text: str  # excerpts joined by CONTEXT_SEPARATOR
+    excerpts: List[str]  # "Source: <source>\n<text>" per merged span
+    tokens: int  # tokens of `text`
+    used: List[int]  # positions in `results` of the chunks included
+
+
+def _merge_spans(rows: List[Dict]) -> str:
+    """Join chunks of one document in document order, dropping overlapped text."""
+    rows = sorted(rows, key=lambda r: (r["start"], r["end"]))
+    out = bytearray(rows[0]["text"].encode("utf-8"))
+    end, index = rows[0]["end"], rows[0].get("chunk_index")
+    for row in rows[1:]:
+        if row["end"] <= end:
+            continue  # contained in what is already there
+        data = row["text"].encode("utf-8")
+        if row["start"] <= end:
+            out += data[end - row["start"]:]
+        else:
+            # consecutive chunks are only separated by whitespace; mark real gaps
+            adjacent = index is not None and row.get("chunk_index") == index + 1
+            out += (b"\n" if adjacent else b"\n...\n") + data
+        end, index = row["end"], row.get("chunk_index")
+    return out.decode("utf-8", errors="ignore")
+
+
+def _render(results: List[Dict], selected: Iterable[int], separator: str):
+    groups = {}  # (source, doc) or (source, None, rank) -> rows, best-ranked first
+    for rank in sorted(selected):
+        row = results[rank]
+        if row.get("doc") is not None and row.get("start") is not None:
+            key = (row.get("source"), row["doc"])
+        else:
+            key = (row.get("source"), None, rank)
+        groups.setdefault(key, []).append(row)
+
+    excerpts = []
+    for key, rows in groups.items():  # dicts keep insertion order, i.e. best rank first
+        text = _merge_spans(rows) if key[1] is not None else rows[0]["text"]
+        excerpt = f"Source: {key[0] or '<unknown>'}\n{text}"
+        if excerpt not in excerpts:
+            excerpts.append(excerpt)
+    return separator.join(excerpts), excerpts
+
+
+def pack_context(
+    results: List[Dict],
+    max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    count_tokens: Optional[Callable[[str], int]] = None,
+    separator: str = CONTEXT_SEPARATOR,
+) -> PackedContext:
+    """Fit ranked retrieval results into at most `max_tokens` tokens of prompt context.
+
+    Args:
+        results: Chunk records in relevance order, with `source` and `text`. Records
+            written by ingest also carry `doc`/`start`/`end` byte offsets.
+        max_tokens: Budget for the packed context text, headers and separators included.
+        count_tokens: Token counter for the LLM (default: `make_llm_token_counter()`).
+        separator: String placed between excerpts.
+
+    Chunks are considered in order of relevance per token (relevance 1 / (rank + 1)) and
+    kept when the rendered context still fits. Chunks of the same document that overlap
+    are merged into one excerpt without repeating the overlapped text, and identical
+    excerpts are included once. Chunks without text are skipped; source files are never
+    read. Excerpts are ordered by their best-ranked chunk.
+    """
+    count = count_tokens or make_llm_token_counter()
+    candidates = []
+    for rank, row in enumerate(results):
+        if row.get("text"):
+            candidates.append((1.0 / (rank + 1) / max(1, count(row["text"])), rank))
+    candidates.sort(key=lambda c: (-c[0], c[1]))
+
+    selected, text, excerpts, tokens = [], "", [], 0
+    for _, rank in candidates:
+        trial_text, trial_excerpts = _render(results, selected + [rank], separator)
+        trial_tokens = count(trial_text)
+        if trial_tokens <= max_tokens:
+            selected.append(rank)
+            text, excerpts, tokens = trial_text, trial_excerpts, trial_tokens
+    return PackedContext(text, excerpts, tokens, sorted(selected))
+
+
+# starts every refusal, whether `src.guardrail` or the LLM itself declines to answer
+REFUSAL_PREFIX = "REFUSAL:"
+
 # User-provided system and user prompt templates (enterprise-friendly guardrails)
-SYSTEM_PROMPT = """
+SYSTEM_PROMPT = f"""
 You are an AI assistant designed to answer questions using ONLY the provided source material.
 
 GUARDRAILS:
 - Do NOT invent facts.
 - Do NOT rely on general knowledge outside the provided context.
-- If the answer cannot be found in the sources, say:
-  "The provided documents do not contain sufficient information to answer this question."
+- If the answer cannot be found in the sources, begin your response with the exact prefix
+  "{REFUSAL_PREFIX}" followed by a concise reason and, optionally, a short suggested action.
 - Cite relevant source excerpts when possible.
 - Maintain a neutral, professional tone suitable for enterprise and government use.
 """
@@ -88,6 +205,22 @@ ANSWER:
 """
 
 
+def format_refusal(reason: str, suggestion: str = "") -> str:
+    """Return a policy-grade refusal message starting with `REFUSAL_PREFIX`.
+
+    Args:
+        reason: Concise explanation of why the question cannot be answered.
+        suggestion: Optional short suggested action for the user.
+
+    Returns:
+        Refusal string suitable for printing or returning to a caller.
+    """
+    msg = f"{REFUSAL_PREFIX} {reason}"
+    if suggestion:
+        msg += f" Suggested action: {suggestion}"
+    return msg
+
+
 def build_user_prompt(retrieved_context: str, user_question: str) -> str:
     """Return a user prompt formatted with `USER_PROMPT_TEMPLATE`.
 
@@ -1,168 +1,687 @@
-import os
 import argparse
 import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 try:
     import faiss
 except Exception:
     faiss = None
 
-try:
-    import openai
-    from openai import OpenAI
-except Exception:
-    openai = None
-    OpenAI = None
-
+from src import ann_index, metrics
+from src.answer_cache import DEFAULT_THRESHOLD, AnswerCache, llm_model
+from src.bm25 import BM25Index, bm25_path
+from src.cache import QueryCache
+from src.chunk_store import open_chunk_store
+from src.dedup import collapse_hits
+from src.embeddings import BACKENDS, DEFAULT_BACKEND, encoder_key, load_encoder
+from src.filters import filter_index, search_filtered
+from src.guardrail import SENSITIVE, UNKNOWN, sensitive_refusal
+from src.llm import LLMClient, call_with_retry, complete_chat, make_client, stream_chat
+from src.reranker import Reranker
+from src.shards import ShardedBM25, ShardedIndex, is_sharded
 from src.prompt_template import (
+    DEFAULT_CONTEXT_TOKENS,
+    PackedContext,
     SYSTEM_PROMPT,
     USER_PROMPT_TEMPLATE,
-    build_user_prompt,
-    format_refusal,
+    pack_context,
     REFUSAL_PREFIX,
 )
 
 
-def generate_grounded_response(openai_client: OpenAI, retrieved_text: str, question: str):
-    """Generate a grounded response using an OpenAI-compatible client.
-
-    This helper mirrors a modern OpenAI client call shape (`client.chat.completions.create`).
-    """
+def grounded_messages(retrieved_text: str, question: str) -> List[Dict]:
     prompt = USER_PROMPT_TEMPLATE.format(
         retrieved_context=retrieved_text,
         user_question=question,
     )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
 
-    response = openai_client.chat.completions.create(
-        model="gpt-4.1",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.0,  # low temp for factual grounding
-    )
-    return response.choices[0].message.content
 
+def generate_grounded_response(openai_client, retrieved_text: str, question: str):
+    """Generate a grounded response using a `src.llm.LLMClient` or any OpenAI-compatible client.
 
-def load_index(index_path: Path):
+    Plain clients are called with the `client.chat.completions.create` shape.
+    """
+    # low temp for factual grounding
+    with metrics.span("llm"):
+        return complete_chat(openai_client, grounded_messages(retrieved_text, question), temperature=0.0)
+
+
+def stream_grounded_response(openai_client, retrieved_text: str, question: str):
+    """Like `generate_grounded_response`, but yields the answer as it is generated."""
+    return stream_chat(openai_client, grounded_messages(retrieved_text, question), temperature=0.0)
+
+
+def load_index(index_path: Path, nprobe=None, ef_search=None, rerank=None, shard_workers="process"):
+    """Read a FAISS index (see `src.ann_index.load_index`) or open a sharded index root.
+
+    A directory holding a `shards.json` layout is searched through a `src.shards.ShardedIndex`
+    with `shard_workers` (`inline`, `process` or `socket`) workers.
+    """
     if faiss is None:
         raise RuntimeError("faiss is required (install faiss-cpu)")
-    return faiss.read_index(str(index_path))
+    if is_sharded(index_path):
+        return ShardedIndex(index_path, mode=shard_workers, nprobe=nprobe, ef_search=ef_search, rerank=rerank)
+    return ann_index.load_index(index_path, nprobe=nprobe, ef_search=ef_search, rerank=rerank)
+
+
+def artifact_mtime(path) -> int:
+    """mtime_ns of an artifact file, or of the newest file inside a chunk store directory."""
+    path = Path(path)
+    if path.is_dir():
+        return max((p.stat().st_mtime_ns for p in path.iterdir()), default=0)
+    return path.stat().st_mtime_ns
+
+
+def load_resources(
+    model_name: str, index_path, meta_path, nprobe=None, ef_search=None, rerank=None, shard_workers="process",
+    backend=DEFAULT_BACKEND,
+):
+    """Load the embedding model, FAISS index and chunk store shared by every entry point.
+
+    `backend` selects the embedding backend (see `src.embeddings`).
+    """
+    with metrics.span("model_load"):
+        model = load_encoder(model_name, backend)
+    with metrics.span("index_load"):
+        index = load_index(
+            Path(index_path), nprobe=nprobe, ef_search=ef_search, rerank=rerank, shard_workers=shard_workers
+        )
+    with metrics.span("store_open"):
+        store = open_chunk_store(meta_path)
+    return model, index, store
+
+
+def encode_queries(model, queries: List[str], cache=None) -> np.ndarray:
+    """Embed `queries` in one `model.encode` call, skipping those found in `cache`."""
+    if cache is None:
+        with metrics.span("encode"):
+            return model.encode(list(queries), convert_to_numpy=True).astype("float32")
+    cached = [cache.get_embedding(q) for q in queries]
+    missing = [i for i, emb in enumerate(cached) if emb is None]
+    if missing:
+        with metrics.span("encode"):
+            fresh = model.encode([queries[i] for i in missing], convert_to_numpy=True).astype("float32")
+        for i, emb in zip(missing, fresh):
+            cache.put_embedding(queries[i], emb)
+            cached[i] = emb
+    return np.vstack(cached).astype("float32")
+
+
+def search_vectors(index, q_emb: np.ndarray, top_k: int, cache=None):
+    """Run one `index.search` for the rows of `q_emb` not already in `cache`; returns (D, I)."""
+    if cache is None:
+        with metrics.span("index_search"):
+            return index.search(q_emb, top_k)
+    cache.check_index()
+    D = np.full((len(q_emb), top_k), np.inf, dtype="float32")
+    I = np.full((len(q_emb), top_k), -1, dtype="int64")
+    missing = []
+    for row, emb in enumerate(q_emb):
+        hit = cache.get_retrieval(emb, top_k)
+        if hit is None:
+            missing.append(row)
+        else:
+            ids, dists = hit
+            I[row, :len(ids)] = ids
+            D[row, :len(dists)] = dists
+    if missing:
+        with metrics.span("index_search"):
+            D_new, I_new = index.search(q_emb[missing], top_k)
+        for row, dists, ids in zip(missing, D_new, I_new):
+            cache.put_retrieval(q_emb[row], top_k, ids, dists)
+            D[row], I[row] = dists, ids
+    return D, I
+
+
+def load_sparse(index_path) -> Optional[BM25Index]:
+    """Load the BM25 index written next to `index_path` by ingest, or None if absent."""
+    if is_sharded(index_path):
+        return ShardedBM25.load(index_path)
+    path = bm25_path(index_path)
+    return BM25Index.load(path) if path.exists() else None
 
 
-def main(index_path, meta_path, model_name, top_k, openai_completion):
+FUSION_METHODS = ("rrf", "weighted")
+
+
+def _minmax(values: np.ndarray) -> np.ndarray:
+    if len(values) == 0:
+        return values
+    span = values.max() - values.min()
+    return (values - values.min()) / span if span > 0 else np.ones_like(values)
+
+
+def fuse(dense_ids, dense_dists, sparse_ids, sparse_scores, top_k: int, method: str = "rrf", alpha: float = 0.5,
+         rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse one query's dense and sparse rankings into the top_k (chunk_id, score) pairs.
+
+    Args:
+        method: `rrf` (reciprocal-rank fusion, sum of 1 / (rrf_k + rank)) or `weighted`
+            (alpha * min-max-normalised dense similarity + (1 - alpha) * normalised BM25).
+    """
+    dense_keep = dense_ids >= 0
+    sparse_keep = sparse_ids >= 0
+    dense_ids, dense_dists = dense_ids[dense_keep], dense_dists[dense_keep]
+    sparse_ids, sparse_scores = sparse_ids[sparse_keep], sparse_scores[sparse_keep]
+    fused = {}
+    if method == "rrf":
+        for ids in (dense_ids, sparse_ids):
+            for rank, chunk_id in enumerate(ids, start=1):
+                fused[int(chunk_id)] = fused.get(int(chunk_id), 0.0) + 1.0 / (rrf_k + rank)
+    elif method == "weighted":
+        # smaller L2 distance == more similar
+        for ids, scores, weight in ((dense_ids, _minmax(-dense_dists), alpha),
+                                    (sparse_ids, _minmax(sparse_scores), 1.0 - alpha)):
+            for chunk_id, score in zip(ids, scores):
+                fused[int(chunk_id)] = fused.get(int(chunk_id), 0.0) + weight * float(score)
+    else:
+        raise ValueError(f"Unknown fusion method {method!r}; expected one of {FUSION_METHODS}")
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+
+
+def _collapse(rows: List[Dict], store, top_k: int) -> List[Dict]:
+    """Add `sources` to the rows and merge near-duplicate rows, keeping the top_k."""
+    for row in rows:
+        sources = [row.get("source")]
+        for record in store.get(store.duplicates_of(row["id"])):
+            if record is not None and record.get("source") not in sources:
+                sources.append(record.get("source"))
+        row["sources"] = sources
+    if getattr(store, "deduplicated", False):
+        return rows[:top_k]  # ingest linked near-duplicates, so hits are already distinct
+    return collapse_hits(rows, top_k)
+
+
+def _flag_sensitive(results: List[List[Dict]], store) -> List[List[Dict]]:
+    """Add each record's ingest-time `sensitive` flag (see `src.guardrail`), where recorded."""
+    rows = [row for rows in results for row in rows]
+    for row, flag in zip(rows, store.sensitive_flags([row["id"] for row in rows])):
+        if flag != UNKNOWN:
+            row["sensitive"] = bool(flag == SENSITIVE)
+    return results
+
+
+def _selected_ids(I: np.ndarray, selected: np.ndarray, store) -> np.ndarray:
+    """Replace hits on a canonical chunk outside the filter by its duplicate inside it."""
+    I = I.copy()
+    for pos in zip(*np.nonzero(I >= 0)):
+        chunk_id = int(I[pos])
+        if chunk_id >= len(selected) or not selected[chunk_id]:
+            I[pos] = next((d for d in store.duplicates_of(chunk_id) if d < len(selected) and selected[d]), chunk_id)
+    return I
+
+
+def search(
+    model,
+    index,
+    store,
+    queries: List[str],
+    top_k: int,
+    cache=None,
+    sparse: Optional[BM25Index] = None,
+    fusion: str = "rrf",
+    alpha: float = 0.5,
+    depth: int = 50,
+    timings: Optional[Dict] = None,
+    collapse: bool = True,
+    reranker=None,
+    where: Optional[str] = None,
+) -> List[List[Dict]]:
+    """Retrieve the top_k chunk records for each query.
+
+    All queries are encoded in one `model.encode` call and searched with one
+    `index.search`, so callers can batch concurrent requests. Each record is a copy of
+    the stored metadata with its chunk `id` and L2 `distance` added. With a
+    `src.cache.QueryCache`, cached embeddings and retrievals skip those calls.
+
+    With a `sparse` BM25 index, both retrievers return their best `depth` chunks and the
+    rankings are fused (see `fuse`); records then also carry `bm25` and the fused `score`
+    (`distance` / `bm25` are None for chunks found by only one retriever). If `timings`
+    is a dict, per-stage milliseconds are added under `dense_ms`, `sparse_ms` and `fusion_ms`.
+
+    With `collapse`, records list in `sources` every source their content appears in
+    (duplicates linked at ingest, see `src.dedup`). For stores built without ingest
+    dedup, near-duplicate hits are merged into the better-ranked one from a 2 * top_k
+    candidate list, so the top_k are distinct.
+
+    With a `src.reranker.Reranker`, `reranker.candidates` chunks are retrieved per query
+    and re-ordered by its cross-encoder before the top_k are kept (`rerank_ms` timing).
+
+    Records carry the `sensitive` flag ingest recorded for their chunk (see
+    `src.guardrail`), used as evidence by `sensitive_refusal`.
+
+    `where` is a metadata filter expression (see `src.filters`); both retrievers then
+    return the exact best chunks among those it selects. Filtered retrievals bypass the
+    retrieval cache.
+    """
+    t0 = time.perf_counter()
+    metrics.inc("rag_queries_total", len(queries))
+    want = max(top_k, reranker.candidates) if reranker is not None else top_k
+    n = 2 * want if collapse and not getattr(store, "deduplicated", False) else want
+    k = n if sparse is None else max(n, depth)
+    q_emb = encode_queries(model, queries, cache)
+    selected = mask = None
+    if where:
+        with metrics.span("filter"):
+            index_filter = filter_index(store)
+            selected, mask = index_filter.select(where), index_filter.select_vectors(where)
+        with metrics.span("index_search"):
+            D, I = search_filtered(index, q_emb, k, mask)
+        I = _selected_ids(I, selected, store)
+    else:
+        D, I = search_vectors(index, q_emb, k, cache)
+    t1 = time.perf_counter()
+    if timings is not None:
+        timings["dense_ms"] = timings.get("dense_ms", 0.0) + (t1 - t0) * 1000.0
+
+    if sparse is None:
+        results = []
+        with metrics.span("metadata"):
+            for dists, ids in zip(D, I):
+                rows = []
+                for dist, idx, record in zip(dists, ids, store.get(ids)):
+                    if record is not None:
+                        rows.append(dict(record, id=int(idx), distance=float(dist)))
+                results.append(_collapse(rows, store, want) if collapse else rows)
+        results = reranker.rerank(queries, results, top_k, timings) if reranker is not None else results
+        return _flag_sensitive(results, store)
+
+    with metrics.span("sparse_search"):
+        S, J = sparse.search(queries, k, mask)
+    if selected is not None:
+        J = _selected_ids(J, selected, store)
+    t2 = time.perf_counter()
+    results = []
+    with metrics.span("fusion"):
+        for dists, ids, scores, sparse_ids in zip(D, I, S, J):
+            distance = {int(i): float(d) for i, d in zip(ids, dists) if i >= 0}
+            bm25 = {int(i): float(s) for i, s in zip(sparse_ids, scores) if i >= 0}
+            fused = fuse(ids, dists, sparse_ids, scores, n, method=fusion, alpha=alpha)
+            rows = []
+            for (idx, score), record in zip(fused, store.get([idx for idx, _ in fused])):
+                if record is not None:
+                    rows.append(dict(record, id=idx, distance=distance.get(idx), bm25=bm25.get(idx), score=score))
+            results.append(_collapse(rows, store, want) if collapse else rows)
+    if timings is not None:
+        timings["sparse_ms"] = timings.get("sparse_ms", 0.0) + (t2 - t1) * 1000.0
+        timings["fusion_ms"] = timings.get("fusion_ms", 0.0) + (time.perf_counter() - t2) * 1000.0
+    results = reranker.rerank(queries, results, top_k, timings) if reranker is not None else results
+    return _flag_sensitive(results, store)
+
+
+def build_retrieved_context(results: List[Dict], max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> PackedContext:
+    """Pack `results` into at most `max_tokens` of grounded-prompt context.
+
+    See `src.prompt_template.pack_context`; `.text` is the context and `.excerpts` the
+    per-source excerpts it is made of.
+    """
+    with metrics.span("prompt_build"):
+        context = pack_context(results, max_tokens)
+    metrics.observe("rag_context_tokens", context.tokens)
+    return context
+
+
+def context_records(results: List[Dict], context: PackedContext) -> List[Dict]:
+    """The retrieved records packed into `context`, the evidence for `sensitive_refusal`."""
+    return [results[i] for i in context.used]
+
+
+def context_chunk_ids(results: List[Dict], context: PackedContext) -> List[int]:
+    """Ids of the retrieved chunks packed into `context`, the key of a cached answer."""
+    return sorted(record["id"] for record in context_records(results, context))
+
+
+def answer_question(
+    openai_client, query: str, results: List[Dict], max_context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    usage: Optional[Dict] = None, answer_cache: Optional[AnswerCache] = None,
+) -> str:
+    """Return a refusal or a grounded answer for `query` over the retrieved `results`.
+
+    If `usage` is a dict, the packed context's size is added as `context_tokens` and
+    `context_chunks`, and whether the answer came from `answer_cache` as `cached`.
+    The refusal check runs before the cache is consulted.
+    """
+    context = build_retrieved_context(results, max_context_tokens)
+    if usage is not None:
+        usage.update(context_tokens=context.tokens, context_chunks=len(context.used), cached=False)
+    refusal_msg = sensitive_refusal(query, context_records(results, context))
+    if refusal_msg is not None:
+        return refusal_msg
+    if answer_cache is None:
+        return generate_grounded_response(openai_client, context.text, query)
+    chunk_ids, model = context_chunk_ids(results, context), llm_model(openai_client)
+    answer = answer_cache.get(query, chunk_ids, model)
+    if answer is not None:
+        if usage is not None:
+            usage["cached"] = True
+        return answer
+    answer = generate_grounded_response(openai_client, context.text, query)
+    answer_cache.put(query, chunk_ids, answer, model)
+    return answer
+
+
+def _iter_jsonl_batches(path, batch_size: int):
+    """Yield lists of parsed JSON objects from `path`, `batch_size` lines at a time."""
+    batch = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def run_batch(
+    model,
+    index,
+    store,
+    batch_file,
+    out_path,
+    top_k: int,
+    batch_size: int = 256,
+    client=None,
+    concurrency: int = 8,
+    retries: int = 3,
+    cache=None,
+    sparse=None,
+    fusion: str = "rrf",
+    alpha: float = 0.5,
+    max_context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    reranker=None,
+    where: Optional[str] = None,
+    answer_cache: Optional[AnswerCache] = None,
+) -> int:
+    """Answer every question in a JSONL file and stream one JSON result per line to `out_path`.
+
+    Input lines are objects with a `question` (or `query`) field and an optional `id`.
+    Each batch of `batch_size` questions is encoded and searched with one call each; when
+    `client` is given, grounded answers are generated in a bounded thread pool with
+    retry and backoff while the next batch is retrieved. Output order matches input
+    order and at most two batches are in memory at a time. With a `sparse` BM25 index,
+    retrieval is hybrid, and a `reranker` re-orders the candidates (see `search`). Answered rows also report `context_tokens`, the
+    size of the packed prompt context (at most `max_context_tokens`). A `where` filter
+    expression restricts every question to the chunks it selects. With an
+    `answer_cache`, repeated questions over the same chunks reuse their answer and rows
+    report `cached`. Returns the number of rows.
+    """
+
+    # an LLMClient retries (and bounds concurrency) by itself
+    outer_retries = 0 if isinstance(client, LLMClient) else retries
+
+    def _answer(question, results):
+        usage = {}
+        try:
+            answer = call_with_retry(
+                lambda: answer_question(client, question, results, max_context_tokens, usage, answer_cache),
+                retries=outer_retries,
+            )
+            row = {"answer": answer, "context_tokens": usage["context_tokens"]}
+            if answer_cache is not None:
+                row["cached"] = usage["cached"]
+            return row
+        except Exception as e:
+            return {"error": f"generation failed: {e}"}
+
+    def _write(out, rows, futures):
+        for row, fut in zip(rows, futures):
+            if fut is not None:
+                row.update(fut.result())
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        out.flush()
+
+    n = 0
+    pending = deque()
+    with open(out_path, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for items in _iter_jsonl_batches(batch_file, batch_size):
+            questions = [str(item.get("question") or item.get("query") or "") for item in items]
+            all_results = search(
+                model, index, store, questions, top_k, cache=cache, sparse=sparse, fusion=fusion, alpha=alpha,
+                reranker=reranker, where=where,
+            )
+            rows, futures = [], []
+            for item, question, results in zip(items, questions, all_results):
+                row = {"id": item.get("id", n), "question": question, "results": [
+                    {k: r[k] for k in ("id", "source", "sources", "chunk_index", "distance", "bm25", "score", "rerank_score") if k in r}
+                    for r in results
+                ]}
+                rows.append(row)
+                futures.append(pool.submit(_answer, question, results) if client is not None else None)
+                n += 1
+            pending.append((rows, futures))
+            # write the previous batch while this one's answers are generated
+            while len(pending) > 1:
+                _write(out, *pending.popleft())
+        while pending:
+            _write(out, *pending.popleft())
+    return n
+
+
+def main(
+    index_path,
+    meta_path,
+    model_name,
+    top_k,
+    openai_completion,
+    nprobe=None,
+    ef_search=None,
+    cache_dir=None,
+    fusion="rrf",
+    alpha=0.5,
+    rerank=None,
+    shard_workers="process",
+    llm="openai",
+    llm_timeout=60.0,
+    max_context_tokens=DEFAULT_CONTEXT_TOKENS,
+    cross_encoder=None,
+    cross_encoder_candidates=50,
+    cross_encoder_budget_ms=None,
+    backend=DEFAULT_BACKEND,
+    where=None,
+    answer_cache_size=1024,
+    answer_threshold=DEFAULT_THRESHOLD,
+):
     index_path = Path(index_path)
     meta_path = Path(meta_path)
     if not index_path.exists() or not meta_path.exists():
         print("Index or metadata not found. Run ingest first.")
         return
 
-    model = SentenceTransformer(model_name)
-    index = load_index(index_path)
-
-    with open(meta_path, "r", encoding="utf-8") as f:
-        metadatas = json.load(f)
+    model, index, store = load_resources(
+        model_name, index_path, meta_path, nprobe=nprobe, ef_search=ef_search, rerank=rerank,
+        shard_workers=shard_workers, backend=backend,
+    )
+    sparse = load_sparse(index_path) if fusion != "dense" else None
+    if fusion != "dense" and sparse is None:
+        print("No BM25 index found next to the FAISS index; using dense retrieval only")
 
-    query = input("Enter your question: ")
-    q_emb = model.encode([query], convert_to_numpy=True).astype("float32")
+    reranker = None
+    if cross_encoder:
+        reranker = Reranker(cross_encoder, candidates=cross_encoder_candidates, budget_ms=cross_encoder_budget_ms)
 
-    D, I = index.search(q_emb, top_k)
-    I = I[0]
+    # a one-shot CLI only benefits from the disk-backed level of the cache
+    cache = None
+    if cache_dir:
+        cache = QueryCache(
+            index_path=index_path, disk_path=Path(cache_dir) / "query_cache.sqlite",
+            model_name=encoder_key(model_name, backend),
+            search_params={"nprobe": nprobe, "ef_search": ef_search, "rerank": rerank},
+        )
 
-    results = []
-    for idx in I:
-        if idx < 0 or idx >= len(metadatas):
-            continue
-        results.append(metadatas[idx])
+    query = input("Enter your question: ")
+    timings = {}
+    results = search(
+        model, index, store, [query], top_k, cache=cache, sparse=sparse, fusion=fusion, alpha=alpha, timings=timings,
+        reranker=reranker, where=where,
+    )[0]
+    if cache is not None:
+        cache.close()
 
     print("Retrieved sources:")
     for r in results:
         print('-', r.get('source'), 'chunk', r.get('chunk_index'))
+    print("Timing:", ", ".join(f"{name[:-3]} {ms:.1f} ms" for name, ms in timings.items()))
 
-    # Optionally generate a grounded answer using OpenAI if available
-    if openai_completion and openai is not None and os.getenv("OPENAI_API_KEY"):
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-
-        # Use chunk text saved in metadata (fallback to reading file if missing)
-        def _read_file_fallback(path: Path) -> str:
-            try:
-                return path.read_text(encoding='utf-8', errors='ignore')
-            except Exception:
-                return ""
-
-        context_excerpts = []
-        for r in results:
-            src = r.get('source', '<unknown>')
-            text = r.get('text')
-            if not text:
-                # fallback: read entire file (best-effort)
-                text = _read_file_fallback(Path(src))
-            context_excerpts.append(f"Source: {src}\n{text}")
-
-        retrieved_context = "\n---\n".join(context_excerpts)
-        user_prompt = build_user_prompt(retrieved_context=retrieved_context, user_question=query)
-
-        # Auto-refusal for sensitive domains (legal / medical / policy) when not present in context
-        sensitive_keywords = [
-            "legal", "law", "legal advice", "attorney", "court", "litigation",
-            "medical", "medicine", "doctor", "diagnosis", "treatment", "clinic",
-            "policy", "regulation", "regulatory", "compliance", "policy guidance",
-        ]
-
-        def _is_sensitive_question(q: str) -> bool:
-            ql = q.lower()
-            return any(kw in ql for kw in sensitive_keywords)
-
-        def _context_contains_evidence(ctx_texts) -> bool:
-            joined = "\n".join(ctx_texts).lower()
-            return any(kw in joined for kw in sensitive_keywords)
-
-        if _is_sensitive_question(query) and not _context_contains_evidence(context_excerpts):
-            reason = (
-                "Question requests legal/medical/policy advice but the provided sources do not "
-                "explicitly contain such information."
-            )
-            suggestion = "Provide authoritative documents or consult a qualified professional."
-            refusal_msg = format_refusal(reason, suggestion)
-            print("\nGrounded answer:")
-            print(refusal_msg)
-            return
+    # Optionally generate a grounded answer, streamed as it is produced
+    client = make_client(llm, timeout=llm_timeout) if openai_completion else None
+    if client is None:
+        print("\nTo generate a grounded LLM answer, set OPENAI_API_KEY and run with --openai")
+        return
 
-        try:
-            if OpenAI is not None:
-                client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-                answer = generate_grounded_response(client, retrieved_context, query)
-            else:
-                # fall back to legacy module-style API
-                resp = openai.ChatCompletion.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    max_tokens=400,
-                    temperature=0.0,
-                )
-                answer = resp['choices'][0]['message']['content']
+    context = build_retrieved_context(results, max_context_tokens)
+    print(f"Context: {context.tokens} tokens from {len(context.used)} of {len(results)} chunks")
+    refusal_msg = sensitive_refusal(query, context_records(results, context))
+    print("\nGrounded answer:")
+    if refusal_msg is not None:
+        print(refusal_msg)
+        return
 
-            print("\nGrounded answer:")
-            print(answer)
-        except Exception as e:
-            print("OpenAI request failed:", e)
-    else:
-        print("\nTo generate a grounded LLM answer, set OPENAI_API_KEY and run with --openai")
+    tokens = stream_grounded_response(client, context.text, query)
+    answer_cache = None
+    if cache_dir and answer_cache_size > 0:
+        # answers to the same question (or a close paraphrase) over the same chunks are reused
+        answer_cache = AnswerCache(
+            answer_cache_size, index_path=index_path, embed=lambda q: encode_queries(model, [q])[0],
+            threshold=answer_threshold, disk_path=Path(cache_dir) / "answer_cache.sqlite",
+        )
+        tokens = answer_cache.stream(query, context_chunk_ids(results, context), tokens, llm_model(client))
+    t0 = time.perf_counter()
+    first_token_ms = None
+    try:
+        with metrics.span("llm"):
+            for token in tokens:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - t0) * 1000.0
+                    metrics.observe("rag_llm_first_token_seconds", first_token_ms / 1000.0)
+                print(token, end="", flush=True)
+        print()
+        print(f"Timing: first token {first_token_ms or 0.0:.0f} ms, answer {(time.perf_counter() - t0) * 1000.0:.0f} ms")
+    except Exception as e:
+        print("\nLLM request failed:", e)
+    finally:
+        if answer_cache is not None:
+            if answer_cache.hits:
+                print("(answer served from the answer cache)")
+            answer_cache.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--index-path", default="artifacts/faiss.index")
-    parser.add_argument("--meta-path", default="artifacts/meta.json")
+    parser.add_argument("--meta-path", default="artifacts/chunks", help="Chunk store directory (or legacy meta.json)")
     parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=BACKENDS,
+                        help="Embedding backend (onnx/onnx-int8 need `python -m src.embeddings export`)")
     parser.add_argument("--top-k", type=int, default=5)
     parser.add_argument("--openai", dest="openai_completion", action="store_true")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists to probe (default: value saved at ingest)")
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW beam width (default: value saved at ingest)")
+    parser.add_argument("--rerank", type=int, default=None,
+                        help="Compressed indexes: candidates per result re-ranked exactly (0: off; default: ingest value)")
+    parser.add_argument("--shard-workers", default="process", choices=["inline", "process", "socket"],
+                        help="Sharded index (--index-path of a shards root): how shards are searched")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Persist query embeddings, retrievals and grounded answers across runs")
+    parser.add_argument("--fusion", default="rrf", choices=["rrf", "weighted", "dense"],
+                        help="Fuse dense and BM25 rankings (or 'dense' for vector search only)")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weighted fusion: weight of the dense score")
+    parser.add_argument("--cross-encoder", default=None,
+                        help="Re-rank candidates with this sentence-transformers CrossEncoder model")
+    parser.add_argument("--cross-encoder-candidates", type=int, default=50, help="Candidates re-ranked per query")
+    parser.add_argument("--cross-encoder-budget-ms", type=float, default=None,
+                        help="Keep the retriever's order when re-ranking takes longer than this")
+    parser.add_argument("--filter", dest="where", default=None,
+                        help='Metadata filter, e.g. "ext:md and path:docs/ and mtime>=2024-01-01" (see src/filters.py)')
+    parser.add_argument("--batch-file", default=None, help="JSONL file of questions to answer non-interactively")
+    parser.add_argument("--out", default="results.jsonl", help="Batch mode: JSONL output path")
+    parser.add_argument("--batch-size", type=int, default=256, help="Batch mode: questions per encode/search call")
+    parser.add_argument("--concurrency", type=int, default=8, help="Batch mode: parallel LLM calls")
+    parser.add_argument("--llm", default="openai", choices=["openai", "fake"],
+                        help="LLM client used with --openai (OPENAI_BASE_URL selects an OpenAI-compatible server)")
+    parser.add_argument("--llm-timeout", type=float, default=60.0, help="Seconds before an LLM request is retried")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="Token budget for the retrieved context sent to the LLM")
+    parser.add_argument("--answer-cache-size", type=int, default=1024,
+                        help="Retrieved sets whose grounded answers are kept (0 disables; interactive mode needs --cache-dir)")
+    parser.add_argument("--answer-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Reuse the answer of a question this similar over the same chunks (above 1: exact repeats only)")
+    parser.add_argument("--metrics-out", default=None,
+                        help="Write per-stage timings and counters (.prom: Prometheus text, .jsonl: appended JSON lines)")
+    parser.add_argument("--profile", default=None, help="Write a cProfile dump of the run to this path")
     args = parser.parse_args()
-    main(args.index_path, args.meta_path, args.model, args.top_k, args.openai_completion)
+    if args.metrics_out:
+        metrics.enable()
+    with metrics.profile(args.profile):
+        if args.batch_file:
+            model, index, store = load_resources(
+                args.model, args.index_path, args.meta_path, nprobe=args.nprobe, ef_search=args.ef_search,
+                rerank=args.rerank, shard_workers=args.shard_workers, backend=args.backend,
+            )
+            sparse = load_sparse(args.index_path) if args.fusion != "dense" else None
+            reranker = None
+            if args.cross_encoder:
+                reranker = Reranker(args.cross_encoder, candidates=args.cross_encoder_candidates,
+                                    budget_ms=args.cross_encoder_budget_ms)
+            client = None
+            if args.openai_completion:
+                client = make_client(args.llm, max_concurrency=args.concurrency, timeout=args.llm_timeout)
+            if args.openai_completion and client is None:
+                print("OPENAI_API_KEY is not set; writing retrieval results only")
+            answer_cache = None
+            if client is not None and args.answer_cache_size > 0:
+                answer_cache = AnswerCache(
+                    args.answer_cache_size, index_path=args.index_path, threshold=args.answer_threshold,
+                    embed=lambda q: encode_queries(model, [q])[0],
+                )
+            n = run_batch(
+                model, index, store, args.batch_file, args.out, args.top_k,
+                batch_size=args.batch_size, client=client, concurrency=args.concurrency,
+                sparse=sparse, fusion=args.fusion, alpha=args.alpha, max_context_tokens=args.context_tokens,
+                reranker=reranker, where=args.where, answer_cache=answer_cache,
+            )
+            print(f"Wrote {n} results to {args.out}")
+            if answer_cache is not None:
+                stats = answer_cache.stats()
+                print(f"Answer cache: {stats['hits']} hits ({stats['semantic_hits']} paraphrases), {stats['misses']} misses")
+        else:
+            main(
+                args.index_path,
+                args.meta_path,
+                args.model,
+                args.top_k,
+                args.openai_completion,
+                nprobe=args.nprobe,
+                ef_search=args.ef_search,
+                cache_dir=args.cache_dir,
+                fusion=args.fusion,
+                alpha=args.alpha,
+                rerank=args.rerank,
+                shard_workers=args.shard_workers,
+                llm=args.llm,
+                llm_timeout=args.llm_timeout,
+                max_context_tokens=args.context_tokens,
+                cross_encoder=args.cross_encoder,
+                cross_encoder_candidates=args.cross_encoder_candidates,
+                cross_encoder_budget_ms=args.cross_encoder_budget_ms,
+                backend=args.backend,
+                where=args.where,
+                answer_cache_size=args.answer_cache_size,
+                answer_threshold=args.answer_threshold,
+            )
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
+        print(f"Wrote metrics to {args.metrics_out}")
@@ -0,0 +1,103 @@
+"""Cross-encoder re-ranking of retrieved candidates.
+
+`src.query.search` over-fetches `candidates` chunks per query when given a `Reranker`;
+a cross-encoder (sentence-transformers `CrossEncoder`) scores every (query, chunk text)
+pair and the best `top_k` are returned with a `rerank_score`. Pairs from all queries
+of one `search` call are scored together in batches of `batch_size`, and scores are
+kept in an `LRUCache` keyed by (normalized query, chunk text digest), so repeated
+queries and chunks shared between queries are scored once.
+
+With `budget_ms`, no new batch is started once the budget is spent: queries whose
+candidates are not all scored keep the retriever's order (scores computed so far are
+still cached, so a repeated query gets further).
+
+Usage:
+    from src.reranker import Reranker
+    reranker = Reranker("cross-encoder/ms-marco-MiniLM-L-6-v2", candidates=50, budget_ms=200)
+    results = search(model, index, store, [query], top_k, reranker=reranker)
+
+    python -m src.query --cross-encoder cross-encoder/ms-marco-MiniLM-L-6-v2 --cross-encoder-candidates 50
+"""
+
+import hashlib
+import time
+from typing import Dict, List, Optional
+
+from src import metrics
+from src.cache import LRUCache, normalize_query
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class Reranker:
+    """Re-ranks retrieved rows with a cross-encoder under an optional time budget."""
+
+    def __init__(
+        self,
+        model=DEFAULT_MODEL,
+        candidates: int = 50,
+        batch_size: int = 32,
+        budget_ms: Optional[float] = None,
+        cache_size: int = 50_000,
+    ):
+        if isinstance(model, str):
+            try:
+                from sentence_transformers import CrossEncoder
+            except Exception as e:
+                raise RuntimeError("sentence-transformers is required for cross-encoder re-ranking") from e
+            model = CrossEncoder(model)
+        if candidates < 1 or batch_size < 1:
+            raise ValueError("candidates and batch_size must be positive")
+        self.model = model
+        self.candidates = candidates
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.fallbacks = 0  # queries left in retriever order because the budget ran out
+
+    @staticmethod
+    def _key(query: str, text: str):
+        return normalize_query(query), hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def rerank(
+        self, queries: List[str], results: List[List[Dict]], top_k: int, timings: Optional[Dict] = None
+    ) -> List[List[Dict]]:
+        """Return the best `top_k` rows per query by cross-encoder score (see module docstring)."""
+        t0 = time.perf_counter()
+        deadline = t0 + self.budget_ms / 1000.0 if self.budget_ms is not None else None
+        keys = [[self._key(q, row.get("text") or "") for row in rows] for q, rows in zip(queries, results)]
+        scores = {}
+        pending = {}  # unscored key -> (query, text), in query order
+        for q, rows, row_keys in zip(queries, results, keys):
+            for row, key in zip(rows, row_keys):
+                hit = self.cache.get(key) if self.cache is not None else None
+                if hit is not None:
+                    scores[key] = hit
+                elif key not in scores:
+                    pending.setdefault(key, (q, row.get("text") or ""))
+
+        pending_keys = list(pending)
+        with metrics.span("rerank"):
+            for start in range(0, len(pending_keys), self.batch_size):
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                batch = pending_keys[start:start + self.batch_size]
+                values = self.model.predict([pending[key] for key in batch], batch_size=self.batch_size,
+                                            show_progress_bar=False)
+                for key, value in zip(batch, values):
+                    scores[key] = float(value)
+                    if self.cache is not None:
+                        self.cache.put(key, float(value))
+
+        out = []
+        for rows, row_keys in zip(results, keys):
+            if any(key not in scores for key in row_keys):
+                self.fallbacks += 1
+                metrics.inc("rag_rerank_fallbacks_total")
+                out.append(rows[:top_k])
+                continue
+            ranked = sorted(zip(rows, row_keys), key=lambda pair: -scores[pair[1]])  # stable on ties
+            out.append([dict(row, rerank_score=scores[key]) for row, key in ranked[:top_k]])
+        if timings is not None:
+            timings["rerank_ms"] = timings.get("rerank_ms", 0.0) + (time.perf_counter() - t0) * 1000.0
+        return out
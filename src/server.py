@@ -0,0 +1,337 @@
+"""Long-lived retrieval service with a warm model and index.
+
+Loads the embedding model, FAISS index and chunk store once, then serves JSON over HTTP:
+
+- `POST /search`  `{"query": "...", "top_k": 5}` -> `{"results": [...]}`
+- `POST /answer`  `{"query": "...", "top_k": 5}` -> `{"results": [...], "answer": "...", "context_tokens": n, "cached": false}`
+
+Both take an optional `"filter"` metadata expression, e.g. `"ext:md and mtime>=2024-01-01"`
+(see `src.filters`).
+- `GET /health`
+- `GET /stats`: query and answer cache hit/miss counters
+- `GET /metrics`: per-stage latency histograms and counters in the Prometheus text format
+  (see `src.metrics`)
+
+Concurrent requests are micro-batched: the batcher waits up to `max_wait_ms` for more
+queries (or until `max_batch` are queued) and serves them with a single `model.encode`
+and a single `index.search` call (see `src.query.search`), fused with BM25 when ingest
+wrote a sparse index. An optional
+`src.cache.QueryCache` short-circuits repeated queries, and `--cross-encoder` re-ranks
+each batch's candidates (see `src.reranker`). Queries with different filters in one
+batch are searched in one call per filter. `/answer` reuses the grounded answer of a
+repeated or paraphrased question over the same chunks from a `src.answer_cache.AnswerCache`
+and reports `"cached": true`.
+
+Usage:
+    python -m src.server --index-path artifacts/faiss.index --meta-path artifacts/chunks --port 8000
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src import filters, metrics
+from src.answer_cache import DEFAULT_THRESHOLD, AnswerCache
+from src.cache import QueryCache
+from src.embeddings import BACKENDS, DEFAULT_BACKEND, encoder_key
+from src.llm import make_client
+from src.prompt_template import DEFAULT_CONTEXT_TOKENS
+from src.query import answer_question, encode_queries, load_resources, load_sparse, search
+from src.reranker import Reranker
+
+
+class MicroBatcher:
+    """Collects concurrent queries and answers them with one encode and one search call."""
+
+    def __init__(
+        self, model, index, store, max_batch: int = 32, max_wait_ms: float = 5.0, cache=None, sparse=None, fusion="rrf",
+        reranker=None,
+    ):
+        self.model = model
+        self.index = index
+        self.store = store
+        self.cache = cache
+        self.sparse = sparse
+        self.fusion = fusion
+        self.reranker = reranker
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, query: str, top_k: int, where: Optional[str] = None) -> Future:
+        fut = Future()
+        self._queue.put((query, top_k, where or None, fut))
+        return fut
+
+    def search(self, query: str, top_k: int, timeout: float = 30.0, where: Optional[str] = None) -> List[Dict]:
+        return self.submit(query, top_k, where).result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            groups = {}
+            for item in self._collect():
+                groups.setdefault(item[2], []).append(item)
+            self.batches += 1
+            for where, batch in groups.items():
+                top_k = max(k for _, k, _, _ in batch)
+                try:
+                    results = search(
+                        self.model, self.index, self.store, [q for q, _, _, _ in batch], top_k,
+                        cache=self.cache, sparse=self.sparse, fusion=self.fusion, reranker=self.reranker, where=where,
+                    )
+                except Exception as e:
+                    for _, _, _, fut in batch:
+                        fut.set_exception(e)
+                    continue
+                for (_, k, _, fut), rows in zip(batch, results):
+                    fut.set_result(rows[:k])
+
+
+class QueryService:
+    """Resident model/index/store plus the optional LLM client used by `/answer`."""
+
+    def __init__(
+        self,
+        model,
+        index,
+        store,
+        llm_client=None,
+        max_batch: int = 32,
+        max_wait_ms: float = 5.0,
+        default_top_k: int = 5,
+        cache=None,
+        sparse=None,
+        fusion: str = "rrf",
+        max_context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+        reranker=None,
+        answer_cache=None,
+    ):
+        self.batcher = MicroBatcher(
+            model, index, store, max_batch=max_batch, max_wait_ms=max_wait_ms, cache=cache, sparse=sparse, fusion=fusion,
+            reranker=reranker,
+        )
+        self.cache = cache
+        self.answer_cache = answer_cache
+        self.llm_client = llm_client
+        self.default_top_k = default_top_k
+        self.max_context_tokens = max_context_tokens
+
+    def search(self, query: str, top_k: int = None, where: Optional[str] = None) -> List[Dict]:
+        return self.batcher.search(query, top_k or self.default_top_k, where=where)
+
+    def answer(self, query: str, top_k: int = None, where: Optional[str] = None) -> Dict:
+        results = self.search(query, top_k, where)
+        usage = {}
+        answer = answer_question(self.llm_client, query, results, self.max_context_tokens, usage, self.answer_cache)
+        return {
+            "results": results, "answer": answer, "context_tokens": usage["context_tokens"], "cached": usage["cached"],
+        }
+
+
+def _make_handler(service: QueryService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, payload: Dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok", "batches": service.batcher.batches})
+            elif self.path == "/stats":
+                self._send(200, {
+                    "cache": service.cache.stats() if service.cache is not None else None,
+                    "answers": service.answer_cache.stats() if service.answer_cache is not None else None,
+                })
+            elif self.path == "/metrics":
+                body = metrics.REGISTRY.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path not in ("/search", "/answer"):
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                query = payload["query"]
+                top_k = int(payload.get("top_k") or service.default_top_k)
+                where = payload.get("filter") or None
+                if where is not None:
+                    filters.parse(where)
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {"error": f"invalid request: {e}"})
+                return
+            t0 = time.perf_counter()
+            try:
+                if self.path == "/search":
+                    self._send(200, {"results": service.search(query, top_k, where)})
+                elif service.llm_client is None:
+                    self._send(503, {"error": "no LLM client configured (set OPENAI_API_KEY)"})
+                else:
+                    self._send(200, service.answer(query, top_k, where))
+            except Exception as e:
+                metrics.inc("rag_request_errors_total", endpoint=self.path)
+                self._send(500, {"error": str(e)})
+            metrics.observe("rag_request_seconds", time.perf_counter() - t0, endpoint=self.path)
+
+        def log_message(self, format, *args):
+            # keep the request log off the hot path; errors are returned to the client
+            pass
+
+    return Handler
+
+
+def make_server(service: QueryService, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _make_handler(service))
+    server.daemon_threads = True
+    return server
+
+
+def main(
+    index_path,
+    meta_path,
+    model_name,
+    host,
+    port,
+    top_k,
+    max_batch,
+    max_wait_ms,
+    cache_size=10_000,
+    cache_ttl=3600.0,
+    cache_dir=None,
+    fusion="rrf",
+    max_context_tokens=DEFAULT_CONTEXT_TOKENS,
+    cross_encoder=None,
+    cross_encoder_candidates=50,
+    cross_encoder_budget_ms=None,
+    backend=DEFAULT_BACKEND,
+    answer_cache_size=1024,
+    answer_threshold=DEFAULT_THRESHOLD,
+):
+    index_path = Path(index_path)
+    meta_path = Path(meta_path)
+    if not index_path.exists() or not meta_path.exists():
+        print("Index or metadata not found. Run ingest first.")
+        return
+
+    metrics.enable()  # served at GET /metrics
+    model, index, store = load_resources(model_name, index_path, meta_path, backend=backend)
+    sparse = load_sparse(index_path) if fusion != "dense" else None
+    reranker = None
+    if cross_encoder:
+        reranker = Reranker(cross_encoder, candidates=cross_encoder_candidates, budget_ms=cross_encoder_budget_ms)
+    client = make_client("openai")  # one pooled client shared by all request threads
+
+    cache = None
+    if cache_size > 0:
+        disk_path = Path(cache_dir) / "query_cache.sqlite" if cache_dir else None
+        cache = QueryCache(
+            cache_size, cache_ttl, index_path=index_path, disk_path=disk_path,
+            model_name=encoder_key(model_name, backend),
+        )
+    answer_cache = None
+    if answer_cache_size > 0:
+        # a paraphrase is embedded through the query cache, which usually holds it already
+        answer_cache = AnswerCache(
+            answer_cache_size, index_path=index_path, embed=lambda q: encode_queries(model, [q], cache)[0],
+            threshold=answer_threshold, disk_path=Path(cache_dir) / "answer_cache.sqlite" if cache_dir else None,
+        )
+
+    service = QueryService(
+        model, index, store, client, max_batch=max_batch, max_wait_ms=max_wait_ms, default_top_k=top_k, cache=cache,
+        sparse=sparse, fusion=fusion, max_context_tokens=max_context_tokens, reranker=reranker,
+        answer_cache=answer_cache,
+    )
+    server = make_server(service, host, port)
+    print(f"Serving on http://{host}:{port} (POST /search, POST /answer, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-path", default="artifacts/faiss.index")
+    parser.add_argument("--meta-path", default="artifacts/chunks")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=BACKENDS, help="Embedding backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--max-batch", type=int, default=32, help="Max queries per encode/search call")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="How long to wait for a batch to fill")
+    parser.add_argument("--cache-size", type=int, default=10_000, help="Entries per cache level (0 disables)")
+    parser.add_argument("--cache-ttl", type=float, default=3600.0, help="Cache entry lifetime in seconds")
+    parser.add_argument("--cache-dir", default=None, help="Persist warm cache entries across restarts")
+    parser.add_argument("--answer-cache-size", type=int, default=1024,
+                        help="/answer: retrieved sets whose grounded answers are kept (0 disables)")
+    parser.add_argument("--answer-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="/answer: reuse the answer of a question this similar over the same chunks")
+    parser.add_argument("--fusion", default="rrf", choices=["rrf", "weighted", "dense"],
+                        help="Hybrid BM25 + dense fusion (or 'dense' only)")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="/answer: token budget for the retrieved context sent to the LLM")
+    parser.add_argument("--cross-encoder", default=None,
+                        help="Re-rank candidates with this sentence-transformers CrossEncoder model")
+    parser.add_argument("--cross-encoder-candidates", type=int, default=50, help="Candidates re-ranked per query")
+    parser.add_argument("--cross-encoder-budget-ms", type=float, default=None,
+                        help="Keep the retriever's order when re-ranking a batch takes longer than this")
+    args = parser.parse_args()
+    main(
+        args.index_path,
+        args.meta_path,
+        args.model,
+        args.host,
+        args.port,
+        args.top_k,
+        args.max_batch,
+        args.max_wait_ms,
+        cache_size=args.cache_size,
+        cache_ttl=args.cache_ttl,
+        cache_dir=args.cache_dir,
+        fusion=args.fusion,
+        max_context_tokens=args.context_tokens,
+        cross_encoder=args.cross_encoder,
+        cross_encoder_candidates=args.cross_encoder_candidates,
+        cross_encoder_budget_ms=args.cross_encoder_budget_ms,
+        backend=args.backend,
+        answer_cache_size=args.answer_cache_size,
+        answer_threshold=args.answer_threshold,
+    )
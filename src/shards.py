@@ -0,0 +1,482 @@
+"""Sharded indexes: partitioned ingest and scatter-gather search.
+
+Files are assigned to one of N shards by a hash of their path relative to the data
+directory, and each shard is an ordinary ingest output (FAISS index, chunk store,
+manifest, BM25 index) under `<root>/shard-XX/`, so shards are rebuilt (or incrementally
+updated) independently. `<root>/shards.json` records the layout.
+
+Global chunk ids are `local_id * num_shards + shard`. `ShardedIndex.search` sends each
+query batch to every shard worker, then merges the per-shard top-k lists (each sorted by
+distance) with a heap into the global top-k, so results match a single index over the
+same vectors. Workers are
+
+- `inline`: the shard indexes are searched in this process;
+- `process`: one worker process per shard (its own memory and core), over a pipe;
+- `socket`: shard servers reached over TCP, a stand-in for remote nodes. Without
+  `addresses`, local servers are started on free ports; run remote ones with `serve`.
+
+`ShardedStore` and `ShardedBM25` give the chunk store and BM25 views over global ids.
+BM25 statistics are per shard, so fused sparse scores approximate a single index.
+
+Usage:
+    python -m src.shards build --data-dir data --root artifacts/shards --shards 4
+    python -m src.shards build --data-dir data --root artifacts/shards --only 2 --incremental
+    python -m src.query --index-path artifacts/shards --meta-path artifacts/shards
+    python -m src.shards serve --root artifacts/shards --shard 0 --port 7700
+"""
+
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src import ann_index, guardrail
+from src.bm25 import BM25Index, bm25_path
+from src.chunk_store import open_chunk_store
+from src.embedding_cache import DEFAULT_DIR as EMBEDDING_CACHE_DIR
+from src.embeddings import BACKENDS, DEFAULT_BACKEND
+from src.filters import parse_tags, search_filtered
+
+LAYOUT_FILE = "shards.json"
+LAYOUT_VERSION = 1
+WORKER_MODES = ("inline", "process", "socket")
+# shared secret for shard servers (HMAC challenge on connect)
+AUTHKEY_ENV = "RAG_SHARD_AUTHKEY"
+
+
+def shard_of(relative_path: str, num_shards: int) -> int:
+    """Shard of a file, from a stable hash of its path relative to the data directory."""
+    digest = hashlib.sha1(relative_path.replace(os.sep, "/").encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def shard_dir(root, shard: int) -> Path:
+    return Path(root) / f"shard-{shard:02d}"
+
+
+def shard_paths(root, shard: int) -> Tuple[Path, Path]:
+    """(index_path, meta_path) of one shard."""
+    return shard_dir(root, shard) / "faiss.index", shard_dir(root, shard) / "chunks"
+
+
+def is_sharded(path) -> bool:
+    return (Path(path) / LAYOUT_FILE).is_file()
+
+
+def load_layout(root) -> dict:
+    with open(Path(root) / LAYOUT_FILE, "r", encoding="utf-8") as f:
+        layout = json.load(f)
+    if layout.get("version") != LAYOUT_VERSION:
+        raise ValueError(f"{root}: unsupported shard layout version {layout.get('version')!r}")
+    return layout
+
+
+def build_shards(data_dir, root, model_name: str, num_shards: Optional[int] = None,
+                 only: Optional[Iterable[int]] = None, **ingest_kwargs) -> dict:
+    """Run ingest for each shard of `data_dir` (or only the shards in `only`) under `root`.
+
+    `num_shards` may be omitted when `root` already holds a layout. Changing the shard
+    count requires rebuilding every shard. Other keyword arguments go to `ingest.main`.
+    """
+    from src import ingest
+
+    root = Path(root)
+    if is_sharded(root):
+        layout = load_layout(root)
+        if num_shards is not None and num_shards != layout["num_shards"] and only is not None:
+            raise ValueError(f"{root} has {layout['num_shards']} shards; rebuild all shards to change the count")
+        num_shards = num_shards or layout["num_shards"]
+    if not num_shards or num_shards < 1:
+        raise ValueError("num_shards must be a positive integer")
+    shards = sorted(set(only)) if only is not None else list(range(num_shards))
+    if any(not 0 <= s < num_shards for s in shards):
+        raise ValueError(f"shard numbers must be in [0, {num_shards})")
+
+    root.mkdir(parents=True, exist_ok=True)
+    if only is None:
+        # drop shards left over from a build with more shards
+        for stale in root.glob("shard-*"):
+            if stale.is_dir() and stale.name not in {shard_dir(root, s).name for s in range(num_shards)}:
+                shutil.rmtree(stale)
+    for shard in shards:
+        index_path, meta_path = shard_paths(root, shard)
+        if not ingest.list_files(data_dir, (shard, num_shards)):
+            print(f"Shard {shard}/{num_shards}: no documents")
+            if shard_dir(root, shard).exists():
+                shutil.rmtree(shard_dir(root, shard))
+            continue
+        print(f"Shard {shard}/{num_shards}:")
+        ingest.main(data_dir, index_path, meta_path, model_name, shard=(shard, num_shards), **ingest_kwargs)
+
+    layout = {
+        "version": LAYOUT_VERSION,
+        "num_shards": num_shards,
+        "model": model_name,
+        "shards": [
+            {"index_path": str(p[0].relative_to(root)), "meta_path": str(p[1].relative_to(root))}
+            for p in (shard_paths(root, s) for s in range(num_shards))
+        ],
+    }
+    tmp = root / (LAYOUT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(layout, f, indent=2)
+    os.replace(tmp, root / LAYOUT_FILE)
+    return layout
+
+
+def to_global(local_ids: np.ndarray, shard: int, num_shards: int) -> np.ndarray:
+    local_ids = np.asarray(local_ids, dtype="int64")
+    return np.where(local_ids >= 0, local_ids * num_shards + shard, -1)
+
+
+def merge_topk(rows: Sequence[Tuple[np.ndarray, np.ndarray]], k: int, descending: bool = False):
+    """Merge per-shard (scores, global ids) rows, each sorted best first, into the global top k.
+
+    Returns (scores, ids) padded like `index.search` (-1 ids).
+    """
+    streams = [
+        [(float(s), int(i)) for s, i in zip(scores, ids) if i >= 0]
+        for scores, ids in rows
+    ]
+    key = (lambda t: (-t[0], t[1])) if descending else (lambda t: (t[0], t[1]))
+    best = list(itertools.islice(heapq.merge(*streams, key=key), k))
+    scores = np.full(k, 0.0 if descending else np.inf, dtype="float32")
+    ids = np.full(k, -1, dtype="int64")
+    for n, (score, chunk_id) in enumerate(best):
+        scores[n], ids[n] = score, chunk_id
+    return scores, ids
+
+
+def _load_shard_index(index_path, nprobe=None, ef_search=None, rerank=None):
+    """Shard index, or None when the shard holds no files."""
+    return ann_index.load_index(index_path, nprobe, ef_search, rerank) if Path(index_path).exists() else None
+
+
+def _search_shard(index, x: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+    if index is None or index.ntotal == 0:
+        return np.full((len(x), k), np.inf, dtype="float32"), np.full((len(x), k), -1, dtype="int64")
+    if mask is not None:
+        return search_filtered(index, x, k, mask)
+    return index.search(x, k)
+
+
+def _pack_mask(mask: Optional[np.ndarray]):
+    return None if mask is None else (np.packbits(mask, bitorder="little"), len(mask))
+
+
+def _unpack_mask(packed) -> Optional[np.ndarray]:
+    if packed is None:
+        return None
+    bits, n = packed
+    return np.unpackbits(bits, count=n, bitorder="little").astype(bool)
+
+
+def _serve_connection(conn, index):
+    """Answer (queries, k, packed mask or None) requests on `conn` until it closes or receives None."""
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            return
+        if request is None:
+            return
+        x, k, packed = request
+        try:
+            conn.send(("ok", _search_shard(index, np.ascontiguousarray(x, dtype="float32"), k, _unpack_mask(packed))))
+        except Exception as e:  # report to the coordinator instead of dying silently
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _process_worker(conn, index_path, nprobe, ef_search, rerank):
+    _serve_connection(conn, _load_shard_index(index_path, nprobe, ef_search, rerank))
+
+
+def serve(index_path, host: str = "127.0.0.1", port: int = 0, authkey: Optional[bytes] = None,
+          nprobe=None, ef_search=None, rerank=None, ready=None):
+    """Serve one shard index over TCP, one client connection at a time, forever.
+
+    `ready` (a connection) receives the bound address once listening.
+    """
+    index = _load_shard_index(index_path, nprobe, ef_search, rerank)
+    authkey = authkey or os.environ.get(AUTHKEY_ENV, "").encode() or None
+    if authkey is None:
+        raise RuntimeError(f"set {AUTHKEY_ENV} (shared with the query side) to serve shards")
+    with Listener((host, port), authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            with listener.accept() as conn:
+                _serve_connection(conn, index)
+
+
+def _socket_worker(ready, index_path, authkey, nprobe, ef_search, rerank):
+    serve(index_path, authkey=authkey, nprobe=nprobe, ef_search=ef_search, rerank=rerank, ready=ready)
+
+
+class ShardedIndex:
+    """Scatter-gather search over the shards of a root written by `build_shards`.
+
+    Has the `search(x, k) -> (D, I)` interface of a FAISS index, with global chunk ids.
+    A boolean `mask` over global ids restricts every shard's search to the ids it selects
+    (see `src.filters.search_filtered`).
+    """
+
+    def __init__(self, root, mode: str = "process", addresses: Optional[List[Tuple[str, int]]] = None,
+                 authkey: Optional[bytes] = None, nprobe=None, ef_search=None, rerank=None):
+        if mode not in WORKER_MODES:
+            raise ValueError(f"Unknown shard worker mode {mode!r}; expected one of {', '.join(WORKER_MODES)}")
+        self.root = Path(root)
+        self.layout = load_layout(self.root)
+        self.num_shards = self.layout["num_shards"]
+        self.mode = mode
+        index_paths = [self.root / s["index_path"] for s in self.layout["shards"]]
+        self._indexes = []
+        self._conns = []
+        self._procs = []
+        knobs = (nprobe, ef_search, rerank)
+        if mode == "inline":
+            self._indexes = [_load_shard_index(p, *knobs) for p in index_paths]
+            return
+        ctx = multiprocessing.get_context("spawn")  # faiss/OpenMP state is not fork-safe
+        if mode == "process":
+            for path in index_paths:
+                parent, child = ctx.Pipe()
+                proc = ctx.Process(target=_process_worker, args=(child, str(path)) + knobs, daemon=True)
+                proc.start()
+                child.close()
+                self._procs.append(proc)
+                self._conns.append(parent)
+            return
+        authkey = authkey or os.environ.get(AUTHKEY_ENV, "").encode() or os.urandom(16)
+        if addresses is None:
+            addresses = []
+            for path in index_paths:
+                parent, child = ctx.Pipe()
+                proc = ctx.Process(target=_socket_worker, args=(child, str(path), authkey) + knobs, daemon=True)
+                proc.start()
+                child.close()
+                self._procs.append(proc)
+                addresses.append(parent.recv())
+        if len(addresses) != self.num_shards:
+            raise ValueError(f"need one address per shard ({self.num_shards}); got {len(addresses)}")
+        self._conns = [Client(tuple(address), authkey=authkey) for address in addresses]
+
+    def search(self, x: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+        x = np.ascontiguousarray(x, dtype="float32")
+        masks = [None if mask is None else mask[shard::self.num_shards] for shard in range(self.num_shards)]
+        if self.mode == "inline":
+            results = [_search_shard(index, x, k, m) for index, m in zip(self._indexes, masks)]
+        else:
+            for conn, m in zip(self._conns, masks):  # scatter first so shards search concurrently
+                conn.send((x, k, _pack_mask(m)))
+            results = []
+            for shard, conn in enumerate(self._conns):
+                status, payload = conn.recv()
+                if status != "ok":
+                    raise RuntimeError(f"shard {shard} failed: {payload}")
+                results.append(payload)
+        D = np.empty((len(x), k), dtype="float32")
+        I = np.empty((len(x), k), dtype="int64")
+        for row in range(len(x)):
+            D[row], I[row] = merge_topk(
+                [(d[row], to_global(i[row], shard, self.num_shards)) for shard, (d, i) in enumerate(results)], k
+            )
+        return D, I
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(None)
+                conn.close()
+            except OSError:
+                pass
+        for proc in self._procs:
+            if self.mode == "socket":
+                proc.terminate()  # servers keep accepting connections
+            proc.join(timeout=5)
+        self._conns, self._procs, self._indexes = [], [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedStore:
+    """Chunk store read API over the shard stores, addressed by global chunk id."""
+
+    # duplicates are only linked within a shard, so the query path collapses the rest
+    deduplicated = False
+
+    def __init__(self, root):
+        self.root = Path(root)
+        layout = load_layout(self.root)
+        self.num_shards = layout["num_shards"]
+        self._stores = []
+        for s in layout["shards"]:
+            meta_path = self.root / s["meta_path"]
+            self._stores.append(open_chunk_store(meta_path) if meta_path.exists() else None)
+
+    def __len__(self) -> int:
+        """Global id slots (one past the largest global id)."""
+        return max((len(s) * self.num_shards for s in self._stores if s is not None), default=0)
+
+    def _locate(self, chunk_id: int):
+        chunk_id = int(chunk_id)
+        if chunk_id < 0:
+            return None, -1
+        return self._stores[chunk_id % self.num_shards], chunk_id // self.num_shards
+
+    def __getitem__(self, chunk_id: int):
+        store, local = self._locate(chunk_id)
+        return store[local] if store is not None else None
+
+    def get(self, ids: Iterable[int]):
+        return [self[int(i)] for i in ids]
+
+    def iter_records(self):
+        for shard, store in enumerate(self._stores):
+            if store is not None:
+                for local, record in store.iter_records():
+                    yield local * self.num_shards + shard, record
+
+    def canonical_of(self, chunk_id: int) -> int:
+        store, local = self._locate(chunk_id)
+        if store is None:
+            return int(chunk_id)
+        return store.canonical_of(local) * self.num_shards + int(chunk_id) % self.num_shards
+
+    def duplicates_of(self, chunk_id: int) -> List[int]:
+        store, local = self._locate(chunk_id)
+        if store is None:
+            return []
+        shard = int(chunk_id) % self.num_shards
+        return [d * self.num_shards + shard for d in store.duplicates_of(local)]
+
+    def duplicate_links(self) -> Dict[int, int]:
+        links = {}
+        for shard, store in enumerate(self._stores):
+            if store is not None:
+                n = self.num_shards
+                links.update({d * n + shard: c * n + shard for d, c in store.duplicate_links().items()})
+        return links
+
+    def sensitive_flags(self, ids: Iterable[int]) -> np.ndarray:
+        """`ChunkStore.sensitive_flags` over global ids."""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        flags = np.full(len(ids), guardrail.UNKNOWN, dtype=np.uint8)
+        for shard, store in enumerate(self._stores):
+            rows = np.flatnonzero((ids >= 0) & (ids % self.num_shards == shard))
+            if store is not None and len(rows):
+                flags[rows] = store.sensitive_flags(ids[rows] // self.num_shards)
+        return flags
+
+    def file_attributes(self):
+        """`ChunkStore.file_attributes` over global ids (file rows of all shards
+        concatenated), or None unless every shard store records them."""
+        tables = [s.file_attributes() if s is not None else None for s in self._stores]
+        if any(t is None and s is not None for t, s in zip(tables, self._stores)):
+            return None
+        chunk_files = np.full(len(self), -1, dtype="int64")
+        live = np.zeros(len(self), dtype=bool)
+        files = []
+        for shard, table in enumerate(tables):
+            if table is None:
+                continue
+            rows, shard_files, shard_live = table
+            chunk_files[shard::self.num_shards][:len(rows)] = np.where(rows >= 0, rows + len(files), -1)
+            live[shard::self.num_shards][:len(shard_live)] = shard_live
+            files.extend(shard_files)
+        return chunk_files, files, live
+
+    def close(self):
+        for store in self._stores:
+            if store is not None:
+                store.close()
+        self._stores = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedBM25:
+    """Per-shard BM25 indexes searched together, with global chunk ids."""
+
+    def __init__(self, shards: List[Optional[BM25Index]]):
+        self.shards = shards
+        self.num_shards = len(shards)
+
+    @classmethod
+    def load(cls, root) -> Optional["ShardedBM25"]:
+        """Load the BM25 index of every shard, or None if no shard has one."""
+        root = Path(root)
+        layout = load_layout(root)
+        paths = [bm25_path(root / s["index_path"]) for s in layout["shards"]]
+        shards = [BM25Index.load(p) if p.exists() else None for p in paths]
+        return cls(shards) if any(s is not None for s in shards) else None
+
+    def search(self, queries: List[str], top_k: int, mask: Optional[np.ndarray] = None):
+        results = []
+        for shard, bm25 in enumerate(self.shards):
+            if bm25 is None:
+                results.append((np.zeros((len(queries), top_k), "float32"), np.full((len(queries), top_k), -1)))
+            else:
+                S, I = bm25.search(queries, top_k, None if mask is None else mask[shard::self.num_shards])
+                results.append((S, to_global(I, shard, self.num_shards)))
+        S = np.zeros((len(queries), top_k), dtype="float32")
+        I = np.full((len(queries), top_k), -1, dtype="int64")
+        for row in range(len(queries)):
+            S[row], I[row] = merge_topk([(s[row], i[row]) for s, i in results], top_k, descending=True)
+        return S, I
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Ingest documents into N shards (or rebuild some of them)")
+    build.add_argument("--data-dir", default="data")
+    build.add_argument("--root", default="artifacts/shards", help="Directory holding the shards and shards.json")
+    build.add_argument("--model", default="all-MiniLM-L6-v2")
+    build.add_argument("--shards", type=int, default=None, help="Number of shards (default: existing layout)")
+    build.add_argument("--only", type=int, nargs="+", default=None, help="Rebuild only these shard numbers")
+    build.add_argument("--incremental", action="store_true", help="Only re-embed new or changed files per shard")
+    build.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parse worker processes")
+    build.add_argument("--index-type", default="flat", choices=ann_index.INDEX_TYPES)
+    build.add_argument("--quantize", default=None, choices=ann_index.QUANTIZERS)
+    build.add_argument("--backend", default=DEFAULT_BACKEND, choices=BACKENDS, help="Embedding backend")
+    build.add_argument("--tag", action="append", default=[], metavar="PATTERN=TAG[,TAG]",
+                       help="Tag files matching the glob for `tag:` filters (repeatable)")
+    build.add_argument("--embedding-cache", default=EMBEDDING_CACHE_DIR,
+                       help="Directory of the embedding cache shared by all shards")
+    build.add_argument("--no-embedding-cache", dest="embedding_cache", action="store_const", const=None)
+    serve_cmd = sub.add_parser("serve", help=f"Serve one shard over TCP (shared secret from ${AUTHKEY_ENV})")
+    serve_cmd.add_argument("--root", default="artifacts/shards")
+    serve_cmd.add_argument("--shard", type=int, required=True)
+    serve_cmd.add_argument("--host", default="127.0.0.1")
+    serve_cmd.add_argument("--port", type=int, default=7700)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_shards(
+            args.data_dir, args.root, args.model, args.shards, only=args.only, incremental=args.incremental,
+            workers=args.workers, index_type=args.index_type, index_params={"quantize": args.quantize},
+            backend=args.backend, tags=parse_tags(args.tag), embedding_cache=args.embedding_cache,
+        )
+    else:
+        index_path = Path(args.root) / load_layout(args.root)["shards"][args.shard]["index_path"]
+        print(f"Serving shard {args.shard} ({index_path}) on {args.host}:{args.port}")
+        serve(index_path, args.host, args.port)
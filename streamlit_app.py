@@ -1,8 +1,11 @@
 import os
+import time
 from pathlib import Path
 
 import streamlit as st
 
+from src import metrics
+
 try:
     import faiss
 except Exception:
@@ -14,21 +17,87 @@ except Exception:
 
 st.set_page_config(page_title="RAG Demo", layout="wide")
 
+
+# Streamlit reruns this script on every interaction; keep the model and artifacts in a
+# process-wide cache. Artifact mtimes are part of the key, so a rebuilt index or chunk
+# store is reloaded on the next search while the model stays warm.
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_model(model_name, backend):
+    from src.embeddings import load_encoder
+
+    return load_encoder(model_name, backend)
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_artifacts(index_path, index_mtime, meta_path, meta_mtime):
+    from src.chunk_store import open_chunk_store
+    from src.query import load_index, load_sparse
+
+    # ingest rewrites the BM25 index together with the FAISS index, so index_mtime covers both
+    return load_index(Path(index_path)), open_chunk_store(meta_path), load_sparse(index_path)
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_reranker(model_name, candidates):
+    from src.reranker import Reranker
+
+    return Reranker(model_name, candidates=candidates)
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_answer_cache(index_path, model_name, backend):
+    from src.answer_cache import AnswerCache
+    from src.query import encode_queries
+
+    # answers are keyed on the index fingerprint, so a rebuilt index starts empty
+    return AnswerCache(
+        index_path=index_path, embed=lambda q: encode_queries(_load_model(model_name, backend), [q])[0]
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _load_llm(api_key):
+    from src.llm import make_client
+
+    # one pooled client for every session, so connections are reused across reruns
+    return make_client("openai", api_key=api_key)
+
+
 st.title("Retrieval-Augmented Generation — Demo")
 
 col1, col2 = st.columns([2, 1])
 
 with col2:
     index_path = st.text_input("FAISS index path", value="artifacts/faiss.index")
-    meta_path = st.text_input("Metadata JSON path", value="artifacts/meta.json")
+    meta_path = st.text_input("Chunk store path", value="artifacts/chunks")
     model_name = st.text_input("Embedding model", value="all-MiniLM-L6-v2")
     top_k = st.slider("Top K", 1, 10, 5)
+    retrieval = st.selectbox(
+        "Retrieval", ["Hybrid (RRF)", "Hybrid (weighted)", "Dense only"], help="BM25 + vector search fusion"
+    )
+    backend = st.selectbox(
+        "Embedding backend", ["torch", "torch-int8", "onnx", "onnx-int8"],
+        help="onnx backends need `python -m src.embeddings export` first",
+    )
+    cross_encoder = st.text_input(
+        "Cross-encoder re-ranker (optional)", value="", help="e.g. cross-encoder/ms-marco-MiniLM-L-6-v2"
+    )
     use_openai = st.checkbox("Enable OpenAI grounded answer (requires OPENAI_API_KEY)")
+    context_tokens = st.number_input("Context token budget", 256, 32000, 3000, step=256)
+    rerank_candidates = st.number_input("Re-rank candidates", 10, 200, 50, step=10)
 
 with col1:
     query = st.text_input("Enter your question")
     submit = st.button("Search")
 
+with st.sidebar:
+    st.header("Filters")
+    filter_path = st.text_input("Path prefix", help="Source path or path relative to the data directory")
+    filter_ext = st.multiselect("Extensions", ["txt", "md", "pdf"])
+    filter_since = st.text_input("Modified on/after (YYYY-MM-DD)")
+    filter_tags = st.text_input("Tags (any of, comma-separated)", help="Assigned at ingest with --tag PATTERN=TAG")
+    filter_raw = st.text_input("Filter expression", help="e.g. (ext:md or tag:hr) and not path:drafts/")
+
 if submit:
     if faiss is None:
         st.error("faiss is not available in this environment. Install faiss-cpu.")
@@ -40,8 +109,11 @@ if submit:
         else:
             with st.spinner("Loading model and index..."):
                 try:
-                    from sentence_transformers import SentenceTransformer
-                    from src.query import load_index, generate_grounded_response
+                    from src.answer_cache import llm_model
+                    from src.query import (
+                        artifact_mtime, build_retrieved_context, context_chunk_ids, context_records, search,
+                        sensitive_refusal, stream_grounded_response,
+                    )
                 except Exception as e:
                     st.error(
                         "Missing or failed-to-import dependency: %s. "
@@ -49,28 +121,57 @@ if submit:
                     )
                     st.stop()
 
-                model = SentenceTransformer(model_name)
-                index = load_index(idx_path)
-
-            # load metadata
-            import json
-
-            with open(meta_p, "r", encoding="utf-8") as f:
-                metadatas = json.load(f)
-
-            q_emb = model.encode([query], convert_to_numpy=True).astype("float32")
-            D, I = index.search(q_emb, top_k)
-            I = I[0]
-
-            results = []
-            for idx in I:
-                if idx < 0 or idx >= len(metadatas):
-                    continue
-                results.append(metadatas[idx])
+                stages = {}  # per-stage ms of this run, shown in the sidebar
+                t0 = time.perf_counter()
+                with metrics.record_stages(stages):
+                    with metrics.span("model_load"):
+                        model = _load_model(model_name, backend)
+                    with metrics.span("index_load"):
+                        index, store, sparse = _load_artifacts(
+                            str(idx_path), artifact_mtime(idx_path), str(meta_p), artifact_mtime(meta_p)
+                        )
+                    reranker = _load_reranker(cross_encoder, int(rerank_candidates)) if cross_encoder else None
+                load_s = time.perf_counter() - t0
+
+            fusion = {"Hybrid (RRF)": "rrf", "Hybrid (weighted)": "weighted"}.get(retrieval)
+            if fusion is None:
+                sparse = None
+            elif sparse is None:
+                st.info("No BM25 index found next to the FAISS index; using dense retrieval only.")
+            from src.filters import build_expression, parse
+
+            where = " and ".join(p for p in (
+                build_expression(filter_path.strip(), filter_ext, filter_since.strip(), tags=filter_tags.split(",")),
+                f"({filter_raw})" if filter_raw.strip() else "",
+            ) if p)
+            if where:
+                try:
+                    parse(where)
+                except ValueError as e:
+                    st.error(f"Invalid filter: {e}")
+                    st.stop()
+            timings = {}
+            t0 = time.perf_counter()
+            with metrics.record_stages(stages):
+                results = search(
+                    model, index, store, [query], top_k, sparse=sparse, fusion=fusion or "rrf", timings=timings,
+                    reranker=reranker, where=where or None,
+                )[0]
+            search_s = time.perf_counter() - t0
+
+            with col2:
+                st.caption("Timing")
+                st.metric("Load model/index", f"{load_s * 1000:.0f} ms")
+                st.metric("Search", f"{search_s * 1000:.1f} ms")
+                for key, label in (("dense_ms", "Dense"), ("sparse_ms", "BM25"), ("fusion_ms", "Fusion"), ("rerank_ms", "Re-rank")):
+                    if key in timings:
+                        st.metric(label, f"{timings[key]:.1f} ms")
 
             st.subheader("Retrieved sources")
             for r in results:
-                st.markdown(f"- **{r.get('source','<unknown>')}** — chunk {r.get('chunk_index')}")
+                also = [s for s in r.get("sources", [])[1:] if s]
+                suffix = f" (also in {', '.join(also)})" if also else ""
+                st.markdown(f"- **{r.get('source','<unknown>')}** — chunk {r.get('chunk_index')}{suffix}")
                 excerpt = r.get('text', '')[:500]
                 st.code(excerpt)
 
@@ -79,39 +180,30 @@ if submit:
                 if not api_key:
                     st.warning("OPENAI_API_KEY is not set in the environment.")
                 else:
-                    # build concatenated retrieved_context
-                    context_excerpts = []
-                    for r in results:
-                        src = r.get("source", "<unknown>")
-                        text = r.get("text", "")
-                        context_excerpts.append(f"Source: {src}\n{text}")
-                    retrieved_context = "\n---\n".join(context_excerpts)
-
-                    with st.spinner("Generating grounded answer..."):
+                    with metrics.record_stages(stages):
+                        context = build_retrieved_context(results, int(context_tokens))
+                    refusal_msg = sensitive_refusal(query, context_records(results, context))
+
+                    st.subheader("Grounded answer")
+                    st.caption(f"Context: {context.tokens} tokens from {len(context.used)} of {len(results)} chunks")
+                    if refusal_msg is not None:
+                        st.write(refusal_msg)
+                    else:
+                        client = _load_llm(api_key)
+                        answers = _load_answer_cache(str(idx_path), model_name, backend)
+                        hits = answers.hits
                         try:
-                            # generate_grounded_response expects an OpenAI-style client; try to instantiate if available
-                            try:
-                                from openai import OpenAI
-
-                                client = OpenAI(api_key=api_key)
-                                answer = generate_grounded_response(client, retrieved_context, query)
-                            except Exception:
-                                # fallback to module-style
-                                import openai as _openai
-
-                                _openai.api_key = api_key
-                                resp = _openai.ChatCompletion.create(
-                                    model="gpt-4o-mini",
-                                    messages=[
-                                        {"role": "system", "content": "Use only provided sources."},
-                                        {"role": "user", "content": retrieved_context + "\n\nQuestion:\n" + query},
-                                    ],
-                                    max_tokens=400,
-                                    temperature=0.0,
-                                )
-                                answer = resp["choices"][0]["message"]["content"]
-
-                            st.subheader("Grounded answer")
-                            st.write(answer)
+                            # tokens are rendered as they arrive, so the wait is the first-token latency
+                            with metrics.record_stages(stages), metrics.span("llm"):
+                                st.write_stream(answers.stream(
+                                    query, context_chunk_ids(results, context),
+                                    stream_grounded_response(client, context.text, query), llm_model(client),
+                                ))
+                            if answers.hits > hits:
+                                st.caption("Served from the answer cache")
                         except Exception as e:
-                            st.error(f"OpenAI request failed: {e}")
+                            st.error(f"LLM request failed: {e}")
+
+            with st.sidebar:
+                st.caption("Stage breakdown")
+                st.table({"stage": list(stages), "ms": [round(ms, 1) for ms in stages.values()]})
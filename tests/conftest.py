@@ -0,0 +1,46 @@
+import hashlib
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# ensure repo root is on sys.path so `src` imports work in tests
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+class FakeEncoder:
+    """Deterministic stand-in for SentenceTransformer: hashed character trigrams, L2-normalised."""
+
+    dim = 64
+
+    def __init__(self, model_name="fake", *args, **kwargs):
+        self.model_name = model_name
+        self.calls = []
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, sentences, **kwargs):
+        self.calls.append(list(sentences))
+        out = np.zeros((len(sentences), self.dim), dtype="float32")
+        for row, text in enumerate(sentences):
+            text = text.lower()
+            for i in range(max(1, len(text) - 2)):
+                h = hashlib.md5(text[i:i + 3].encode("utf-8")).digest()
+                out[row, h[0] % self.dim] += 1.0
+            norm = np.linalg.norm(out[row])
+            if norm:
+                out[row] /= norm
+        return out
+
+
+@pytest.fixture
+def fake_encoder(monkeypatch):
+    """Patch `src.ingest.load_encoder` and return the shared fake instance."""
+    from src import ingest
+
+    encoder = FakeEncoder()
+    monkeypatch.setattr(ingest, "load_encoder", lambda *a, **k: encoder)
+    return encoder
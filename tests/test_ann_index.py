@@ -0,0 +1,160 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from src import ann_index, ingest
+from src.query import load_index
+
+
+def _vectors(n=2000, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dim)).astype("float32")
+
+
+def test_training_buffer_trains_on_sample_and_replays_all_vectors(tmp_path):
+    xb = _vectors()
+    params = ann_index.resolve_params("ivf", nlist=16, train_sample=700)
+    index = ann_index.build_index(16, params)
+    buf = ann_index.TrainingBuffer(index, params, 16, tmp_dir=tmp_path)
+    for start in range(0, len(xb), 300):
+        buf.add_with_ids(xb[start:start + 300], np.arange(start, min(start + 300, len(xb))))
+    index, built = buf.finish()
+
+    assert index.is_trained and index.ntotal == len(xb)
+    assert built["nlist"] == 16
+    assert list(tmp_path.iterdir()) == []  # spool removed
+    ann_index.apply_search_params(index, dict(built, nprobe=16))
+    _, I = index.search(xb[:20], 1)
+    assert list(I[:, 0]) == list(range(20))
+
+
+def test_reservoir_sample_is_uniform_across_batches():
+    stream = np.arange(20, dtype="float32")[:, None]
+    counts = np.zeros(20)
+    for seed in range(2000):
+        reservoir = ann_index.ReservoirSample(5, 1, seed=seed)
+        for start in range(0, 20, 3):
+            reservoir.add(stream[start:start + 3])
+        picked = reservoir.sample[:, 0].astype(int)
+        assert reservoir.seen == 20 and len(set(picked)) == 5
+        counts[picked] += 1
+    # every row is kept with probability size / seen
+    np.testing.assert_allclose(counts / 2000, 0.25, atol=0.04)
+
+    partial = ann_index.ReservoirSample(5, 1)
+    partial.add(stream[:3])
+    assert partial.sample[:, 0].tolist() == [0, 1, 2]
+
+
+def test_small_corpus_shrinks_nlist():
+    params = ann_index.fit_to_training_size(ann_index.resolve_params("ivfpq", nlist=1024, pq_m=8), 400, 64)
+    assert params["nlist"] == 10
+    assert params["pq_bits"] == 3
+    with pytest.raises(ValueError):
+        ann_index.fit_to_training_size(ann_index.resolve_params("ivfpq", pq_m=7), 400, 64)
+
+
+def test_recall_at_k():
+    truth = np.array([[1, 2, 3], [4, 5, 6]])
+    found = np.array([[3, 2, 9], [4, -1, -1]])
+    assert ann_index.recall_at_k(truth, found, 3) == pytest.approx(3 / 6)
+
+
+@pytest.mark.parametrize("index_type,knob", [("ivf", "nprobe"), ("hnsw", "efSearch")])
+def test_ingest_saves_params_and_load_index_restores_knobs(tmp_path, fake_encoder, index_type, knob):
+    data = tmp_path / "data"
+    data.mkdir()
+    for n in range(5):
+        (data / f"d{n}.txt").write_text(f"document number {n} " * 200)
+    out = tmp_path / "out"
+    ingest.main(
+        data, out / "faiss.index", out / "chunks", "fake",
+        index_type=index_type, index_params={"nprobe": 3, "ef_search": 77},
+    )
+
+    saved = ann_index.load_params(out / "faiss.index")
+    assert saved["index_type"] == index_type
+    index = load_index(out / "faiss.index")
+    inner = faiss.downcast_index(index.index)
+    value = inner.nprobe if knob == "nprobe" else inner.hnsw.efSearch
+    assert value == (3 if knob == "nprobe" else 77)
+    if knob == "nprobe":
+        assert faiss.downcast_index(load_index(out / "faiss.index", nprobe=5).index).nprobe == 5
+
+
+def test_incremental_hnsw_with_deletions_falls_back_to_full_rebuild(tmp_path, fake_encoder, capsys):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("alpha " * 100)
+    (data / "b.txt").write_text("beta " * 100)
+    out = tmp_path / "out"
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True, index_type="hnsw")
+    (data / "b.txt").unlink()
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True, index_type="hnsw")
+
+    assert "running a full rebuild" in capsys.readouterr().out
+    manifest = ingest.load_manifest(out / "manifest.json")
+    assert list(manifest["files"]) == [str(data / "a.txt")]
+    assert faiss.read_index(str(out / "faiss.index")).ntotal == len(manifest["files"][str(data / "a.txt")]["chunk_ids"])
+
+
+def test_quantized_factory_strings():
+    assert ann_index.factory_string(ann_index.resolve_params("flat", quantize="sq8")) == "SQ8"
+    assert ann_index.factory_string(ann_index.resolve_params("hnsw", quantize="fp16")) == "HNSW32_SQfp16"
+    assert ann_index.factory_string(ann_index.resolve_params("ivf", nlist=8, quantize="pq", pq_m=4)) == "IVF8,PQ4x8"
+    with pytest.raises(ValueError):
+        ann_index.resolve_params("ivfpq", quantize="sq8")
+    with pytest.raises(ValueError):
+        ann_index.resolve_params("flat", quantize="int4")
+
+
+def test_rerank_index_restores_exact_ranking_from_sidecar(tmp_path):
+    xb = _vectors(n=3000, dim=32)
+    ids = np.arange(10, 10 + len(xb), dtype="int64")  # ids need not start at 0
+    params = ann_index.fit_to_training_size(ann_index.resolve_params("flat", quantize="pq", pq_m=4), len(xb), 32)
+    index = ann_index.build_index(32, params)
+    index.train(xb)
+    index.add_with_ids(xb, ids)
+    vector_file = ann_index.VectorFile(tmp_path / "v.f32", 32, truncate=True)
+    vector_file.add_with_ids(xb, ids)
+    vector_file.close()
+
+    exact = faiss.IndexIDMap2(faiss.IndexFlatL2(32))
+    exact.add_with_ids(xb, ids)
+    xq = xb[:50] + 0.01
+    D_true, I_true = exact.search(xq, 5)
+    reranked = ann_index.RerankIndex(index, ann_index.open_vectors(tmp_path / "v.f32", 32), factor=20)
+    D, I = reranked.search(xq, 5)
+    assert ann_index.recall_at_k(I_true, I, 5) > ann_index.recall_at_k(I_true, index.search(xq, 5)[1], 5) + 0.2
+    assert (I[:, 0] == I_true[:, 0]).all()
+    np.testing.assert_allclose(D[I == I_true], D_true[I == I_true], rtol=1e-4)
+    assert reranked.ntotal == len(xb)
+
+
+def test_incremental_quantized_ingest_keeps_sidecar_in_sync(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    data.mkdir()
+    for n in range(8):
+        (data / f"d{n}.txt").write_text(f"Topic {n} covers subject {n * 7} in depth. " * (3 + n))
+    out = tmp_path / "out"
+    kwargs = dict(index_params={"quantize": "sq8"}, dedup=False)
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True, **kwargs)
+    (data / "d3.txt").write_text("A rewritten note about rerankers and quantization.")
+    (data / "d5.txt").unlink()
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True, **kwargs)
+    full = tmp_path / "full"
+    ingest.main(data, full / "faiss.index", full / "chunks", "fake", dedup=False)
+
+    assert ann_index.vectors_path(out / "faiss.index").exists()
+    assert not ann_index.vectors_path(full / "faiss.index").exists()
+    index = load_index(out / "faiss.index")
+    assert isinstance(index, ann_index.RerankIndex)
+    assert not isinstance(load_index(out / "faiss.index", rerank=0), ann_index.RerankIndex)
+    exact = load_index(full / "faiss.index")
+    xq = fake_encoder.encode(["rerankers", "topic 2", "subject 49", "depth"])
+    D, I = index.search(xq, 3)
+    D_exact, I_exact = exact.search(xq, 3)
+    with ingest.open_chunk_store(out / "chunks") as a, ingest.open_chunk_store(full / "chunks") as b:
+        assert [[a[i]["text"] for i in row] for row in I] == [[b[i]["text"] for i in row] for row in I_exact]
+    np.testing.assert_allclose(D, D_exact, rtol=1e-4, atol=1e-6)
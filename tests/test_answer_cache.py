@@ -0,0 +1,79 @@
+import pytest
+
+from src import answer_cache
+from src.answer_cache import AnswerCache, prompt_version
+from tests.conftest import FakeEncoder
+
+
+def _embed(encoder):
+    return lambda q: encoder.encode([q])[0]
+
+
+def test_exact_and_paraphrase_hits_need_the_same_chunks():
+    encoder = FakeEncoder()
+    cache = AnswerCache(embed=_embed(encoder), threshold=0.8)
+    assert cache.get("How do citations improve trust?", [3, 1]) is None
+    assert encoder.calls == []  # a miss on an empty bucket embeds nothing
+    cache.put("How do citations improve trust?", [3, 1], "They show sources [a.txt].")
+
+    assert cache.get("how do  citations improve trust?", [1, 3]) == "They show sources [a.txt]."
+    assert cache.get("How do citations improve the trust", [1, 3]) == "They show sources [a.txt]."
+    assert cache.get("How do citations improve the trust", [1, 4]) is None
+    assert cache.get("What is the leave policy?", [1, 3]) is None
+    assert cache.get("How do citations improve trust?", [1, 3], model="other-model") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["semantic_hits"] == 1
+
+    exact_only = AnswerCache()
+    exact_only.put("How do citations improve trust?", [1, 3], "cached")
+    assert exact_only.get("How do citations improve the trust", [1, 3]) is None
+
+
+def test_bounded_and_invalidated_by_index_and_prompt_changes(tmp_path, monkeypatch):
+    index_path = tmp_path / "faiss.index"
+    index_path.write_bytes(b"v1")
+    cache = AnswerCache(maxsize=2, index_path=index_path, disk_path=tmp_path / "answers.sqlite")
+    for n in range(3):
+        cache.put("q", [n], f"answer {n}")
+    assert cache.get("q", [0]) == "answer 0"  # evicted from memory, still on disk
+    assert len(cache.buckets) == 2
+
+    reopened = AnswerCache(index_path=index_path, disk_path=tmp_path / "answers.sqlite")
+    assert reopened.get("q", [2]) == "answer 2"
+    monkeypatch.setattr(answer_cache, "prompt_version", lambda: prompt_version("edited system prompt"))
+    assert AnswerCache(index_path=index_path, disk_path=tmp_path / "answers.sqlite").get("q", [2]) is None
+
+    index_path.write_bytes(b"rebuilt")
+    assert reopened.get("q", [2]) is None
+    reopened.close()
+    cache.close()
+
+
+def test_stream_stores_completed_answers_only():
+    cache = AnswerCache()
+    assert "".join(cache.stream("q", [1], iter(["Based ", "on [a]."]))) == "Based on [a]."
+
+    def failing():
+        yield "partial "
+        raise ConnectionError("dropped")
+
+    with pytest.raises(ConnectionError):
+        list(cache.stream("other", [1], failing()))
+    assert list(cache.stream("q", [1], failing())) == ["Based on [a]."]
+    assert cache.get("other", [1]) is None
+
+
+def test_answer_question_checks_refusal_before_the_cache():
+    from src.llm import DEFAULT_MODEL, FakeChatClient
+    from src.query import answer_question
+
+    results = [{"id": 7, "source": "a.txt", "text": "Grounding reduces hallucinations."}]
+    client = FakeChatClient()
+    cache = AnswerCache(embed=_embed(FakeEncoder()), threshold=0.8)
+    usage = {}
+    first = answer_question(client, "Does grounding reduce hallucinations?", results, usage=usage, answer_cache=cache)
+    again = answer_question(client, "Does grounding reduce hallucination?", results, usage=usage, answer_cache=cache)
+    assert first == again == "Based on [a.txt]." and client.calls == 1 and usage["cached"]
+
+    cache.put("Is grounding legal advice?", [7], "stale answer", DEFAULT_MODEL)
+    refused = answer_question(client, "Is grounding legal advice?", results, answer_cache=cache)
+    assert refused.startswith("REFUSAL:")
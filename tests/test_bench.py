@@ -0,0 +1,52 @@
+import copy
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from bench.run import compare, reciprocal_rank, recall_at_k, run_benchmark
+
+
+def test_rank_metrics():
+    assert recall_at_k({1, 2}, [5, 2, 7], 3) == 0.5
+    assert recall_at_k({1, 2}, [5, 7, 1], 2) == 0.0
+    assert reciprocal_rank({7}, [5, 2, 7]) == pytest.approx(1 / 3)
+    assert reciprocal_rank({9}, [5, 2, 7]) == 0.0
+
+
+def test_benchmark_report_and_baseline_comparison(tmp_path):
+    report = run_benchmark(
+        tmp_path, n_docs=20, k=5, chunkings=[("tokens", 64, 8)], index_types=["flat", "hnsw"], guardrail_queries=20,
+    )
+
+    assert [r["index_type"] for r in report["runs"]] == ["flat", "hnsw"]
+    flat = report["runs"][0]
+    assert flat["chunks"] > 20 and flat["chunks_per_s"] > 0
+    assert flat["queries"] == report["config"]["queries"] == 40
+    assert flat["recall_at_k"] > 0.8 and 0 < flat["mrr"] <= 1
+    assert flat["latency_ms"]["p50"] <= flat["latency_ms"]["p99"]
+    assert set(report["guardrail"]) == {"substring_us", "regex_text_us", "regex_flags_us"}
+
+    # the guardrail check compares two timings of the same run; pin them so it is deterministic
+    report["guardrail"] = {"substring_us": 1.0, "regex_text_us": 10.0, "regex_flags_us": 2.0}
+    assert compare(report, report) == []
+    worse = copy.deepcopy(report)
+    worse["runs"][0]["recall_at_k"] -= 0.1
+    worse["runs"][1]["latency_ms"]["p50"] *= 3
+    regressions = compare(worse, report)
+    assert len(regressions) == 2
+    assert "flat tokens 64/8: recall_at_k" in regressions[0]
+    assert "hnsw tokens 64/8: p50 latency" in regressions[1]
+
+    worse["guardrail"]["regex_flags_us"] = 20.0
+    assert "guardrail: chunk flags" in compare(worse, report)[-1]
+
+
+def test_rerank_runs_report_latency_and_context_quality_per_depth(tmp_path):
+    report = run_benchmark(tmp_path, n_docs=20, k=3, chunkings=[("tokens", 64, 8)], index_types=["flat"],
+                           rerank_depths=[0, 10])
+    plain, reranked = report["rerank_runs"]
+    assert [r["rerank_candidates"] for r in report["rerank_runs"]] == [0, 10]
+    assert report["config"]["rerank_depths"] == [0, 10]
+    assert reranked["mrr"] >= plain["mrr"] and reranked["precision_at_k"] >= plain["precision_at_k"]
+    assert reranked["latency_ms"]["p50"] > 0
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from src.bm25 import BM25Index, bm25_path, tokenize
+from src.query import fuse
+
+
+RECORDS = [
+    (0, {"text": "Grounding answers in retrieved documents reduces hallucinations."}),
+    (2, {"text": "The connection failed with ERR_CONN_RESET after the upgrade to v2.1."}),
+    (3, {"text": "Citations and source attribution improve trust in answers."}),
+    (4, {"text": "Retrieved documents, retrieved passages and retrieved chunks."}),
+]
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("ERR_CONN_RESET at v2.1") == ["err_conn_reset", "err", "conn", "reset", "at", "v2.1", "v2", "1"]
+
+
+def test_search_ranks_exact_identifier_and_matches_bm25(tmp_path):
+    bm25 = BM25Index.build(RECORDS, n_slots=5)
+    path = bm25_path(tmp_path / "faiss.index")
+    bm25.save(path)
+    bm25 = BM25Index.load(path)
+
+    scores, ids = bm25.search(["err_conn_reset", "unknown words"], 3)
+    assert ids[0].tolist() == [2, -1, -1]
+    assert ids[1].tolist() == [-1, -1, -1]
+
+    # reference Okapi BM25 (k1=1.2, b=0.75) for a two-term query
+    docs = {cid: tokenize(r["text"]) for cid, r in RECORDS}
+    avgdl = np.mean([len(t) for t in docs.values()])
+
+    def reference(query, cid):
+        total = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in t for t in docs.values())
+            if df == 0:
+                continue
+            idf = np.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = docs[cid].count(term)
+            total += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(docs[cid]) / avgdl))
+        return total
+
+    scores, ids = bm25.search_one("retrieved answers", 4)
+    expected = sorted(((reference("retrieved answers", cid), cid) for cid in docs), reverse=True)
+    expected = [(s, cid) for s, cid in expected if s > 0]
+    assert ids.tolist() == [cid for _, cid in expected]
+    assert scores == pytest.approx([s for s, _ in expected], rel=1e-5)
+
+
+def test_fuse_rrf_and_weighted():
+    dense_ids, dense_dists = np.array([1, 2, 3]), np.array([0.1, 0.2, 0.9], dtype="float32")
+    sparse_ids, sparse_scores = np.array([3, 4, -1]), np.array([5.0, 1.0, 0.0], dtype="float32")
+
+    rrf = fuse(dense_ids, dense_dists, sparse_ids, sparse_scores, 4)
+    assert [cid for cid, _ in rrf] == [3, 1, 2, 4]
+    assert rrf[0][1] == pytest.approx(1 / 63 + 1 / 61)
+
+    weighted = fuse(dense_ids, dense_dists, sparse_ids, sparse_scores, 2, method="weighted", alpha=0.9)
+    assert [cid for cid, _ in weighted] == [1, 2]
+    with pytest.raises(ValueError):
+        fuse(dense_ids, dense_dists, sparse_ids, sparse_scores, 2, method="max")
+
+
+def test_hybrid_search_finds_identifier_missed_by_dense(tmp_path, fake_encoder):
+    pytest.importorskip("faiss")
+    from src import ingest
+    from src.chunk_store import open_chunk_store
+    from src.query import load_index, load_sparse, search
+
+    data = tmp_path / "data"
+    data.mkdir()
+    for i in range(30):
+        (data / f"filler{i:02d}.txt").write_text(f"General notes about retrieval quality, batch {i}.")
+    (data / "codes.txt").write_text("Deploys abort with E4417 when the cache volume is full.")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+
+    sparse = load_sparse(tmp_path / "faiss.index")
+    assert sparse is not None
+    index = load_index(tmp_path / "faiss.index")
+    with open_chunk_store(tmp_path / "chunks") as store:
+        timings = {}
+        (rows,) = search(fake_encoder, index, store, ["what is E4417"], 3, sparse=sparse, timings=timings)
+        assert rows[0]["source"].endswith("codes.txt")
+        assert rows[0]["bm25"] > 0 and rows[0]["score"] > 0
+        assert set(timings) == {"dense_ms", "sparse_ms", "fusion_ms"}
+        (dense,) = search(fake_encoder, index, store, ["what is E4417"], 3)
+        assert "score" not in dense[0]
+
+
+def test_update_matches_full_build(tmp_path):
+    bm25 = BM25Index.build(RECORDS[:3], n_slots=4)
+    path = bm25_path(tmp_path / "faiss.index")
+    bm25.save(path)
+    added = [(4, RECORDS[3][1]), (5, {"text": "A new chunk about retrieved citations."})]
+    updated = BM25Index.load(path).update(added, removed_ids=[2], n_slots=6)
+
+    full = BM25Index.build([RECORDS[0], RECORDS[2], *added], n_slots=6)
+    assert "err_conn_reset" not in updated.terms
+    for name in ("terms", "indptr", "doc_ids", "tfs", "doc_len"):
+        np.testing.assert_array_equal(getattr(updated, name), getattr(full, name))
+    np.testing.assert_allclose(updated.impacts, full.impacts, rtol=1e-6)
+    assert updated.search(["retrieved citations"], 2)[1].tolist() == full.search(["retrieved citations"], 2)[1].tolist()
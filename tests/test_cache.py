@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from src import ingest
+from src.cache import LRUCache, QueryCache
+from src.chunk_store import open_chunk_store
+from src.query import load_index, search
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_evicts_least_recent_and_expires():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=2, ttl=10, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # evicts "b"
+    assert cache.get("b") is None
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "size": 1, "maxsize": 2}
+
+
+@pytest.fixture
+def built(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("Grounding reduces hallucinations.")
+    (data / "b.txt").write_text("Citations improve trust.")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+    return tmp_path
+
+
+def test_query_cache_skips_encode_and_search(built, fake_encoder):
+    index = load_index(built / "faiss.index")
+    cache = QueryCache(index_path=built / "faiss.index")
+    with open_chunk_store(built / "chunks") as store:
+        first = search(fake_encoder, index, store, ["Reduce  hallucinations"], 2, cache=cache)
+        fake_encoder.calls.clear()
+        second = search(fake_encoder, index, store, ["reduce hallucinations"], 2, cache=cache)
+
+    assert first == second
+    assert fake_encoder.calls == []
+    stats = cache.stats()
+    assert stats["embedding"]["hits"] == 1 and stats["retrieval"]["hits"] == 1
+
+
+def test_retrieval_level_invalidated_when_index_changes(built, fake_encoder):
+    index = load_index(built / "faiss.index")
+    cache = QueryCache(index_path=built / "faiss.index")
+    with open_chunk_store(built / "chunks") as store:
+        search(fake_encoder, index, store, ["trust"], 1, cache=cache)
+        st = os.stat(built / "faiss.index")
+        os.utime(built / "faiss.index", ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        search(fake_encoder, index, store, ["trust"], 1, cache=cache)
+
+    stats = cache.stats()
+    assert stats["embedding"]["hits"] == 1
+    assert stats["retrieval"]["hits"] == 0 and stats["retrieval"]["misses"] == 2
+
+
+def test_disk_cache_survives_restart(built, fake_encoder):
+    index = load_index(built / "faiss.index")
+    disk = built / "cache" / "query_cache.sqlite"
+    with open_chunk_store(built / "chunks") as store:
+        cache = QueryCache(index_path=built / "faiss.index", disk_path=disk)
+        expected = search(fake_encoder, index, store, ["citations"], 2, cache=cache)
+        cache.close()
+
+        fake_encoder.calls.clear()
+        restarted = QueryCache(index_path=built / "faiss.index", disk_path=disk)
+        assert search(fake_encoder, index, store, ["citations"], 2, cache=restarted) == expected
+        assert fake_encoder.calls == []
+        assert restarted.stats()["disk_retrieval"]["hits"] == 1
+        np.testing.assert_array_equal(restarted.get_embedding("citations"), fake_encoder.encode(["citations"])[0])
+        restarted.close()
+
+
+def test_retrievals_keyed_on_search_params(built, fake_encoder):
+    disk = built / "cache" / "query_cache.sqlite"
+    emb = fake_encoder.encode(["citations"])[0]
+    cache = QueryCache(index_path=built / "faiss.index", disk_path=disk, search_params={"nprobe": 1, "rerank": None})
+    cache.put_retrieval(emb, 2, np.array([1, 0]), np.array([0.5, 0.7]))
+    cache.close()
+
+    for params, hit in (({"nprobe": 16}, False), ({"nprobe": 1}, True), (None, False)):
+        reopened = QueryCache(index_path=built / "faiss.index", disk_path=disk, search_params=params)
+        assert (reopened.get_retrieval(emb, 2) is not None) == hit, params
+        reopened.close()
+
+
+def test_embeddings_keyed_on_encoder_backend(tmp_path):
+    from src.embeddings import encoder_key
+
+    disk = tmp_path / "query_cache.sqlite"
+    cache = QueryCache(disk_path=disk, model_name=encoder_key("all-MiniLM-L6-v2", "torch"))
+    cache.put_embedding("citations", np.ones(4, dtype="float32"))
+    cache.close()
+    assert encoder_key("all-MiniLM-L6-v2") == "all-MiniLM-L6-v2"
+    for backend, hit in (("onnx-int8", False), ("torch", True)):
+        reopened = QueryCache(disk_path=disk, model_name=encoder_key("all-MiniLM-L6-v2", backend))
+        assert (reopened.get_embedding("citations") is not None) == hit, backend
+        reopened.close()
@@ -0,0 +1,101 @@
+import json
+
+from src.chunk_store import ChunkStoreWriter, JsonMetaStore, convert_meta_json, open_chunk_store
+
+
+def test_append_get_and_delete(tmp_path):
+    store_path = tmp_path / "chunks"
+    with ChunkStoreWriter(store_path, truncate=True) as w:
+        w.append_many([0, 1], [{"source": "a", "text": "héllo"}, {"source": "b", "text": "world"}])
+        w.append(3, {"source": "c", "text": "gap before me"})
+        w.delete([1])
+    with ChunkStoreWriter(store_path) as w:
+        assert len(w) == 4
+        w.append(4, {"source": "d", "text": "appended later"})
+
+    with open_chunk_store(store_path) as store:
+        assert len(store) == 5
+        assert store.get([3, 0, 1, 2, -1, 99]) == [
+            {"source": "c", "text": "gap before me"}, {"source": "a", "text": "héllo"}, None, None, None, None,
+        ]
+        assert [i for i, _ in store.iter_records()] == [0, 3, 4]
+
+
+def test_convert_meta_json_roundtrip(tmp_path):
+    records = [{"source": "x", "chunk_index": 0, "text": "one"}, None, {"source": "y", "chunk_index": 0, "text": "two"}, None]
+    meta = tmp_path / "meta.json"
+    meta.write_text(json.dumps(records))
+
+    assert convert_meta_json(meta, tmp_path / "chunks") == 4
+    legacy = open_chunk_store(meta)
+    assert isinstance(legacy, JsonMetaStore)
+    with open_chunk_store(tmp_path / "chunks") as store:
+        assert store.get(range(4)) == legacy.get(range(4)) == records
+
+
+def test_records_by_reference_share_document_text(tmp_path):
+    from src.chunker import iter_char_chunks
+
+    text = "Grounding reduces hallucinations. " * 40
+    chunks = list(iter_char_chunks([text], chunk_size=200, overlap=50))
+    ids = iter(range(100))
+    with ChunkStoreWriter(tmp_path / "chunks", truncate=True) as w:
+        for source in ("a.txt", "copy_of_a.txt"):
+            w.append_many([next(ids) for _ in chunks], [
+                {"source": source, "chunk_index": c.index, "text": c.text, "doc_key": "sha-a",
+                 "start": c.start, "end": c.end, "fresh": c.fresh}
+                for c in chunks
+            ])
+
+    # overlapped windows and the duplicate file are backed by one copy of the text
+    assert (tmp_path / "chunks" / "docs.bin").read_bytes() == text.strip().encode("utf-8")
+    with open_chunk_store(tmp_path / "chunks") as store:
+        records = [r for _, r in store.iter_records()]
+    assert [r["text"] for r in records] == [c.text for c in chunks] * 2
+    assert {r["doc"] for r in records} == {0}
+    assert [r["source"] for r in records] == ["a.txt"] * len(chunks) + ["copy_of_a.txt"] * len(chunks)
+
+
+def test_document_opens_at_first_stored_chunk(tmp_path):
+    from src.chunker import iter_char_chunks
+
+    # leading blank windows are skipped, so the first chunk has chunk_index > 0
+    text = " " * 1500 + "Leading whitespace then text. " * 20
+    chunks = list(iter_char_chunks([text], chunk_size=500, overlap=100))
+    assert chunks[0].index > 0
+    with ChunkStoreWriter(tmp_path / "chunks", truncate=True) as w:
+        for n, source in enumerate(("blank.txt", "other.txt")):
+            w.append_many(range(n * len(chunks), (n + 1) * len(chunks)), [
+                {"source": source, "chunk_index": c.index, "text": c.text, "doc_key": f"sha-{source}",
+                 "start": c.start, "end": c.end, "fresh": c.fresh, "file": {"path": source}}
+                for c in chunks
+            ])
+
+    with open_chunk_store(tmp_path / "chunks") as store:
+        records = [r for _, r in store.iter_records()]
+    assert [r["text"] for r in records] == [c.text for c in chunks] * 2
+    assert [r["doc"] for r in records] == [0] * len(chunks) + [1] * len(chunks)
+    assert (tmp_path / "chunks" / "files.jsonl").read_text().count("\n") == 2
+
+
+def test_discarded_document_is_not_reused(tmp_path):
+    from src.chunker import iter_char_chunks
+
+    text = "Grounding reduces hallucinations. " * 40
+    chunks = list(iter_char_chunks([text], chunk_size=200, overlap=50))
+
+    def records(source, chunks):
+        return [{"source": source, "chunk_index": c.index, "text": c.text, "doc_key": "sha-a",
+                 "start": c.start, "end": c.end, "fresh": c.fresh} for c in chunks]
+
+    with ChunkStoreWriter(tmp_path / "chunks", truncate=True) as w:
+        w.append_many([0, 1], records("a.txt", chunks[:2]))  # a.txt failed after two chunks
+        w.discard_doc("a.txt", "sha-a")
+        w.delete([0, 1])
+    with ChunkStoreWriter(tmp_path / "chunks") as w:
+        w.append_many(range(2, 2 + len(chunks)), records("a.txt", chunks))
+
+    assert (tmp_path / "chunks" / "doc_keys.txt").read_text().split() == ["-", "sha-a"]
+    with open_chunk_store(tmp_path / "chunks") as store:
+        assert [r["text"] for _, r in store.iter_records()] == [c.text for c in chunks]
+        assert {r["doc"] for _, r in store.iter_records()} == {1}
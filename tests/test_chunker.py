@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from src.chunker import iter_char_chunks, iter_token_chunks, make_token_counter
+
+
+class CharTokenizer:
+    """Hugging Face-style tokenizer stand-in: one token per 4 characters of each word."""
+
+    def __call__(self, texts, add_special_tokens=True, **kwargs):
+        return {"input_ids": [[0] * sum(-(-len(w) // 4) for w in t.split()) for t in texts]}
+
+
+def _document(seed=0):
+    rng = random.Random(seed)
+    words = "alpha beta gamma délta epsilon zeta eta theta iota kappa".split()
+    parts = ["  "]
+    for _ in range(200):
+        parts.append(" ".join(rng.choice(words) for _ in range(rng.randint(3, 30))) + rng.choice(".!?"))
+        parts.append(rng.choice([" ", "  ", "\n\n", "\n"]))
+    parts.append(" ".join(["runon"] * 400) + ".\n")
+    return "".join(parts)
+
+
+def _blocks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("tokenizer", [None, CharTokenizer()])
+def test_token_chunks_respect_budget_and_map_back_to_document(tokenizer):
+    doc = _document()
+    count = make_token_counter(tokenizer)
+    chunks = list(iter_token_chunks(_blocks(doc, 97), count, max_tokens=60, overlap_tokens=12))
+
+    # block size does not change the result, so streaming is equivalent to whole-file chunking
+    assert chunks == list(iter_token_chunks([doc], count, max_tokens=60, overlap_tokens=12))
+    rebuilt = "".join(c.fresh for c in chunks).encode("utf-8")
+    assert doc.encode("utf-8").startswith(rebuilt) and doc.strip().encode("utf-8") in rebuilt
+    for c in chunks:
+        assert rebuilt[c.start:c.end].decode("utf-8") == c.text
+        assert count([c.text])[0] <= 60
+    # sentence chunks end on sentence boundaries (or the split run-on sentence)
+    assert all(c.text[-1] in ".!?" or "runon" in c.text for c in chunks)
+    # consecutive chunks share trailing sentences when they fit the overlap budget
+    shared = [rebuilt[b.start:a.end].decode("utf-8") for a, b in zip(chunks, chunks[1:]) if b.start < a.end]
+    assert len(shared) >= 10
+    assert all(count([text])[0] <= 12 for text in shared)
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+
+
+def test_char_chunks_match_fixed_windows():
+    doc = _document(1)
+    chunks = list(iter_char_chunks(_blocks(doc, 50), chunk_size=300, overlap=60))
+    expected = []
+    start = 0
+    while start < len(doc):
+        expected.append(doc[start:start + 300].strip())
+        start += 240
+    assert [c.text for c in chunks] == [t for t in expected if t]
+    rebuilt = "".join(c.fresh for c in chunks).encode("utf-8")
+    assert all(rebuilt[c.start:c.end].decode("utf-8") == c.text for c in chunks)
+
+
+def test_invalid_overlap():
+    with pytest.raises(ValueError):
+        list(iter_token_chunks(["A sentence."], max_tokens=10, overlap_tokens=10))
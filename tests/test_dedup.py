@@ -0,0 +1,93 @@
+import pytest
+
+from src.dedup import DEDUP_FILE, DedupIndex, collapse_hits
+
+DISCLAIMER = (
+    "This document is confidential and intended solely for the use of the individual or entity "
+    "to whom it is addressed. If you have received it in error, please notify the sender and "
+    "delete it. Any review, retransmission or dissemination by persons other than the intended "
+    "recipient is prohibited."
+)
+
+
+def test_exact_and_near_duplicates_map_to_the_canonical_chunk(tmp_path):
+    dedup = DedupIndex(threshold=0.8)
+    assert dedup.add(0, DISCLAIMER) is None
+    assert dedup.add(1, "  " + DISCLAIMER.upper() + "  ") == 0  # same normalized text
+    assert dedup.add(2, DISCLAIMER.replace("please notify", "kindly notify")) == 0
+    assert dedup.add(3, "Vector search finds nearest neighbours in embedding space.") is None
+    assert len(dedup) == 2
+
+    dedup.save(tmp_path / DEDUP_FILE)
+    loaded = DedupIndex.load(tmp_path / DEDUP_FILE)
+    assert loaded.find(DISCLAIMER) == 0 and loaded.threshold == 0.8
+
+    loaded.remove(0, replacement=7)
+    assert loaded.find(DISCLAIMER) == 7 and not loaded.is_canonical(0)
+    loaded.remove(7)
+    assert loaded.find(DISCLAIMER) is None
+
+
+def test_collapse_hits_merges_sources_and_keeps_top_k():
+    rows = [
+        {"id": 4, "source": "a.txt", "text": DISCLAIMER},
+        {"id": 9, "source": "b.txt", "text": DISCLAIMER.replace("please notify", "kindly notify")},
+        {"id": 2, "source": "c.txt", "text": "Citations improve trust in answers."},
+        {"id": 5, "source": "d.txt", "text": "Rerankers reorder candidates."},
+    ]
+    kept = collapse_hits(rows, top_k=2)
+    assert [r["id"] for r in kept] == [4, 2]
+    assert kept[0]["sources"] == ["a.txt", "b.txt"]
+
+
+def _write_corpus(data):
+    data.mkdir()
+    report = "Quarterly revenue grew in the storage segment. Churn fell after the pricing change."
+    (data / "report.txt").write_text(report + "\n\n" + DISCLAIMER)
+    (data / "copy").mkdir()
+    (data / "copy" / "report.txt").write_text(report + "\n\n" + DISCLAIMER)
+    (data / "memo.txt").write_text("The rollout of the new search service starts on Monday.\n\n" + DISCLAIMER)
+
+
+def test_ingest_embeds_duplicates_once_and_lists_all_sources(tmp_path, fake_encoder):
+    faiss = pytest.importorskip("faiss")
+    from src import ingest
+    from src.chunk_store import open_chunk_store
+    from src.query import load_index, search
+
+    data = tmp_path / "data"
+    _write_corpus(data)
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake", chunk_tokens=30, overlap_tokens=0)
+
+    embedded = [t for call in fake_encoder.calls for t in call]
+    assert len(embedded) == len(set(embedded)) == faiss.read_index(str(tmp_path / "faiss.index")).ntotal
+    with open_chunk_store(tmp_path / "chunks") as store:
+        assert len(list(store.iter_records())) > len(embedded)
+        (rows,) = search(fake_encoder, load_index(tmp_path / "faiss.index"), store, ["intended recipient"], 3)
+        assert len({r["text"] for r in rows}) == len(rows)
+        (hit,) = [r for r in rows if "intended recipient" in r["text"]]
+        assert sorted(hit["sources"]) == sorted(str(p) for p in data.rglob("*.txt"))
+
+
+def test_removing_a_canonical_file_promotes_a_duplicate(tmp_path, fake_encoder):
+    pytest.importorskip("faiss")
+    from src import ingest
+    from src.chunk_store import open_chunk_store
+    from src.query import load_index, search
+
+    data = tmp_path / "data"
+    _write_corpus(data)
+    kwargs = dict(chunk_tokens=30, overlap_tokens=0)
+    ingest.main(data, tmp_path / "inc" / "faiss.index", tmp_path / "inc" / "chunks", "fake", incremental=True, **kwargs)
+    (data / "copy" / "report.txt").unlink()
+    (data / "report.txt").unlink()
+    ingest.main(data, tmp_path / "inc" / "faiss.index", tmp_path / "inc" / "chunks", "fake", incremental=True, **kwargs)
+    ingest.main(data, tmp_path / "full" / "faiss.index", tmp_path / "full" / "chunks", "fake", **kwargs)
+
+    results = []
+    for out in ("inc", "full"):
+        with open_chunk_store(tmp_path / out / "chunks") as store:
+            (rows,) = search(fake_encoder, load_index(tmp_path / out / "faiss.index"), store, ["intended recipient"], 5)
+            results.append([(r["text"], r["sources"]) for r in rows])
+    assert results[0] == results[1]
+    assert any(sources == [str(data / "memo.txt")] and "intended recipient" in text for text, sources in results[0])
@@ -0,0 +1,112 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from src import embedding_cache
+from src.embedding_cache import EmbeddingCache, text_key
+from tests.conftest import FakeEncoder
+
+
+def _fill(path, texts):
+    with EmbeddingCache(path) as cache:
+        encoder = FakeEncoder()
+        for start in range(0, len(texts), 7):
+            cache.encode(encoder, "fake", texts[start:start + 7])
+
+
+def test_encode_serves_hits_and_encodes_only_misses(tmp_path):
+    encoder = FakeEncoder()
+    with EmbeddingCache(tmp_path / "cache") as cache:
+        first = cache.encode(encoder, "fake", ["alpha beta", "gamma", "alpha beta"])
+        assert encoder.calls == [["alpha beta", "gamma"]]
+        again = cache.encode(encoder, "fake", ["gamma", "delta", "alpha  beta\n"])  # same text modulo whitespace
+        assert encoder.calls[-1] == ["delta"]
+        np.testing.assert_array_equal(again[[0, 2]], first[[1, 0]])
+        np.testing.assert_array_equal(again[1], encoder.encode(["delta"])[0])
+        assert (cache.hits, cache.misses) == (3, 3)
+        assert cache.report("fake")["hit_rate"] == 0.5 and cache.report("fake")["saved_seconds"] > 0
+
+        # vectors are per model
+        vectors, found = cache.lookup("other", [text_key("gamma")])
+        assert vectors is None and not found.any()
+        with pytest.raises(ValueError):
+            cache.add("fake", [text_key("x")], np.zeros((1, 3)))
+
+    with EmbeddingCache(tmp_path / "cache") as cache:  # persisted
+        vectors, found = cache.lookup("fake", [text_key("delta"), text_key("epsilon")])
+        assert found.tolist() == [True, False]
+        assert cache.stats()[0]["entries"] == 3
+
+
+def test_evict_by_model_and_age_compacts_vector_files(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: clock[0])
+    encoder = FakeEncoder()
+    with EmbeddingCache(tmp_path) as cache:
+        cache.encode(encoder, "a", ["old one", "old two"])
+        clock[0] = 2000.0
+        cache.encode(encoder, "a", ["new one", "old two"])  # a hit refreshes "old two"
+        cache.encode(encoder, "b", ["other model"])
+        files = sorted(p.name for p in tmp_path.glob("*.f32"))
+
+        assert cache.evict(older_than=500.0) == 1
+        keys = [text_key(t) for t in ("old one", "old two", "new one")]
+        vectors, found = cache.lookup("a", keys)
+        assert found.tolist() == [False, True, True]
+        np.testing.assert_array_equal(vectors[1:], encoder.encode(["old two", "new one"]))
+        assert {s["model"]: s["entries"] for s in cache.stats()} == {"a": 2, "b": 1}
+        assert {s["model"]: s["bytes"] for s in cache.stats()}["a"] == 2 * encoder.dim * 4
+
+        assert cache.evict(model="b") == 1
+        assert [s["model"] for s in cache.stats()] == ["a"]
+        assert sorted(p.name for p in tmp_path.glob("*.f32")) != files and len(list(tmp_path.glob("*.f32"))) == 1
+        with pytest.raises(ValueError):
+            cache.evict()
+
+
+def test_concurrent_writers_share_one_cache(tmp_path):
+    texts = [f"chunk number {n} about topic {n % 11}" for n in range(120)]
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_fill, args=(tmp_path, texts[n * 30:n * 30 + 60])) for n in range(3)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(60)
+        assert proc.exitcode == 0
+
+    with EmbeddingCache(tmp_path) as cache:
+        vectors, found = cache.lookup("fake", [text_key(t) for t in texts])
+    assert found.all()
+    np.testing.assert_array_equal(vectors, FakeEncoder().encode(texts))
+
+
+def test_ingest_reuses_vectors_across_rebuilds(tmp_path, fake_encoder, capsys):
+    faiss = pytest.importorskip("faiss")
+    from src import ingest
+
+    data = tmp_path / "data"
+    data.mkdir()
+    for n in range(6):
+        (data / f"doc{n}.txt").write_text(f"Document {n}. " + " ".join(f"word{n}{i}" for i in range(60)))
+    cache_dir = tmp_path / "cache"
+    kwargs = dict(chunker="chars", chunk_size=200, overlap=0, embedding_cache=cache_dir)
+
+    ingest.main(data, tmp_path / "a" / "faiss.index", tmp_path / "a" / "chunks", "fake", **kwargs)
+    encoded = sum(len(call) for call in fake_encoder.calls)
+    assert "Embedding cache: 0/" in capsys.readouterr().out
+
+    fake_encoder.calls.clear()
+    ingest.main(data, tmp_path / "b" / "faiss.index", tmp_path / "b" / "chunks", "fake", **kwargs)
+    assert fake_encoder.calls == []
+    assert f"Embedding cache: {encoded}/{encoded} hits (100.0%)" in capsys.readouterr().out
+
+    # new chunking: only the chunks with new text are encoded
+    (data / "doc0.txt").write_text("A new document.")
+    ingest.main(data, tmp_path / "b" / "faiss.index", tmp_path / "b" / "chunks", "fake", **kwargs)
+    assert fake_encoder.calls == [["A new document."]]
+
+    a = faiss.read_index(str(tmp_path / "a" / "faiss.index"))
+    b = faiss.read_index(str(tmp_path / "b" / "faiss.index"))
+    last = [int(faiss.vector_to_array(index.id_map).max()) for index in (a, b)]  # the last chunk of doc5
+    np.testing.assert_array_equal(a.reconstruct(last[0]), b.reconstruct(last[1]))
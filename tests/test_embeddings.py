@@ -0,0 +1,73 @@
+import pickle
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from src.embeddings import MIN_COSINE, agreement, load_encoder, sample_texts
+from tests.conftest import ROOT
+
+
+def test_cli_modules_import_without_heavy_dependencies():
+    code = (
+        "import sys, src.query, src.ingest, src.server; "
+        "print(sorted(m for m in ('torch', 'transformers', 'sentence_transformers', 'openai') if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
+
+
+def _tiny_model(path):
+    """A randomly initialised 2-layer BERT sentence-transformers model saved under `path`."""
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    from src.embeddings import _WORDS
+
+    raw = path / "raw"
+    raw.mkdir(parents=True)
+    (raw / "vocab.txt").write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "."] + sorted(set(_WORDS))))
+    BertTokenizerFast(str(raw / "vocab.txt")).save_pretrained(str(raw))
+    config = BertConfig(vocab_size=len(_WORDS) + 6, hidden_size=32, num_hidden_layers=2, num_attention_heads=4,
+                        intermediate_size=64, max_position_embeddings=128)
+    BertModel(config).save_pretrained(str(raw))
+    transformer = models.Transformer(str(raw), max_seq_length=64)
+    model = SentenceTransformer(modules=[transformer, models.Pooling(32, "mean"), models.Normalize()], device="cpu")
+    model.save(str(path / "model"))
+    return str(path / "model")
+
+
+def test_onnx_backends_reproduce_torch_embeddings(tmp_path):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    pytest.importorskip("sentence_transformers")
+    from src.embeddings import export_onnx
+
+    model_path = _tiny_model(tmp_path)
+    scores = export_onnx(model_path, tmp_path / "onnx")
+    assert scores["onnx"] > 0.9999 and scores["onnx-int8"] >= MIN_COSINE
+
+    texts = sample_texts(40, seed=1)
+    reference = load_encoder(model_path).encode(texts, convert_to_numpy=True)
+    for backend in ("onnx", "onnx-int8"):
+        encoder = load_encoder(model_path, backend, onnx_dir=tmp_path / "onnx")
+        vectors = encoder.encode(texts, batch_size=8)
+        assert vectors.shape == reference.shape and vectors.dtype == np.float32
+        assert agreement(reference, vectors) >= MIN_COSINE
+    assert agreement(reference, load_encoder(model_path, "torch-int8").encode(texts)) >= MIN_COSINE
+
+    # the token chunker counts with `model.tokenizer`, also inside parse worker processes
+    tokenizer = pickle.loads(pickle.dumps(encoder.tokenizer))
+    hf = load_encoder(model_path).tokenizer
+    counts = tokenizer(texts[:3], add_special_tokens=False)["input_ids"]
+    assert [len(ids) for ids in counts] == [len(hf(t, add_special_tokens=False)["input_ids"]) for t in texts[:3]]
+    assert encoder.max_seq_length == 64 and encoder.get_sentence_embedding_dimension() == 32
+
+
+def test_unknown_backend_and_missing_export_are_reported(tmp_path):
+    with pytest.raises(ValueError):
+        load_encoder("all-MiniLM-L6-v2", "tensorrt")
+    pytest.importorskip("onnxruntime")
+    with pytest.raises(RuntimeError, match="export"):
+        load_encoder("all-MiniLM-L6-v2", "onnx", onnx_dir=tmp_path)
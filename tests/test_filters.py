@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from src import ann_index, filters, ingest, shards
+from src.chunk_store import open_chunk_store
+from src.filters import FilterIndex, build_expression, filter_index, parse, parse_tags, search_filtered
+from src.query import load_index, load_sparse, search
+
+
+def test_parse_expressions():
+    assert parse("ext:MD,.pdf") == ("term", "ext", ":", frozenset({"md", "pdf"}))
+    tree = parse('path:"My Docs/" tag:hr or not (ext:txt and mtime<100)')
+    assert tree == (
+        "or",
+        ("and", ("term", "path", ":", "My Docs/"), ("term", "tag", ":", frozenset({"hr"}))),
+        ("not", ("and", ("term", "ext", ":", frozenset({"txt"})), ("term", "mtime", "<", 100.0))),
+    )
+    assert parse("mtime >= 2024-01-01")[3] == pytest.approx(__import__("datetime").datetime(2024, 1, 1).timestamp())
+    for bad in ("", "ext:md and", "size:3", "ext>=md", "mtime:2024", "mtime>=yesterday", "(ext:md", "ext:md)"):
+        with pytest.raises(ValueError):
+            parse(bad)
+
+    assert build_expression("docs/a b", [".md", "pdf"], "2024-01-01", tags=["hr", " "]) == (
+        'path:"docs/a b" and ext:md,pdf and tag:hr and mtime>=2024-01-01'
+    )
+    assert build_expression() == ""
+    assert parse_tags(["policies/*=hr,legal", "*.md=docs", "policies/*=hr"]) == {
+        "policies/*": ["hr", "legal"], "*.md": ["docs"],
+    }
+    with pytest.raises(ValueError):
+        parse_tags(["policies/*"])
+
+
+def test_filter_index_masks_files_and_duplicates():
+    files = [
+        {"source": "d/a.md", "rel": "a.md", "ext": "md", "mtime": 10.0, "tags": ["hr"]},
+        {"source": "d/sub/b.txt", "rel": "sub/b.txt", "ext": "txt", "mtime": 20.0, "tags": []},
+    ]
+    chunk_files = np.array([0, 0, 1, 1, -1, 1])
+    live = np.array([True, True, True, False, True, True])
+    index = FilterIndex(chunk_files, files, live, links={5: 0})
+    assert np.flatnonzero(index.select("ext:md")).tolist() == [0, 1]
+    assert np.flatnonzero(index.select("path:sub/ or tag:hr")).tolist() == [0, 1, 2, 5]
+    assert np.flatnonzero(index.select("not tag:hr and mtime>15")).tolist() == [2, 5]
+    # the duplicate chunk 5 is searched through its canonical chunk 0
+    assert np.flatnonzero(index.select_vectors("ext:txt")).tolist() == [0, 2]
+    assert not index.select("path:nowhere/").any()
+    assert index.select("ext:md") is index.select(" ext:md ")  # cached
+
+
+def _brute(xb, x, k, ids):
+    d = ((xb[ids][None, :, :] - x[:, None, :]) ** 2).sum(-1)
+    order = np.argsort(d, axis=1, kind="stable")[:, :k]
+    return ids[order]
+
+
+@pytest.mark.parametrize("params", [
+    {"index_type": "flat"},
+    {"index_type": "hnsw"},
+    {"index_type": "ivf", "nlist": 16, "nprobe": 2},
+    {"index_type": "ivf", "nlist": 16, "nprobe": 2, "quantize": "sq8"},
+])
+def test_search_filtered_returns_only_selected_ids(params, tmp_path):
+    rng = np.random.default_rng(0)
+    xb = rng.standard_normal((2000, 16)).astype("float32")
+    x = rng.standard_normal((5, 16)).astype("float32")
+    params = ann_index.resolve_params(**params)
+    index = ann_index.build_index(16, params)
+    index.train(xb)
+    index.add_with_ids(xb, np.arange(len(xb), dtype="int64"))
+    index = ann_index.apply_search_params(index, params)
+    if ann_index.is_compressed(params):
+        index = ann_index.RerankIndex(index, xb, 4)
+
+    for fraction in (0.005, 0.5):
+        mask = rng.random(len(xb)) < fraction
+        ids = np.flatnonzero(mask)
+        # small selections are scanned exactly, whatever the index type
+        D, I = search_filtered(index, x, 5, mask)
+        assert np.isin(I, ids).all()
+        if len(ids) <= filters.EXACT_MAX:
+            assert I.tolist() == _brute(xb, x, 5, ids).tolist()
+        # through the ANN index with a bitmap selector
+        D, I = search_filtered(index, x, 5, mask, exact_max=0)
+        assert np.isin(I, ids).all() and (np.diff(D, axis=1) >= 0).all()
+        if params["index_type"] == "flat":
+            assert I.tolist() == _brute(xb, x, 5, ids).tolist()
+
+    D, I = search_filtered(index, x, 5, np.zeros(len(xb), dtype=bool))
+    assert (I == -1).all()
+
+
+def _corpus(data):
+    (data / "policies").mkdir(parents=True)
+    (data / "notes").mkdir()
+    (data / "policies" / "leave.md").write_text("Leave policy: employees get twenty days of paid leave.")
+    (data / "policies" / "travel.txt").write_text("Travel policy: book flights through the portal.")
+    (data / "notes" / "leave.txt").write_text("Leave policy: employees get twenty days of paid leave.")
+    (data / "notes" / "standup.md").write_text("Standup notes: the portal release slipped a week.")
+    old = 1_600_000_000
+    os.utime(data / "notes" / "standup.md", (old, old))
+
+
+def test_ingest_records_attributes_and_search_filters(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    _corpus(data)
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake", tags={"policies/*": ["hr"]})
+    index = load_index(tmp_path / "faiss.index")
+    sparse = load_sparse(tmp_path / "faiss.index")
+
+    def sources(query, where, **kwargs):
+        rows = search(fake_encoder, index, store, [query], 5, where=where, **kwargs)[0]
+        return sorted(os.path.relpath(r["source"], data) for r in rows)
+
+    with open_chunk_store(tmp_path / "chunks") as store:
+        assert sources("paid leave", "ext:md") == ["notes/standup.md", "policies/leave.md"]
+        assert sources("portal", "tag:hr and not ext:md") == ["policies/travel.txt"]
+        assert sources("portal", "mtime<2021-01-01", sparse=sparse) == ["notes/standup.md"]
+        # notes/leave.txt duplicates policies/leave.md; the filter still finds it by its own path
+        assert sources("paid leave", "path:notes/", sparse=sparse) == ["notes/leave.txt", "notes/standup.md"]
+        assert sources("paid leave", f"path:{data / 'policies'}") == ["policies/leave.md", "policies/travel.txt"]
+        assert sources("paid leave", "ext:pdf", sparse=sparse) == []
+
+    # incremental runs append the attributes of new files and refresh those of touched ones
+    (data / "notes" / "retro.md").write_text("Retro notes: fewer meetings.")
+    os.utime(data / "notes" / "standup.md")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake", incremental=True,
+                tags={"policies/*": ["hr"]})
+    with open_chunk_store(tmp_path / "chunks") as store:
+        index = load_index(tmp_path / "faiss.index")
+        assert sources("meetings", "path:notes/ and ext:md") == ["notes/retro.md", "notes/standup.md"]
+        assert sources("portal", "mtime<2021-01-01") == []
+        chunk_files, files, live = store.file_attributes()
+        assert {f["rel"]: f["tags"] for f in files}["policies/travel.txt"] == ["hr"]
+
+    # also when nothing needs embedding
+    os.utime(data / "policies" / "travel.txt", (1_600_000_000, 1_600_000_000))
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake", incremental=True,
+                tags={"policies/*": ["hr"]})
+    with open_chunk_store(tmp_path / "chunks") as store:
+        assert sources("portal", "mtime<2021-01-01", sparse=sparse) == ["policies/travel.txt"]
+
+
+def test_sharded_filtered_search_matches_single_index(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    _corpus(data)
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+    shards.build_shards(data, tmp_path / "shards", "fake", 2)
+    where = "ext:txt or mtime<2021-01-01"
+    with open_chunk_store(tmp_path / "chunks") as store:
+        expected = search(fake_encoder, load_index(tmp_path / "faiss.index"), store, ["portal"], 5, where=where)
+        expected = [(r["source"], round(r["distance"], 5)) for r in expected[0]]
+    index = load_index(tmp_path / "shards", shard_workers="process")
+    try:
+        with open_chunk_store(tmp_path / "shards") as store:
+            assert filter_index(store) is filter_index(store)
+            rows = search(fake_encoder, index, store, ["portal"], 5, where=where)[0]
+            assert [(r["source"], round(r["distance"], 5)) for r in rows] == expected
+    finally:
+        index.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from src import chunk_store, guardrail
+from src.guardrail import compile_keywords, has_evidence, is_sensitive, sensitive_refusal
+
+
+def test_matcher_uses_word_boundaries():
+    for text in ("Is this LEGAL advice?", "new laws", "see a doctor", "Policy  guidance", "clinics"):
+        assert is_sensitive(text), text
+    for text in ("a flaw in the lawn", "clinical trials", "courtesy", "doctoral thesis", ""):
+        assert not is_sensitive(text), text
+    pattern = compile_keywords(["tax", "tax law", "  "])
+    assert pattern.search("the tax\tlaw") and not pattern.search("taxes")
+
+
+def test_refusal_reads_flags_before_text():
+    assert sensitive_refusal("What is our leave policy?", [{"text": "Travel booking portal."}]).startswith("REFUSAL:")
+    assert sensitive_refusal("What is our leave policy?", [{"text": "The leave policy grants 20 days."}]) is None
+    # an ingest-time flag is trusted over the text
+    assert sensitive_refusal("What is our leave policy?", [{"text": "", "sensitive": True}]) is None
+    assert not has_evidence([{"text": "The court ruled.", "sensitive": False}])
+    assert sensitive_refusal("How do I book travel?", []) is None
+    assert has_evidence(["Source: a.txt\nSee a doctor."])
+
+    report = guardrail.benchmark(queries=20)
+    assert set(report) == {"substring_us", "regex_text_us", "regex_flags_us"}
+    assert all(isinstance(us, float) and us > 0 for us in report.values())
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "leave.txt").write_text("Leave policy: employees get twenty days of paid leave.")
+    (data / "travel.txt").write_text("Travel: book flights through the portal.")
+    return data
+
+
+def test_ingest_records_flags_used_by_search(tmp_path, corpus, fake_encoder, monkeypatch):
+    pytest.importorskip("faiss")
+    from src import ingest, shards
+    from src.query import answer_question, load_index, search
+
+    ingest.main(corpus, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+    with chunk_store.open_chunk_store(tmp_path / "chunks") as store:
+        flags = {r["source"].rsplit("/", 1)[-1]: f for (i, r), f in zip(
+            store.iter_records(), store.sensitive_flags(range(len(store))))}
+        assert flags == {"leave.txt": guardrail.SENSITIVE, "travel.txt": guardrail.NOT_SENSITIVE}
+        assert store.sensitive_flags([-1, len(store)]).tolist() == [guardrail.UNKNOWN] * 2
+
+        index = load_index(tmp_path / "faiss.index")
+        rows = search(fake_encoder, index, store, ["leave policy"], 2)[0]
+        assert {r["source"].rsplit("/", 1)[-1]: r["sensitive"] for r in rows} == {"leave.txt": True, "travel.txt": False}
+        travel = search(fake_encoder, index, store, ["flights portal"], 1)[0]
+        assert answer_question(None, "What is the flight policy?", travel).startswith("REFUSAL:")
+
+    # incremental runs append flags; the new file is flagged from its text
+    (corpus / "court.txt").write_text("The court ruling on remote work.")
+    ingest.main(corpus, tmp_path / "faiss.index", tmp_path / "chunks", "fake", incremental=True)
+    with chunk_store.open_chunk_store(tmp_path / "chunks") as store:
+        assert int(store.sensitive_flags([len(store) - 1])[0]) == guardrail.SENSITIVE
+
+    # flags written for another keyword list are ignored; the text is matched instead
+    with monkeypatch.context() as m:
+        m.setattr(chunk_store, "SENSITIVE_FILE", "sensitive-other.bin")
+        with chunk_store.open_chunk_store(tmp_path / "chunks") as store:
+            rows = search(fake_encoder, load_index(tmp_path / "faiss.index"), store, ["leave policy"], 1)[0]
+            assert "sensitive" not in rows[0]
+            assert sensitive_refusal("Leave policy?", rows) is None
+
+    shards.build_shards(corpus, tmp_path / "shards", "fake", 2)
+    with chunk_store.open_chunk_store(tmp_path / "shards") as store:
+        ids = np.arange(len(store))
+        flags = store.sensitive_flags(ids)
+        expected = [int(guardrail.is_sensitive(store[i]["text"])) if store[i] else guardrail.UNKNOWN for i in ids]
+        assert flags.tolist() == expected and guardrail.SENSITIVE in expected
@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from src import ingest
+from src.bm25 import BM25Index, bm25_path
+from src.chunk_store import open_chunk_store
+
+
+def _search_all(index_path, meta_path, encoder, query, k=10):
+    index = faiss.read_index(str(index_path))
+    D, I = index.search(encoder.encode([query]), k)
+    with open_chunk_store(meta_path) as store:
+        return [(m["source"], m["chunk_index"], m["text"]) for m in store.get(I[0]) if m is not None]
+
+
+def _write_corpus(data_dir):
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("Grounding reduces hallucinations. " * 50)
+    (data_dir / "b.md").write_text("Citations improve trust in answers. " * 10)
+    (data_dir / "c.txt").write_text("Vector search finds nearest neighbours.")
+
+
+def test_incremental_matches_full_rebuild(tmp_path, fake_encoder, monkeypatch):
+    data = tmp_path / "data"
+    _write_corpus(data)
+    inc = tmp_path / "inc"
+    ingest.main(data, inc / "faiss.index", inc / "chunks", "fake", incremental=True)
+
+    (data / "b.md").write_text("Citations were rewritten entirely.")
+    (data / "c.txt").unlink()
+    (data / "d.txt").write_text("A brand new document about rerankers.")
+    fake_encoder.calls.clear()
+    with monkeypatch.context() as m:
+        m.setattr(BM25Index, "from_store", None)  # the BM25 index is updated, not rebuilt
+        ingest.main(data, inc / "faiss.index", inc / "chunks", "fake", incremental=True)
+
+    # only the modified and the new file are re-embedded
+    embedded = [t for call in fake_encoder.calls for t in call]
+    assert sorted(embedded) == ["A brand new document about rerankers.", "Citations were rewritten entirely."]
+
+    full = tmp_path / "full"
+    ingest.main(data, full / "faiss.index", full / "chunks", "fake")
+
+    assert faiss.read_index(str(inc / "faiss.index")).ntotal == faiss.read_index(str(full / "faiss.index")).ntotal
+    for q in ["hallucinations", "citations", "rerankers", "neighbours"]:
+        assert sorted(_search_all(inc / "faiss.index", inc / "chunks", fake_encoder, q)) == \
+            sorted(_search_all(full / "faiss.index", full / "chunks", fake_encoder, q))
+
+    # the updated BM25 index equals a rebuild
+    updated = BM25Index.load(bm25_path(inc / "faiss.index"))
+    with open_chunk_store(inc / "chunks") as store:
+        rebuilt = BM25Index.from_store(store)
+    for name in ("terms", "indptr", "doc_ids", "tfs", "doc_len"):
+        np.testing.assert_array_equal(getattr(updated, name), getattr(rebuilt, name))
+    np.testing.assert_allclose(updated.impacts, rebuilt.impacts, rtol=1e-6)
+
+
+def test_touch_without_content_change_skips_embedding(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    _write_corpus(data)
+    out = tmp_path / "out"
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True)
+
+    st = (data / "a.txt").stat()
+    os.utime(data / "a.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    fake_encoder.calls.clear()
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True)
+
+    assert fake_encoder.calls == []
+    manifest = ingest.load_manifest(out / "manifest.json")
+    assert manifest["files"][str(data / "a.txt")]["mtime"] == st.st_mtime_ns + 10 ** 9
+
+
+def test_changed_chunking_forces_full_rebuild(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    _write_corpus(data)
+    out = tmp_path / "out"
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True)
+
+    fake_encoder.calls.clear()
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", incremental=True, chunker="chars", chunk_size=300, overlap=50)
+
+    embedded = [t for call in fake_encoder.calls for t in call]
+    assert embedded and max(len(t) for t in embedded) <= 300
+    with open_chunk_store(out / "chunks") as store:
+        canonical = [i for i, _ in store.iter_records() if store.canonical_of(i) == i]
+        assert faiss.read_index(str(out / "faiss.index")).ntotal == len(canonical) == len(embedded)
+
+
+def test_failed_rebuild_keeps_previous_store(tmp_path, fake_encoder, monkeypatch):
+    data = tmp_path / "data"
+    _write_corpus(data)
+    out = tmp_path / "out"
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake")
+    before = _search_all(out / "faiss.index", out / "chunks", fake_encoder, "citations")
+
+    def broken_encoder(*args):
+        raise OSError("model download failed")
+
+    monkeypatch.setattr(ingest, "load_encoder", broken_encoder)
+    (data / "d.txt").write_text("A brand new document about rerankers.")
+    for incremental in (False, True):
+        with pytest.raises(OSError, match="download failed"):
+            ingest.main(data, out / "faiss.index", out / "chunks", "fake-other", incremental=incremental)
+        assert _search_all(out / "faiss.index", out / "chunks", fake_encoder, "citations") == before
+    assert sorted(p.name for p in out.iterdir()) == ["chunks", "faiss.index", "faiss.index.bm25.npz", "faiss.index.json", "manifest.json"]
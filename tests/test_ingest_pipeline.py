@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from src import ingest
+from src.chunk_store import open_chunk_store
+
+
+def _corpus(data_dir):
+    data_dir.mkdir()
+    for n in range(6):
+        (data_dir / f"doc{n}.txt").write_text(f"Document {n} talks about topic {n}. " * (20 + 15 * n))
+    (data_dir / "empty.md").write_text("   ")
+
+
+def _load(out):
+    index = faiss.read_index(str(out / "faiss.index"))
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    ids = faiss.vector_to_array(index.id_map)
+    with open_chunk_store(out / "chunks") as store:
+        metas = [store[i] for i in range(len(store))]
+        canonical = [i for i, _ in store.iter_records() if store.canonical_of(i) == i]
+    assert list(ids) == canonical  # duplicate chunks are stored but not embedded
+    return ids, vectors, metas
+
+
+def test_parallel_pipeline_matches_serial(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    _corpus(data)
+    serial = tmp_path / "serial"
+    parallel = tmp_path / "parallel"
+    ingest.main(data, serial / "faiss.index", serial / "chunks", "fake", workers=1, batch_size=10 ** 6)
+    ingest.main(data, parallel / "faiss.index", parallel / "chunks", "fake", workers=3, batch_size=7)
+
+    s_ids, s_vec, s_meta = _load(serial)
+    p_ids, p_vec, p_meta = _load(parallel)
+    assert s_meta == p_meta
+    assert list(s_ids) == list(p_ids) and len(s_ids) < len(s_meta)
+    np.testing.assert_allclose(s_vec, p_vec, atol=1e-6)
+    assert max(len(call) for call in fake_encoder.calls[1:]) <= 7
+
+
+def test_pipeline_propagates_writer_errors(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    _corpus(data)
+
+    class BrokenIndex:
+        def add_with_ids(self, *args):
+            raise ValueError("disk full")
+
+    to_embed = [(f, f.stat(), None) for f in sorted(data.iterdir())]
+    with pytest.raises(ValueError, match="disk full"):
+        ingest.run_pipeline(to_embed, fake_encoder, BrokenIndex(), None, {}, 0, workers=2, batch_size=3)
+
+
+def test_large_files_are_chunked_lazily_with_same_result(tmp_path, fake_encoder, monkeypatch):
+    data = tmp_path / "data"
+    _corpus(data)
+    pooled = tmp_path / "pooled"
+    ingest.main(data, pooled / "faiss.index", pooled / "chunks", "fake", workers=2, chunk_tokens=40)
+    monkeypatch.setattr(ingest, "LAZY_PARSE_BYTES", 1000)
+    lazy = tmp_path / "lazy"
+    ingest.main(data, lazy / "faiss.index", lazy / "chunks", "fake", workers=2, chunk_tokens=40)
+
+    p_ids, p_vec, p_meta = _load(pooled)
+    l_ids, l_vec, l_meta = _load(lazy)
+    assert p_meta == l_meta and len(p_meta) > 6
+    np.testing.assert_allclose(p_vec, l_vec, atol=1e-6)
+
+
+def test_unreadable_files_are_skipped_with_one_worker(tmp_path, fake_encoder, monkeypatch):
+    data = tmp_path / "data"
+    _corpus(data)
+    (data / "doc3_copy.txt").write_text((data / "doc3.txt").read_text())
+    clean = tmp_path / "clean"
+    ingest.main(data, clean / "faiss.index", clean / "chunks", "fake", workers=1, chunk_tokens=40)
+    (data / "bad.pdf").write_bytes(b"%PDF-1.4 truncated")
+    real_blocks = ingest.iter_file_blocks
+
+    def failing_blocks(path):
+        if path.name != "doc3.txt":
+            yield from real_blocks(path)
+            return
+        # doc3.txt breaks half-way, once chunks of it are queued
+        text = "".join(real_blocks(path))
+        yield text[: len(text) // 2]
+        raise OSError("read error")
+
+    def texts(out):
+        by_source = {}
+        for m in _load(out)[2]:
+            if m is not None:
+                by_source.setdefault(m["source"].rsplit("/", 1)[-1], []).append(m["text"])
+        return by_source
+
+    monkeypatch.setattr(ingest, "iter_file_blocks", failing_blocks)
+    out = tmp_path / "out"
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", workers=1, chunk_tokens=40, batch_size=4)
+
+    expected = texts(clean)
+    # the copy with doc3's content is stored from its own, complete text
+    assert texts(out) == {name: t for name, t in expected.items() if name != "doc3.txt"}
+    with open_chunk_store(out / "chunks") as store:
+        assert len(store) > len(list(store.iter_records()))  # doc3's queued chunks were removed
+    manifest = ingest.load_manifest(out / "manifest.json")
+    assert "bad.pdf" not in str(list(manifest["files"])) and "doc3.txt" not in str(list(manifest["files"]))
+
+    # the skipped file is picked up again once it reads
+    monkeypatch.setattr(ingest, "iter_file_blocks", real_blocks)
+    (data / "doc3_copy.txt").unlink()
+    ingest.main(data, out / "faiss.index", out / "chunks", "fake", workers=1, chunk_tokens=40, incremental=True)
+    assert texts(out)["doc3.txt"] == expected["doc3.txt"]
@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("openai")
+
+from src.llm import LLMClient, make_fake_server
+from src.query import generate_grounded_response, stream_grounded_response
+
+
+@pytest.fixture
+def fake_server():
+    srv = make_fake_server(fail_times=1, token_delay_s=0.005)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv, f"http://127.0.0.1:{srv.server_address[1]}/v1"
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_streams_tokens_over_pooled_connections_with_bounded_concurrency(fake_server):
+    srv, base_url = fake_server
+    client = LLMClient(api_key="test", base_url=base_url, max_concurrency=2, base_delay=0.01)
+    try:
+        # the first request gets a 503 and is retried before any token is emitted
+        tokens = list(stream_grounded_response(client, "Source: a.txt\nGrounding helps.", "why?"))
+        assert tokens == ["Based ", "on ", "[a.txt]."]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            answers = list(pool.map(
+                lambda n: generate_grounded_response(client, f"Source: doc{n}.txt\ntext", "q"), range(8)
+            ))
+    finally:
+        client.close()
+
+    assert answers == [f"Based on [doc{n}.txt]." for n in range(8)]
+    assert srv.requests == 10
+    assert srv.max_inflight == 2
+    assert srv.connections <= 3  # the failed request's connection may be dropped
+
+
+def test_timeout_is_retried_then_raised(fake_server):
+    openai = pytest.importorskip("openai")
+    srv, base_url = fake_server
+    srv.fail_times, srv.latency_s = 0, 0.5
+    client = LLMClient(api_key="test", base_url=base_url, timeout=0.1, retries=1, base_delay=0.01)
+    try:
+        with pytest.raises(openai.APITimeoutError):
+            client.complete([{"role": "user", "content": "Source: a.txt"}])
+    finally:
+        client.close()
+    assert srv.requests == 2
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from src import metrics
+
+
+@pytest.fixture
+def registry():
+    metrics.REGISTRY.reset()
+    metrics.enable()
+    yield metrics.REGISTRY
+    metrics.enable(False)
+    metrics.REGISTRY.reset()
+
+
+def test_spans_are_noops_while_disabled():
+    assert not metrics.enabled()
+    assert metrics.span("encode") is metrics.span("search")
+    with metrics.span("encode"):
+        pass
+    metrics.inc("rag_queries_total")
+    assert metrics.REGISTRY.histogram(metrics.STAGE_HISTOGRAM, stage="encode") is None
+    assert metrics.REGISTRY.counter("rag_queries_total") == 0
+
+    with metrics.record_stages() as stages:
+        with metrics.span("encode"):
+            pass
+    assert list(stages) == ["encode"]  # recorded for the caller, still not exported
+    assert metrics.REGISTRY.histogram(metrics.STAGE_HISTOGRAM, stage="encode") is None
+
+
+def test_export_prometheus_and_json_lines(registry, tmp_path):
+    for _ in range(3):
+        with metrics.span("encode"):
+            pass
+    metrics.observe(metrics.STAGE_HISTOGRAM, 2.0, stage="llm")
+    metrics.inc("rag_queries_total", 2)
+
+    text = registry.to_prometheus()
+    assert "# TYPE rag_queries_total counter\nrag_queries_total 2\n" in text
+    assert 'rag_stage_seconds_bucket{stage="encode",le="+Inf"} 3' in text
+    assert 'rag_stage_seconds_bucket{stage="llm",le="1"} 0' in text
+    assert 'rag_stage_seconds_bucket{stage="llm",le="2.5"} 1' in text
+    assert 'rag_stage_seconds_count{stage="llm"} 1' in text
+
+    metrics.write(tmp_path / "metrics.jsonl")
+    metrics.write(tmp_path / "metrics.jsonl")
+    rows = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert len(rows) == 6  # appended, one row per series
+    llm = next(r for r in rows if r["labels"] == {"stage": "llm"})
+    assert llm["count"] == 1 and llm["sum"] == 2.0
+
+    metrics.write(tmp_path / "metrics.prom")
+    assert (tmp_path / "metrics.prom").read_text() == text
+
+
+def test_search_records_each_query_stage(registry, tmp_path, fake_encoder):
+    pytest.importorskip("faiss")
+    from src import ingest
+    from src.chunk_store import open_chunk_store
+    from src.query import load_index, load_sparse, search
+
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("Grounding reduces hallucinations.")
+    (data / "b.txt").write_text("Citations improve trust.")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake", workers=1)
+    for stage in ("list_files", "encode", "index_add", "store_write", "index_write", "bm25_build"):
+        assert registry.histogram(metrics.STAGE_HISTOGRAM, stage=stage).count >= 1, stage
+    assert registry.counter("rag_chunks_embedded_total") == 2
+
+    with open_chunk_store(tmp_path / "chunks") as store, metrics.record_stages() as stages:
+        search(fake_encoder, load_index(tmp_path / "faiss.index"), store, ["trust", "grounding"], 1,
+               sparse=load_sparse(tmp_path / "faiss.index"))
+    assert set(stages) == {"encode", "index_search", "sparse_search", "fusion"}
+    assert registry.counter("rag_queries_total") == 2
@@ -17,3 +17,39 @@ def test_format_refusal_basic():
 
 def test_system_prompt_contains_refusal_instruction():
     assert "REFUSAL:" in pt.SYSTEM_PROMPT
+
+
+def _words(text):
+    return len(text.split())
+
+
+def test_pack_context_merges_overlapping_chunks_of_a_document():
+    doc = "Alpha beta gamma. Delta epsilon zeta. Eta theta iota."
+    b = doc.encode()
+    results = [
+        {"source": "a.txt", "doc": 0, "chunk_index": 1, "start": 18, "end": len(b), "text": doc[18:]},
+        {"source": "b.txt", "text": "Unrelated but relevant note."},
+        {"source": "a.txt", "doc": 0, "chunk_index": 0, "start": 0, "end": 37, "text": doc[:37]},
+        {"source": "c.txt", "text": None},
+        {"source": "b.txt", "text": "Unrelated but relevant note."},
+    ]
+    packed = pt.pack_context(results, max_tokens=100, count_tokens=_words)
+    assert packed.excerpts == [f"Source: a.txt\n{doc}", "Source: b.txt\nUnrelated but relevant note."]
+    assert packed.text == pt.CONTEXT_SEPARATOR.join(packed.excerpts)
+    assert packed.tokens == _words(packed.text)
+    assert packed.used == [0, 1, 2, 4]
+
+
+def test_pack_context_fills_budget_by_relevance_per_token():
+    long_text = " ".join(["filler"] * 40)
+    results = [
+        {"source": "long.txt", "text": long_text},
+        {"source": "short1.txt", "text": "short answer one"},
+        {"source": "short2.txt", "text": "short answer two"},
+    ]
+    packed = pt.pack_context(results, max_tokens=20, count_tokens=_words)
+    assert packed.used == [1, 2]
+    assert packed.tokens <= 20
+    assert pt.pack_context(results, max_tokens=1, count_tokens=_words).text == ""
+    everything = pt.pack_context(results, max_tokens=1000)
+    assert everything.used == [0, 1, 2] and everything.excerpts[0].startswith("Source: long.txt")
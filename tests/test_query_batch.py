@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from src import ingest
+from src.chunk_store import open_chunk_store
+from src.llm import FakeChatClient, call_with_retry
+from src.query import load_index, run_batch
+
+
+def test_run_batch_streams_ordered_results_with_answers(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "ground.txt").write_text("Grounding answers in retrieved documents reduces hallucinations.")
+    (data / "cite.txt").write_text("Citations and source attribution improve trust.")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+
+    questions = ["reduce hallucinations", "source attribution", "Is this legal advice?"] * 3
+    batch_file = tmp_path / "in.jsonl"
+    batch_file.write_text("\n".join(json.dumps({"id": f"q{i}", "question": q}) for i, q in enumerate(questions)) + "\n")
+    out = tmp_path / "results.jsonl"
+    client = FakeChatClient(fail_times=2)
+
+    fake_encoder.calls.clear()
+    with open_chunk_store(tmp_path / "chunks") as store:
+        n = run_batch(
+            fake_encoder, load_index(tmp_path / "faiss.index"), store, batch_file, out, 1,
+            batch_size=4, client=client, concurrency=3, retries=3,
+        )
+
+    rows = [json.loads(line) for line in out.read_text().splitlines()]
+    assert n == len(rows) == len(questions)
+    assert [r["id"] for r in rows] == [f"q{i}" for i in range(len(questions))]
+    assert [len(c) for c in fake_encoder.calls] == [4, 4, 1]
+    for row in rows:
+        assert 0 < row["context_tokens"] <= 3000
+        if "legal" in row["question"]:
+            assert row["answer"].startswith("REFUSAL:")
+        else:
+            assert row["answer"] == f"Based on [{row['results'][0]['source']}]."
+
+
+def test_call_with_retry_gives_up_after_retries():
+    delays = []
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        call_with_retry(flaky, retries=2, base_delay=1.0, sleep=delays.append)
+    assert len(calls) == 3
+    assert len(delays) == 2 and 0 <= delays[0] <= 1.0 and 0 <= delays[1] <= 2.0
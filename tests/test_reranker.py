@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from src import ingest
+from src.chunk_store import open_chunk_store
+from src.query import load_index, search
+from src.reranker import Reranker
+
+DOCS = {
+    "rrf.txt": "Reciprocal rank fusion merges rankings.",
+    "bm25.txt": "BM25 scores terms; rank fusion needs BM25 and dense rankings.",
+    "hnsw.txt": "HNSW graphs answer nearest neighbour queries.",
+    "pq.txt": "Product quantization compresses vectors.",
+}
+
+
+class WordOverlapCrossEncoder:
+    """Scores (query, text) pairs by shared words; records batch sizes."""
+
+    def __init__(self, delay_s: float = 0.0):
+        self.batches = []
+        self.delay_s = delay_s
+
+    def predict(self, pairs, batch_size=32, **kwargs):
+        self.batches.append(len(pairs))
+        time.sleep(self.delay_s)
+        return np.array([len(set(q.lower().split()) & set(t.lower().split())) for q, t in pairs], dtype="float32")
+
+
+@pytest.fixture
+def corpus(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    data.mkdir()
+    for name, text in DOCS.items():
+        (data / name).write_text(text)
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+    with open_chunk_store(tmp_path / "chunks") as store:
+        yield fake_encoder, load_index(tmp_path / "faiss.index"), store
+
+
+def test_rerank_reorders_candidates_in_batches_and_caches_scores(corpus):
+    encoder, index, store = corpus
+    queries = ["needs bm25 and dense rankings", "nearest neighbour queries"]
+    model = WordOverlapCrossEncoder()
+    reranker = Reranker(model, candidates=4, batch_size=3)
+
+    results = search(encoder, index, store, queries, 2, sparse=None, reranker=reranker)
+    assert [len(rows) for rows in results] == [2, 2]
+    assert results[0][0]["source"].endswith("bm25.txt") and results[1][0]["source"].endswith("hnsw.txt")
+    assert all(rows[0]["rerank_score"] >= rows[1]["rerank_score"] for rows in results)
+    assert model.batches == [3, 3, 2]  # 8 pairs across both queries
+
+    timings = {}
+    again = search(encoder, index, store, queries, 2, reranker=reranker, timings=timings)
+    assert model.batches == [3, 3, 2]  # served from the score cache
+    assert [r["id"] for r in again[0]] == [r["id"] for r in results[0]] and "rerank_ms" in timings
+
+
+def test_budget_overrun_falls_back_to_retriever_order(corpus):
+    encoder, index, store = corpus
+    query = ["needs bm25 and dense rankings"]
+    dense = search(encoder, index, store, query, 2)
+    reranker = Reranker(WordOverlapCrossEncoder(delay_s=0.05), candidates=4, batch_size=2, budget_ms=10)
+
+    fallback = search(encoder, index, store, query, 2, reranker=reranker)
+    assert [r["id"] for r in fallback[0]] == [r["id"] for r in dense[0]]
+    assert "rerank_score" not in fallback[0][0] and reranker.fallbacks == 1
+    assert len(reranker.cache) == 2  # the batch that ran is cached for the next call
@@ -0,0 +1,118 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from src import ingest, metrics
+from src.answer_cache import AnswerCache
+from src.chunk_store import open_chunk_store
+from src.query import load_index
+from src.server import QueryService, make_server
+from scripts.load_test import run_load
+
+
+class StubChatClient:
+    """Local replacement for `OpenAI(...)`: echoes the first context line."""
+
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, **kwargs):
+        user = messages[-1]["content"]
+        first_source = next(line for line in user.splitlines() if line.startswith("Source:"))
+        message = type("Message", (), {"content": f"stub answer from {first_source}"})
+        choice = type("Choice", (), {"message": message})
+        return type("Response", (), {"choices": [choice]})
+
+
+@pytest.fixture
+def server(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "ground.txt").write_text("Grounding answers in retrieved documents reduces hallucinations.")
+    (data / "cite.txt").write_text("Citations and source attribution improve trust.")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+
+    store = open_chunk_store(tmp_path / "chunks")
+    service = QueryService(
+        fake_encoder, load_index(tmp_path / "faiss.index"), store, StubChatClient(), max_wait_ms=50,
+        answer_cache=AnswerCache(index_path=tmp_path / "faiss.index"),
+    )
+    srv = make_server(service, port=0)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}", service
+    srv.shutdown()
+    srv.server_close()
+    store.close()
+
+
+def _post(url, payload):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def test_search_micro_batches_concurrent_queries(server, fake_encoder):
+    url, service = server
+    queries = ["reduce hallucinations", "source attribution"] * 8
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(lambda q: _post(url + "/search", {"query": q, "top_k": 1}), queries))
+
+    tops = [r["results"][0]["source"].rsplit("/", 1)[-1] for r in responses]
+    assert tops == ["ground.txt", "cite.txt"] * 8
+    assert service.batcher.batches < len(queries)
+    assert max(len(call) for call in fake_encoder.calls) > 1
+
+
+def test_search_filter_is_applied_per_request(server):
+    url, _ = server
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        filtered, unfiltered = pool.map(
+            lambda where: _post(url + "/search", {"query": "reduce hallucinations", "top_k": 2, "filter": where}),
+            ["path:cite", None],
+        )
+    assert [r["source"].rsplit("/", 1)[-1] for r in filtered["results"]] == ["cite.txt"]
+    assert len(unfiltered["results"]) == 2
+
+    with pytest.raises(urllib.error.HTTPError) as err:
+        _post(url + "/search", {"query": "trust", "filter": "size>3"})
+    assert err.value.code == 400
+
+
+def test_answer_uses_llm_client_and_refusal(server):
+    url, _ = server
+    resp = _post(url + "/answer", {"query": "reduce hallucinations", "top_k": 2})
+    assert resp["answer"].startswith("stub answer from Source:")
+    assert len(resp["results"]) == 2 and resp["context_tokens"] > 0 and not resp["cached"]
+    again = _post(url + "/answer", {"query": "Reduce  hallucinations", "top_k": 2})
+    assert again["cached"] and again["answer"] == resp["answer"]
+
+    refused = _post(url + "/answer", {"query": "Can you give me legal advice?", "top_k": 2})
+    assert refused["answer"].startswith("REFUSAL:")
+
+
+def test_metrics_endpoint_exports_stage_histograms(server, monkeypatch):
+    url, _ = server
+    monkeypatch.setattr(metrics, "_enabled", True)
+    monkeypatch.setattr(metrics, "REGISTRY", metrics.Registry())
+    _post(url + "/search", {"query": "reduce hallucinations", "top_k": 1})
+    with urllib.request.urlopen(url + "/metrics", timeout=10) as resp:
+        text = resp.read().decode()
+    assert resp.headers["Content-Type"].startswith("text/plain")
+    assert 'rag_stage_seconds_count{stage="encode"} 1' in text
+    assert 'rag_request_seconds_count{endpoint="/search"} 1' in text
+
+
+def test_load_test_reports_latency_percentiles(server):
+    url, _ = server
+    report = run_load(url + "/search", ["hallucinations", "citations"], concurrency=4, total=40)
+    assert report["errors"] == 0
+    assert report["p50_ms"] <= report["p99_ms"]
+    assert report["qps"] > 0
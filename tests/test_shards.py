@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from src import ingest, shards
+from src.chunk_store import open_chunk_store
+from src.query import load_index, load_sparse, search
+
+TOPICS = [
+    "rerankers", "quantization", "sharding", "caching", "tokenizers", "embeddings", "guardrails",
+    "streaming", "batching", "retries", "manifests", "benchmarks", "chunking", "fusion",
+]
+QUERIES = ["how does sharding work", "embeddings and tokenizers", "retries with backoff", "benchmarks"]
+
+
+def _corpus(data):
+    data.mkdir()
+    (data / "sub").mkdir()
+    for n, topic in enumerate(TOPICS):
+        folder = data / "sub" if n % 3 == 0 else data
+        (folder / f"{topic}.txt").write_text(f"Notes on {topic}. Item {n} explains {topic} in detail number {n * 13}.")
+
+
+def _rows(encoder, index, store):
+    results = search(encoder, index, store, QUERIES, 5)
+    return [[(r["text"], round(r["distance"], 5)) for r in rows] for rows in results]
+
+
+def test_merge_topk_and_shard_assignment():
+    D, I = shards.merge_topk([(np.array([0.1, 0.5]), np.array([3, 6])), (np.array([0.2, 0.3]), np.array([1, -1]))], 3)
+    assert I.tolist() == [3, 1, 6] and D.tolist() == pytest.approx([0.1, 0.2, 0.5])
+    S, I = shards.merge_topk([(np.array([9.0]), np.array([4])), (np.array([7.0, 1.0]), np.array([2, 5]))], 4,
+                             descending=True)
+    assert I.tolist() == [4, 2, 5, -1]
+    assert shards.shard_of("sub/a.txt", 4) == shards.shard_of("sub/a.txt", 4)
+    assert len({shards.shard_of(f"{t}.txt", 3) for t in TOPICS}) == 3
+
+
+@pytest.mark.parametrize("mode", shards.WORKER_MODES)
+def test_sharded_search_matches_single_index(tmp_path, fake_encoder, mode):
+    data = tmp_path / "data"
+    _corpus(data)
+    ingest.main(data, tmp_path / "single" / "faiss.index", tmp_path / "single" / "chunks", "fake")
+    layout = shards.build_shards(data, tmp_path / "shards", "fake", 3)
+    assert layout["num_shards"] == 3
+
+    with open_chunk_store(tmp_path / "single" / "chunks") as store:
+        expected = _rows(fake_encoder, load_index(tmp_path / "single" / "faiss.index"), store)
+    index = load_index(tmp_path / "shards", shard_workers=mode)
+    try:
+        with open_chunk_store(tmp_path / "shards") as store:
+            assert isinstance(store, shards.ShardedStore)
+            assert _rows(fake_encoder, index, store) == expected
+            hybrid = search(fake_encoder, index, store, ["sharding"], 3, sparse=load_sparse(tmp_path / "shards"))
+            assert "sharding" in hybrid[0][0]["text"]
+    finally:
+        index.close()
+
+
+def test_single_shard_rebuild_leaves_other_shards_alone(tmp_path, fake_encoder):
+    data = tmp_path / "data"
+    _corpus(data)
+    root = tmp_path / "shards"
+    shards.build_shards(data, root, "fake", 3, incremental=True)
+
+    target = data / "fusion.txt"
+    shard = shards.shard_of("fusion.txt", 3)
+    target.write_text("Notes on fusion. Reciprocal rank fusion merges sharding results too.")
+    before = {s: shards.shard_paths(root, s)[0].stat().st_mtime_ns for s in range(3) if s != shard}
+    fake_encoder.calls.clear()
+    shards.build_shards(data, root, "fake", only=[shard], incremental=True)
+
+    assert [t for call in fake_encoder.calls for t in call] == [target.read_text()]
+    assert {s: shards.shard_paths(root, s)[0].stat().st_mtime_ns for s in before} == before
+    ingest.main(data, tmp_path / "single" / "faiss.index", tmp_path / "single" / "chunks", "fake")
+    with open_chunk_store(tmp_path / "single" / "chunks") as store:
+        expected = _rows(fake_encoder, load_index(tmp_path / "single" / "faiss.index"), store)
+    with open_chunk_store(root) as store:
+        assert _rows(fake_encoder, load_index(root, shard_workers="inline"), store) == expected
+    with pytest.raises(ValueError):
+        shards.build_shards(data, root, "fake", 4, only=[0])
@@ -0,0 +1,96 @@
+import pytest
+
+pytest.importorskip("faiss")
+testing = pytest.importorskip("streamlit.testing.v1")
+
+from src import ingest
+from tests.conftest import FakeEncoder, ROOT
+
+
+def test_search_reuses_cached_model_and_artifacts(tmp_path, fake_encoder, monkeypatch):
+    import sentence_transformers
+
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("Grounding reduces hallucinations.")
+    (data / "b.txt").write_text("Citations improve trust.")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+
+    loads = []
+
+    def fake_model(name):
+        loads.append(name)
+        return FakeEncoder(name)
+
+    monkeypatch.setattr(sentence_transformers, "SentenceTransformer", fake_model)
+    monkeypatch.chdir(ROOT)
+
+    at = testing.AppTest.from_file(str(ROOT / "streamlit_app.py"), default_timeout=60)
+    at.run()
+    # widgets are ordered by layout: the question column comes first
+    at.text_input[0].set_value("hallucinations")
+    at.text_input[1].set_value(str(tmp_path / "faiss.index"))
+    at.text_input[2].set_value(str(tmp_path / "chunks"))
+    at.text_input[3].set_value("fake-model")
+    at.button[0].click().run()
+    assert not at.exception
+    assert "a.txt" in at.markdown[0].value
+    at.button[0].click().run()
+
+    assert loads == ["fake-model"]
+    assert [m.label for m in at.metric] == ["Load model/index", "Search", "Dense", "BM25", "Fusion"]
+    assert {"encode", "index_search", "fusion"} <= set(at.sidebar.table[0].value["stage"])
+
+    at.selectbox[0].select("Dense only")
+    at.button[0].click().run()
+    assert [m.label for m in at.metric] == ["Load model/index", "Search", "Dense"]
+
+    at.sidebar.text_input[0].set_value("b.")  # path prefix
+    at.button[0].click().run()
+    assert ["b.txt" in m.value for m in at.markdown] == [True]
+    at.sidebar.text_input[3].set_value("ext:md or")
+    at.button[0].click().run()
+    assert at.error and "Invalid filter" in at.error[0].value
+
+
+def test_grounded_answer_streams_from_openai_compatible_server(tmp_path, fake_encoder, monkeypatch):
+    import threading
+
+    import sentence_transformers
+    from src.llm import make_fake_server
+
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("Grounding reduces hallucinations.")
+    ingest.main(data, tmp_path / "faiss.index", tmp_path / "chunks", "fake")
+
+    srv = make_fake_server()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{srv.server_address[1]}/v1")
+    monkeypatch.setattr(sentence_transformers, "SentenceTransformer", FakeEncoder)
+    monkeypatch.chdir(ROOT)
+    try:
+        at = testing.AppTest.from_file(str(ROOT / "streamlit_app.py"), default_timeout=60)
+        at.run()
+        at.text_input[0].set_value("hallucinations")
+        at.text_input[1].set_value(str(tmp_path / "faiss.index"))
+        at.text_input[2].set_value(str(tmp_path / "chunks"))
+        at.checkbox[0].check()
+        at.button[0].click().run()
+        first_answer = [m.value for m in at.markdown]
+        at.text_input[0].set_value("Hallucinations ")
+        at.button[0].click().run()
+        cached_captions = [c.value for c in at.caption]
+        at.text_input[0].set_value("Is this legal advice?")
+        at.button[0].click().run()
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+    assert not at.exception and not at.error
+    assert f"Based on [{data / 'a.txt'}]." in first_answer
+    assert srv.requests == 1  # the repeated question is answered from the answer cache
+    assert "Served from the answer cache" in cached_captions
+    # the guardrail refuses without calling the LLM
+    assert any(m.value.startswith("REFUSAL:") for m in at.markdown)